@@ -0,0 +1,100 @@
+"""
+Benchmark of deleting bucket-lists with many tasks
+
+Seeds bucket-lists holding an increasing number of tasks and deletes
+each one through DELETE /bucketlists/<id>, counting the SQL statements
+the request sends and timing it. Tasks go through ON DELETE CASCADE, so
+the statement count stays the same whatever the number of tasks.
+
+Usage:
+    python benchmarks/cascade_delete.py [--tasks N [N ...]]
+
+Runs against TEST_DATABASE_URL, or a throwaway SQLite file if unset.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from base64 import b64encode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TEST_DATABASE_URL', 'sqlite:///' + os.path.join(
+    tempfile.mkdtemp(), 'bench.sqlite'))
+
+from sqlalchemy import event  # noqa: E402
+
+from bucky_api import create_app, db  # noqa: E402
+from bucky_api.models import BucketList, Task, User  # noqa: E402
+
+ENDPOINT = '/api/v1.0/bucketlists/'
+
+
+def auth_headers(username, password=''):
+    credentials = '{}:{}'.format(username, password).encode('utf-8')
+    return {'Authorization': 'Basic ' + b64encode(credentials).decode('utf-8')}
+
+
+def seed_bucketlist(user_id, name, tasks):
+    """Insert a bucket-list with tasks using Core executemany"""
+    bucket_id = db.session.execute(BucketList.__table__.insert().values(
+        name=name, user_id=user_id, task_count=tasks)).inserted_primary_key[0]
+    db.session.execute(Task.__table__.insert(), [
+        {'description': 'task {}'.format(i), 'user_id': user_id,
+         'bucketlist_id': bucket_id} for i in range(tasks)])
+    User.query.filter_by(id=user_id).update(
+        {User.bucketlist_count: User.bucketlist_count + 1})
+    db.session.commit()
+    return bucket_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--tasks', type=int, nargs='+',
+                        default=[10, 1000, 10000, 100000])
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        try:
+            client = app.test_client()
+            client.post('/api/v1.0/auth/users/',
+                        data=json.dumps({'username': 'bench',
+                                         'password': 'bench'}),
+                        content_type='application/json')
+            response = client.get('/api/v1.0/auth/get_token/',
+                                  headers=auth_headers('bench', 'bench'))
+            headers = auth_headers(
+                json.loads(response.data.decode('utf-8'))['token'])
+            user_id = User.query.filter_by(username='bench').one().id
+
+            engine = db.get_engine(app)
+            print('{:>10} {:>12} {:>12}'.format('tasks', 'statements', 'ms'))
+            for tasks in args.tasks:
+                bucket_id = seed_bucketlist(user_id, 'bench {}'.format(tasks),
+                                            tasks)
+                del statements[:]
+                event.listen(engine, 'before_cursor_execute', record)
+                start = time.perf_counter()
+                response = client.delete(ENDPOINT + str(bucket_id),
+                                         headers=headers)
+                elapsed = time.perf_counter() - start
+                event.remove(engine, 'before_cursor_execute', record)
+                assert response.status_code == 200, response.data
+                assert Task.query.filter_by(bucketlist_id=bucket_id).count() == 0
+                print('{:>10} {:>12} {:>12.1f}'.format(
+                    tasks, len(statements), elapsed * 1000))
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Query plans of every endpoint against a seeded database
+
+Seeds users with bucket-lists and tasks, calls each endpoint through the
+test client while recording the SQL it sends, and prints the plan of
+every recorded SELECT, UPDATE and DELETE (EXPLAIN QUERY PLAN on SQLite,
+EXPLAIN on PostgreSQL). Plans that scan a whole bucketlists, tasks or
+users table are flagged and make the script exit with status 1, so it
+can guard against index regressions.
+
+Usage:
+    python benchmarks/explain_queries.py [--users N] [--bucketlists N]
+                                         [--tasks N] [--quiet]
+
+Runs against TEST_DATABASE_URL, or a throwaway SQLite file if unset.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+from base64 import b64encode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TEST_DATABASE_URL', 'sqlite:///' + os.path.join(
+    tempfile.mkdtemp(), 'bench.sqlite'))
+
+from sqlalchemy import event  # noqa: E402
+
+from bucky_api import create_app, db  # noqa: E402
+from bucky_api.models import BucketList, Task, User  # noqa: E402
+
+API = '/api/v1.0'
+
+# full scans of the application tables, per dialect
+FULL_SCAN = {
+    'sqlite': re.compile(r'\bSCAN (TABLE )?(bucketlists|tasks|users)\b'
+                         r'(?! USING)'),
+    'postgresql': re.compile(r'Seq Scan on (bucketlists|tasks|users)\b'),
+}
+EXPLAIN = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN '}
+
+
+def auth_headers(username, password=''):
+    credentials = '{}:{}'.format(username, password).encode('utf-8')
+    return {'Authorization': 'Basic ' + b64encode(credentials).decode('utf-8'),
+            'Content-Type': 'application/json'}
+
+
+def seed(users, bucketlists, tasks):
+    """Insert users each having bucket-lists of tasks with Core inserts"""
+    password_hashed = User(password='bench').password_hashed
+    for u in range(users):
+        user_id = db.session.execute(User.__table__.insert().values(
+            username='user{}'.format(u), password_hashed=password_hashed,
+            bucketlist_count=bucketlists)).inserted_primary_key[0]
+        db.session.execute(BucketList.__table__.insert(), [
+            {'name': 'bucket {} of {}'.format(b, u), 'user_id': user_id,
+             'task_count': tasks} for b in range(bucketlists)])
+        bucket_ids = [b.id for b in BucketList.query.filter_by(
+            user_id=user_id)]
+        db.session.execute(Task.__table__.insert(), [
+            {'description': 'task {}'.format(t), 'user_id': user_id,
+             'bucketlist_id': bucket_id}
+            for bucket_id in bucket_ids for t in range(tasks)])
+    db.session.commit()
+    db.session.execute('ANALYZE')
+    db.session.commit()
+
+
+def endpoints(bucket_id):
+    """(name, method, path, body) of the calls to explain, in order"""
+    bucket = '{}/bucketlists/{}'.format(API, bucket_id)
+    return [
+        ('list bucket-lists', 'get', API + '/bucketlists/', None),
+        ('list bucket-lists, later page', 'get',
+         API + '/bucketlists/?page=3', None),
+        ('list bucket-lists by cursor', 'get',
+         API + '/bucketlists/?cursor=', None),
+        ('list bucket-list names', 'get',
+         API + '/bucketlists/?fields=id,name', None),
+        ('search bucket-lists', 'get', API + '/bucketlists/search/bucket 1',
+         None),
+        ('get bucket-list', 'get', bucket, None),
+        ('list tasks', 'get', bucket + '/tasks/', None),
+        ('list tasks, newest first', 'get', bucket + '/tasks/?sort=-id', None),
+        ('filter tasks', 'get', bucket + '/tasks/?q=task 1', None),
+        ('create bucket-list', 'post', API + '/bucketlists/',
+         {'name': 'explained'}),
+        ('rename bucket-list', 'patch', bucket, {'name': 'renamed'}),
+        ('create task', 'post', bucket + '/tasks/', {'description': 'new'}),
+        ('create tasks', 'post', bucket + '/tasks/',
+         [{'description': 'bulk 1'}, {'description': 'bulk 2'}]),
+        ('delete bucket-list', 'delete', bucket, None),
+    ]
+
+
+def explain(connection, dialect, statement, parameters):
+    """Plan of a statement as a list of lines"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute(EXPLAIN[dialect] + statement, parameters)
+        return [' '.join(str(col) for col in row[-1:]) for row in cursor]
+    finally:
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--bucketlists', type=int, default=50)
+    parser.add_argument('--tasks', type=int, default=20)
+    parser.add_argument('--quiet', action='store_true',
+                        help='only print flagged plans')
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    app.config['ETAGS_ENABLED'] = False
+    with app.app_context():
+        db.create_all()
+        recorded = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and statement.lstrip().split()[0].upper() in (
+                    'SELECT', 'UPDATE', 'DELETE'):
+                recorded.append((statement, parameters))
+
+        engine = db.get_engine(app)
+        dialect = engine.dialect.name
+        if dialect not in EXPLAIN:
+            sys.exit('EXPLAIN is not supported on ' + dialect)
+        flagged = 0
+        try:
+            seed(args.users, args.bucketlists, args.tasks)
+            user = User.query.filter_by(username='user0').one()
+            bucket_id = user.bucketlists.order_by(BucketList.id).first().id
+            headers = auth_headers('user0', 'bench')
+            client = app.test_client()
+            client.get(API + '/bucketlists/', headers=headers)  # warm cache
+
+            connection = engine.raw_connection()
+            for name, method, path, body in endpoints(bucket_id):
+                del recorded[:]
+                event.listen(engine, 'before_cursor_execute', record)
+                try:
+                    response = getattr(client, method)(
+                        path, headers=headers,
+                        data=None if body is None else json.dumps(body))
+                finally:
+                    event.remove(engine, 'before_cursor_execute', record)
+                assert response.status_code < 400, (name, response.data)
+
+                lines = []
+                for statement, parameters in recorded:
+                    plan = explain(connection, dialect, statement, parameters)
+                    bad = any(FULL_SCAN[dialect].search(p) for p in plan)
+                    flagged += bad
+                    if bad or not args.quiet:
+                        lines.append(('!! ' if bad else '   ') +
+                                     ' '.join(statement.split())[:100])
+                        lines.extend('      ' + p for p in plan)
+                if lines:
+                    print('{} {} ({})'.format(method.upper(), path, name))
+                    print('\n'.join(lines))
+            connection.close()
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+    print('{} plan(s) with full table scans'.format(flagged))
+    sys.exit(1 if flagged else 0)
+
+
+if __name__ == '__main__':
+    main()
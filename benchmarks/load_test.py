@@ -0,0 +1,409 @@
+"""
+Load test of the whole API with a mixed workload
+
+Seeds users having bucket-lists of tasks, then sends a weighted mix of
+requests to the real endpoints from concurrent clients: token fetches,
+bucket-list listings, searches and later pages, task listings, and
+task creation, renames and deletions. Reports throughput and p50, p95
+and p99 latencies per operation, optionally saves them as JSON, and
+compares them with an earlier run, exiting with status 1 on regressions.
+
+Requests go through create_app's test client in this process, or over
+HTTP to gunicorn workers started for the run on the same database.
+
+Usage:
+    python benchmarks/load_test.py [--users N] [--bucketlists N]
+                                   [--tasks N] [--requests N]
+                                   [--concurrency N] [--seed N]
+                                   [--gunicorn WORKERS] [--output FILE]
+                                   [--compare FILE] [--tolerance F]
+
+Runs against TEST_DATABASE_URL, or a throwaway SQLite file if unset.
+The tables are created for the run and dropped afterwards, so it refuses
+to run against a database that already has them.
+"""
+import argparse
+import bisect
+import datetime
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from base64 import b64encode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('TEST_DATABASE_URL', 'sqlite:///' + os.path.join(
+    tempfile.mkdtemp(), 'bench.sqlite'))
+
+from sqlalchemy import inspect  # noqa: E402
+
+from bucky_api import create_app, db  # noqa: E402
+from bucky_api.common.seeding import NOUNS, seed  # noqa: E402
+from bucky_api.models import User  # noqa: E402
+
+API = '/api/v1.0'
+PASSWORD = 'bench'
+
+# operation -> (weight in the mix, statuses counted as success)
+OPERATIONS = {
+    'token': (5, (200,)),
+    'list bucket-lists': (25, (200,)),
+    'search bucket-lists': (15, (200, 404)),
+    'page bucket-lists': (10, (200, 404)),
+    'list tasks': (15, (200, 404)),
+    'create task': (12, (201,)),
+    'rename task': (10, (200,)),
+    'delete task': (8, (200,)),
+}
+
+
+def auth_headers(username, password=''):
+    credentials = '{}:{}'.format(username, password).encode('utf-8')
+    return {'Authorization': 'Basic ' + b64encode(credentials).decode('utf-8'),
+            'Content-Type': 'application/json'}
+
+
+class InProcessClient(object):
+    """Sends requests through the app's test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, headers, body=None):
+        response = self.client.open(
+            path, method=method, headers=headers,
+            data=None if body is None else json.dumps(body))
+        return response.status_code, response.get_data()
+
+
+class HTTPClient(object):
+    """Sends requests to a server over a kept-alive HTTP connection"""
+
+    def __init__(self, port):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port,
+                                                     timeout=30)
+
+    def request(self, method, path, headers, body=None):
+        self.connection.request(
+            method, path.replace(' ', '%20'), headers=headers,
+            body=None if body is None else json.dumps(body))
+        response = self.connection.getresponse()
+        return response.status, response.read()
+
+
+class VirtualUser(object):
+    """
+    One client of the load test, acting as random seeded users
+
+    Attributes:
+        client -- InProcessClient or HTTPClient to send requests with
+        accounts -- (username, token, bucket-list ids) of the seeded users
+        seed -- seed of the client's random choices
+        rng -- random number generator of this client
+        created -- (username, bucket-list id, task id) of tasks it created
+    """
+
+    def __init__(self, client, accounts, seed):
+        self.client = client
+        self.accounts = accounts
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.created = []
+        self._serial = 0
+        names = sorted(OPERATIONS)
+        self._names = names
+        self._cumulative_weights = list(itertools.accumulate(
+            OPERATIONS[name][0] for name in names))
+
+    def next_operation(self):
+        # weighted choice, random.choices needs Python 3.6
+        total = self._cumulative_weights[-1]
+        name = self._names[bisect.bisect(self._cumulative_weights,
+                                         self.rng.random() * total)]
+        if name in ('rename task', 'delete task') and not self.created:
+            name = 'create task'
+        return name
+
+    def run(self, name):
+        """
+        Send the request of an operation
+
+        :return: status code of the response
+        """
+        username, token, bucket_ids = self.rng.choice(self.accounts)
+        headers = auth_headers(token)
+        bucket_id = self.rng.choice(bucket_ids)
+        tasks = '{}/bucketlists/{}/tasks/'.format(API, bucket_id)
+        if name == 'token':
+            return self.client.request('GET', API + '/auth/get_token/',
+                                       auth_headers(username, PASSWORD))[0]
+        if name == 'list bucket-lists':
+            return self.client.request('GET', API + '/bucketlists/',
+                                       headers)[0]
+        if name == 'search bucket-lists':
+            term = self.rng.choice(NOUNS)
+            return self.client.request(
+                'GET', API + '/bucketlists/search/' + term, headers)[0]
+        if name == 'page bucket-lists':
+            page = self.rng.randint(2, max(2, len(bucket_ids) // 3))
+            return self.client.request(
+                'GET', API + '/bucketlists/?page={}'.format(page), headers)[0]
+        if name == 'list tasks':
+            return self.client.request('GET', tasks, headers)[0]
+        if name == 'create task':
+            self._serial += 1
+            code, body = self.client.request(
+                'POST', tasks, headers,
+                {'description': 'load {} {}'.format(self.seed, self._serial)})
+            if code == 201:
+                task_id = json.loads(body.decode('utf-8'))['task']['id']
+                self.created.append((username, bucket_id, task_id))
+            return code
+
+        # renames and deletes work on tasks created by this client
+        index = self.rng.randrange(len(self.created))
+        username, bucket_id, task_id = self.created[index]
+        token = next(a[1] for a in self.accounts if a[0] == username)
+        path = '{}/bucketlists/{}/tasks/{}'.format(API, bucket_id, task_id)
+        if name == 'rename task':
+            self._serial += 1
+            return self.client.request(
+                'PATCH', path, auth_headers(token),
+                {'description': 'renamed {} {}'.format(self.seed,
+                                                       self._serial)})[0]
+        del self.created[index]
+        return self.client.request('DELETE', path, auth_headers(token))[0]
+
+
+def drive(virtual_users, requests, warmup):
+    """
+    Run requests operations spread over the virtual users in threads
+
+    :return: (seconds taken, {operation: [(seconds, ok), ...]})
+    """
+    samples = {name: [] for name in OPERATIONS}
+    lock = threading.Lock()
+    per_user = requests // len(virtual_users)
+
+    def work(user):
+        for _ in range(warmup):
+            user.run(user.next_operation())
+        recorded = []
+        for _ in range(per_user):
+            name = user.next_operation()
+            start = time.perf_counter()
+            try:
+                code = user.run(name)
+            except (OSError, http.client.HTTPException):
+                code = None
+            recorded.append((name, time.perf_counter() - start,
+                             code in OPERATIONS[name][1]))
+        with lock:
+            for name, seconds, ok in recorded:
+                samples[name].append((seconds, ok))
+
+    threads = [threading.Thread(target=work, args=(user,))
+               for user in virtual_users]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, samples
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    return values[max(0, int(round(fraction * len(values))) - 1)]
+
+
+def summarize(samples, seconds):
+    """Throughput, error count and latency percentiles in milliseconds"""
+    latencies = sorted(s * 1000 for s, _ in samples)
+    return {
+        'requests': len(samples),
+        'errors': sum(not ok for _, ok in samples),
+        'throughput': len(samples) / seconds if seconds else 0.0,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+    }
+
+
+def compare(previous, current, tolerance):
+    """
+    Operations whose p95 latency rose or whose throughput fell by more
+    than tolerance since the previous run
+
+    :return: list of (operation, metric, previous value, current value)
+    """
+    regressions = []
+    for name, now in sorted(current['operations'].items()):
+        before = previous.get('operations', {}).get(name)
+        if not before or not before['requests'] or not now['requests']:
+            continue
+        if now['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append((name, 'p95_ms', before['p95_ms'],
+                                now['p95_ms']))
+        if now['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append((name, 'throughput', before['throughput'],
+                                now['throughput']))
+    return regressions
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(workers, port, config_name):
+    """Start gunicorn serving bucky_app and wait until it answers"""
+    env = dict(os.environ, FLASK_CONFIG=config_name)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn.app.wsgiapp',
+         '--workers', str(workers), '--bind', '127.0.0.1:{}'.format(port),
+         'bucky_app:app'],
+        cwd=ROOT, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit('gunicorn exited with status {}'.format(
+                process.returncode))
+        try:
+            HTTPClient(port).request('GET', API + '/bucketlists/', {})
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit('gunicorn did not start within 30 seconds')
+
+
+def print_table(results):
+    print('{:<22} {:>8} {:>7} {:>10} {:>9} {:>9} {:>9}'.format(
+        'operation', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms',
+        'p99 ms'))
+    rows = sorted(results['operations'].items()) + [
+        ('all', results['total'])]
+    for name, r in rows:
+        if not r['requests']:
+            continue
+        print('{:<22} {:>8} {:>7} {:>10.1f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+            name, r['requests'], r['errors'], r['throughput'], r['p50_ms'],
+            r['p95_ms'], r['p99_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--bucketlists', type=int, default=20)
+    parser.add_argument('--tasks', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='measured requests over all clients')
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='unmeasured requests per client')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--config', default='testing',
+                        help='configuration of the app under test, its '
+                             'database must not have the tables yet')
+    parser.add_argument('--gunicorn', type=int, metavar='WORKERS',
+                        help='serve over HTTP from this many workers')
+    parser.add_argument('--output', help='save results as JSON')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    app = create_app(args.config)
+    server = None
+    with app.app_context():
+        existing = set(inspect(db.engine).get_table_names())
+        if existing & set(db.metadata.tables):
+            sys.exit('{} already has tables, refusing to seed and drop '
+                     'them'.format(repr(db.engine.url)))
+        db.create_all()
+        try:
+            seed(args.users, args.bucketlists, args.tasks, PASSWORD,
+                 seed=args.seed)
+            if args.gunicorn:
+                port = free_port()
+                server = start_gunicorn(args.gunicorn, port, args.config)
+
+                def make_client():
+                    return HTTPClient(port)
+            else:
+                def make_client():
+                    return InProcessClient(app)
+
+            client = make_client()
+            accounts = []
+            for user in User.query.order_by(User.id):
+                code, body = client.request(
+                    'GET', API + '/auth/get_token/',
+                    auth_headers(user.username, PASSWORD))
+                assert code == 200, body
+                token = json.loads(body.decode('utf-8'))['token']
+                bucket_ids = [b.id for b in user.bucketlists]
+                accounts.append((user.username, token, bucket_ids))
+            dialect = db.engine.dialect.name
+            db.session.remove()
+
+            virtual_users = [VirtualUser(make_client(), accounts,
+                                         args.seed * 1000 + i)
+                             for i in range(args.concurrency)]
+            seconds, samples = drive(virtual_users, args.requests,
+                                     args.warmup)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+            db.session.remove()
+            db.drop_all()
+
+    results = {
+        'meta': {
+            'started': datetime.datetime.utcnow().isoformat() + 'Z',
+            'target': 'gunicorn x{}'.format(args.gunicorn)
+                      if args.gunicorn else 'in-process',
+            'database': dialect,
+            'python': platform.python_version(),
+            'users': args.users, 'bucketlists': args.bucketlists,
+            'tasks': args.tasks, 'concurrency': args.concurrency,
+            'seed': args.seed, 'config': args.config,
+        },
+        'total': summarize([s for v in samples.values() for s in v],
+                           seconds),
+        'operations': {name: summarize(v, seconds)
+                       for name, v in samples.items()},
+    }
+    print_table(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        regressions = compare(previous, results, args.tolerance)
+        for name, metric, before, now in regressions:
+            print('REGRESSION {} {}: {:.2f} -> {:.2f}'.format(
+                name, metric, before, now))
+        if not regressions:
+            print('no regressions against ' + args.compare)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
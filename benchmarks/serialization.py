@@ -0,0 +1,72 @@
+"""
+Benchmark of marshmallow against the precompiled serializers
+
+Dumps pages of 10, 100 and 1000 bucket-lists, each with nested tasks,
+with BucketListSchema(many=True) and with its compiled counterpart, and
+loads task payloads with TaskSchema and its compiled counterpart.
+
+Usage:
+    python benchmarks/serialization.py [--tasks K] [--repeat R]
+"""
+import argparse
+import os
+import sys
+import timeit
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bucky_api.common.serializers import compile_schema  # noqa: E402
+from bucky_api.models import BucketListSchema, TaskSchema  # noqa: E402
+
+PAGE_SIZES = (10, 100, 1000)
+
+
+def make_page(size, tasks_per_bucketlist):
+    return [SimpleNamespace(
+        id=i, name='bucket-list {}'.format(i), task_count=tasks_per_bucketlist,
+        task_list=[SimpleNamespace(id=i * 1000 + j,
+                                   description='task {}'.format(j))
+                   for j in range(tasks_per_bucketlist)])
+            for i in range(size)]
+
+
+def best_of(func, repeat):
+    number = 1
+    # scale the loop so each measurement takes a measurable time
+    while timeit.timeit(func, number=number) < 0.05:
+        number *= 2
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--tasks', type=int, default=5,
+                        help='tasks per bucket-list')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    schema = BucketListSchema(many=True)
+    compiled = compile_schema(schema)
+
+    print('{:>14} {:>16} {:>16} {:>8}'.format(
+        'operation', 'marshmallow', 'compiled', 'speedup'))
+    for size in PAGE_SIZES:
+        page = make_page(size, args.tasks)
+        assert compiled.dump(page) == schema.dump(page)
+        slow = best_of(lambda: schema.dump(page), args.repeat)
+        fast = best_of(lambda: compiled.dump(page), args.repeat)
+        print('{:>14} {:>13.3f} ms {:>13.3f} ms {:>7.1f}x'.format(
+            'dump {}'.format(size), slow * 1000, fast * 1000, slow / fast))
+
+    task_schema = TaskSchema()
+    compiled_task_schema = compile_schema(task_schema)
+    payload = {'description': 'a task', 'id': 5}
+    slow = best_of(lambda: task_schema.load(payload), args.repeat)
+    fast = best_of(lambda: compiled_task_schema.load(payload), args.repeat)
+    print('{:>14} {:>13.3f} us {:>13.3f} us {:>7.1f}x'.format(
+        'load task', slow * 1e6, fast * 1e6, slow / fast))
+
+
+if __name__ == '__main__':
+    main()
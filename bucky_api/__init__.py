@@ -1,9 +1,20 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 
+from bucky_api.common.cache import CredentialCache
+from bucky_api.common.database import PooledSQLAlchemy, WriteTracker
+from bucky_api.common.hashing import PasswordHasher
+from bucky_api.common.instrumentation import Instrumentation
+from bucky_api.common.metrics import Metrics
+from bucky_api.common.profiling import Profiler
 from config import config
 
-db = SQLAlchemy()
+db = PooledSQLAlchemy()
+credential_cache = CredentialCache()
+password_hasher = PasswordHasher()
+write_tracker = WriteTracker()
+instrumentation = Instrumentation()
+metrics = Metrics()
+profiler = Profiler()
 
 
 def create_app(config_name):
@@ -12,13 +23,21 @@ def create_app(config_name):
     config[config_name].init_app(app)
 
     db.init_app(app)
+    credential_cache.init_app(app)
+    password_hasher.init_app(app)
+    write_tracker.init_app(app)
+    instrumentation.init_app(app)
+    metrics.init_app(app)
+    profiler.init_app(app)
 
     from bucky_api.resources.auth import auth_bp
+    from bucky_api.resources.batch import batch_bp
     from bucky_api.resources.bucketlist import bucketlists_bp
     from bucky_api.resources.task import tasks_bp
 
     app.register_blueprint(auth_bp, url_prefix='/api/v1.0')
     app.register_blueprint(bucketlists_bp, url_prefix='/api/v1.0')
     app.register_blueprint(tasks_bp, url_prefix='/api/v1.0')
+    app.register_blueprint(batch_bp, url_prefix='/api/v1.0')
 
     return app
@@ -0,0 +1,178 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from bucky_api.common.database import UserStamps
+
+
+class CredentialCache(object):
+    """
+    Bounded, TTL-expiring cache of successfully verified credentials
+
+    Entries are keyed on an HMAC of the username:password pair, so neither
+    the plain password nor a reusable hash of it is kept in memory. The
+    HMAC key is random per process and never leaves it.
+
+    It also keeps the credential version of users whose tokens were
+    verified, so that tokens issued before a password change are
+    rejected without a query per request.
+
+    Entries are local to a worker process. invalidate_user also stamps
+    the user in a file shared by the workers of the host, and every
+    worker ignores entries checked before the user's last stamp, so a
+    password change is seen by all of them on their next lookup. Workers
+    on other hosts keep their entries until the TTL runs out.
+
+    Attributes:
+        max_size -- maximum number of cached verifications
+        ttl -- seconds a verification stays valid
+        stamps -- UserStamps holding the time of the last invalidations
+        hits -- number of lookups answered from the cache
+        misses -- number of lookups that had to go to the database
+    """
+
+    def __init__(self, app=None, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._key = os.urandom(32)
+        self._entries = OrderedDict()
+        self._user_keys = {}
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+        self.stamps = UserStamps()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_size = app.config.get('AUTH_CACHE_SIZE', self.max_size)
+        self.ttl = app.config.get('AUTH_CACHE_TTL', self.ttl)
+        self.stamps.close()
+        if app.config.get('AUTH_STAMPS_FILE'):
+            self.stamps.open(app.config['AUTH_STAMPS_FILE'],
+                             app.config.get('AUTH_STAMPS_SLOTS'))
+        self.clear()
+
+    def _digest(self, username, password):
+        message = '{}\x00{}'.format(username, password).encode('utf-8')
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def get(self, username, password):
+        """
+        Look up a previously verified credential pair
+
+        :return: cached value or None on a miss
+        """
+        if not self.max_size:
+            return None
+        key = self._digest(username, password)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is None or entry[0] < now or
+                    self._stale(entry[1], entry[3])):
+                if entry is not None:
+                    self._evict(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, username, password, user_id, value, checked_at):
+        """
+        Remember that the credential pair verified as user_id
+
+        :param checked_at: Unix time at which the verification started,
+            before the user was read from the database
+        """
+        if not self.max_size:
+            return
+        key = self._digest(username, password)
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = (time.monotonic() + self.ttl, user_id, value,
+                                  checked_at)
+            self._user_keys.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._evict(next(iter(self._entries)))
+
+    def get_version(self, user_id):
+        """
+        Look up the credential version of user_id
+
+        :return: cached version or None on a miss
+        """
+        with self._lock:
+            entry = self._versions.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            if self._stale(user_id, entry[2]):
+                del self._versions[user_id]
+                return None
+            self._versions.move_to_end(user_id)
+            return entry[1]
+
+    def set_version(self, user_id, version, checked_at):
+        """
+        Remember the current credential version of user_id
+
+        :param checked_at: Unix time before the version was read
+        """
+        if not self.max_size:
+            return
+        with self._lock:
+            self._versions.pop(user_id, None)
+            self._versions[user_id] = (time.monotonic() + self.ttl, version,
+                                       checked_at)
+            while len(self._versions) > self.max_size:
+                self._versions.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        """
+        Drop every cached verification belonging to user_id, in this
+        worker and, through the shared stamps, in the others
+
+        Called after the change is committed.
+        """
+        self.stamps.record(user_id)
+        with self._lock:
+            for key in self._user_keys.pop(user_id, ()):
+                self._entries.pop(key, None)
+            self._versions.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_keys.clear()
+            self._versions.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Counters describing cache effectiveness
+
+        :return: dict with hits, misses and current size
+        :rtype: dict
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries)}
+
+    def _stale(self, user_id, checked_at):
+        # checked before the last invalidation of user_id in any worker
+        return checked_at <= self.stamps.last(user_id)
+
+    def _evict(self, key):
+        user_id = self._entries.pop(key)[1]
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user_id]
@@ -0,0 +1,95 @@
+"""
+Conditional GET support
+
+Every write to a user's bucket-lists or tasks bumps users.data_version
+(see User.record_write), so a response body is fully determined by the
+user, that version and the request url. ETags are derived from those
+three alone: answering If-None-Match reads one integer from the users
+table and never touches bucket-lists or tasks.
+
+Responses built from a single bucket-list and its tasks use the
+bucket-list's own version instead (see BucketList.record_write), read
+by primary key, so writes to the user's other bucket-lists leave their
+ETags valid.
+"""
+import hashlib
+from functools import wraps
+
+from flask import current_app, g, request, Response
+
+from bucky_api import db
+from bucky_api.common import status
+from bucky_api.models import BucketList, User
+
+CACHE_CONTROL = 'no-cache, must-revalidate'
+
+
+def data_version(user_id):
+    """Current data version of a user, 0 if it cannot be found"""
+    return db.session.query(User.data_version).filter(
+        User.id == user_id).scalar() or 0
+
+
+def bucketlist_version(user_id, bucket_id):
+    """Current version of a user's bucket-list, None if it cannot be
+    found"""
+    return db.session.query(BucketList.version).filter(
+        BucketList.id == bucket_id, BucketList.user_id == user_id).scalar()
+
+
+def make_etag(user_id, version, url):
+    """
+    Strong validator for a response of user_id at version for url
+
+    :rtype: str
+    """
+    raw = '{}:{}:{}'.format(user_id, version, url).encode('utf-8')
+    return hashlib.sha1(raw).hexdigest()
+
+
+def conditional_on(version):
+    """
+    Make a decorator for a resource's get method answering If-None-Match
+    with 304
+
+    Successful responses get an ETag along with headers telling clients
+    to revalidate before reuse. Disabled with the ETAGS_ENABLED setting.
+
+    :param version: called with the current user's id and the url
+        arguments of the request, returns the version of the data the
+        response is built from
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if not current_app.config['ETAGS_ENABLED']:
+                return f(*args, **kwargs)
+            etag = make_etag(g.current_user.id,
+                             version(g.current_user.id, **kwargs),
+                             request.url)
+            headers = {'ETag': '"{}"'.format(etag),
+                       'Cache-Control': CACHE_CONTROL,
+                       'Vary': 'Authorization'}
+            if request.if_none_match.contains(etag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED,
+                                headers=headers)
+
+            result = f(*args, **kwargs)
+            data, code, extra = result, status.HTTP_200_OK, {}
+            if isinstance(result, tuple):
+                data, code, extra = (result + (None, None))[:3]
+                code = code or status.HTTP_200_OK
+                extra = extra or {}
+            if code != status.HTTP_200_OK:
+                return result
+            headers.update(extra)
+            return data, code, headers
+        return decorated
+    return decorator
+
+
+# responses built from any of the user's bucket-lists
+conditional = conditional_on(
+    lambda user_id, **kwargs: data_version(user_id))
+# responses built from the bucket-list of the bucket_id url argument
+conditional_on_bucketlist = conditional_on(bucketlist_version)
@@ -0,0 +1,319 @@
+"""
+Engine and connection pool setup
+
+PooledSQLAlchemy reads the pool settings of each config class:
+
+- SQLALCHEMY_POOL_SIZE, SQLALCHEMY_MAX_OVERFLOW, SQLALCHEMY_POOL_TIMEOUT
+  and SQLALCHEMY_POOL_RECYCLE, already understood by Flask-SQLAlchemy
+- SQLALCHEMY_POOL_PRE_PING, test connections on checkout so connections
+  dropped by the server or a deploy are replaced instead of failing
+- SQLALCHEMY_STATEMENT_TIMEOUT, milliseconds a statement may run on
+  PostgreSQL, 0 for no limit
+- SQLALCHEMY_PGBOUNCER, for pgbouncer in transaction pooling mode: a
+  server connection then serves other clients between transactions, so
+  nothing is set for the session, the statement timeout is SET LOCAL at
+  the start of every transaction instead
+
+Server databases get an InstrumentedQueuePool recording how long
+checkouts wait and how saturated the pool is, see pool_metrics.
+SQLite keeps Flask-SQLAlchemy's pools, which do not queue.
+
+Sessions are RoutingSessions: while session.info['use_replica'] is set
+they read through the 'replica' bind of SQLALCHEMY_BINDS, if there is
+one. Flushes and INSERT/UPDATE/DELETE statements always go to the
+primary. WriteTracker remembers when each user last wrote, so that
+their reads can stay on the primary until the replica caught up, in
+UserStamps shared by the worker processes of the host.
+"""
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, exc, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import UpdateBase
+
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout',
+                      'pool_recycle')
+REPLICA_BIND = 'replica'
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite only enforces foreign keys, and with them ON DELETE CASCADE,
+    on connections that ask for it"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+@event.listens_for(Engine, 'begin')
+def set_local_statement_timeout(connection):
+    """Limit the statements of a transaction in pgbouncer mode"""
+    options = connection.get_execution_options()
+    timeout = options.get('local_statement_timeout')
+    if timeout:
+        connection.execute(
+            'SET LOCAL statement_timeout = {:d}'.format(timeout))
+
+
+def is_unique_violation(error, table, index_name):
+    """
+    Whether an IntegrityError was raised by the unique index index_name
+    of table, rather than by another index or a foreign key
+
+    PostgreSQL names the violated constraint, SQLite lists the columns of
+    the violated unique index.
+
+    :type error: sqlalchemy.exc.IntegrityError
+    :rtype: bool
+    """
+    index = next(i for i in table.indexes if i.name == index_name)
+    diag = getattr(error.orig, 'diag', None)
+    if diag is not None:
+        return diag.constraint_name == index.name
+    message = str(error.orig)
+    columns = ', '.join('{}.{}'.format(table.name, column.name)
+                        for column in index.columns)
+    return (message == 'UNIQUE constraint failed: ' + columns or
+            index.name in message)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool keeping statistics on its checkouts
+
+    Attributes:
+        checkouts -- number of connections handed out
+        timeouts -- number of checkouts that gave up waiting
+        wait_seconds -- total time spent waiting for a connection
+        max_wait_seconds -- longest wait for a connection
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedQueuePool, self).__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super(InstrumentedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            self._record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        self._record_wait(time.perf_counter() - start)
+        return connection
+
+    def _record_wait(self, waited, timed_out=False):
+        with self._stats_lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def recreate(self):
+        # pre-ping and invalidation rebuild the pool, keep its statistics
+        pool = super(InstrumentedQueuePool, self).recreate()
+        with self._stats_lock:
+            pool.checkouts = self.checkouts
+            pool.timeouts = self.timeouts
+            pool.wait_seconds = self.wait_seconds
+            pool.max_wait_seconds = self.max_wait_seconds
+        return pool
+
+
+def pool_metrics(engine):
+    """
+    Current state of an engine's pool
+
+    :return: size, checked_out and overflow for queue pools, plus
+        saturation (checked out share of size + max overflow) and the
+        checkout statistics of an InstrumentedQueuePool. Empty for pools
+        that do not queue.
+    :rtype: dict
+    """
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {}
+    capacity = pool.size() + max(pool._max_overflow, 0)
+    metrics = {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'overflow': max(pool.overflow(), 0),
+        'saturation': pool.checkedout() / capacity if capacity else 0.0,
+    }
+    if isinstance(pool, InstrumentedQueuePool):
+        metrics.update(checkouts=pool.checkouts, timeouts=pool.timeouts,
+                       wait_seconds=pool.wait_seconds,
+                       max_wait_seconds=pool.max_wait_seconds)
+    return metrics
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session reading from the replica bind while asked to
+
+    Sessions joined to a connection, e.g. by an atomic batch, always use
+    that connection: their reads have to see the transaction's writes.
+    """
+
+    def __init__(self, db, **options):
+        self.routable = options.get('bind') is None
+        self._db = db
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if (self.routable and self.info.get('use_replica') and
+                not self._flushing and not isinstance(clause, UpdateBase)):
+            return self._db.get_engine(self.app, bind=REPLICA_BIND)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class UserStamps(object):
+    """
+    Time of each user's last event, shared by the worker processes
+
+    Timestamps are kept in a file mapped into memory by every worker, one
+    slot per user id modulo the number of slots. Users sharing a slot
+    see each other's events, callers have to treat a stamp as "maybe".
+    Until open() is called no user has a stamp.
+
+    Attributes:
+        slots -- number of timestamp slots
+    """
+
+    SLOT = struct.Struct('d')
+
+    def __init__(self, slots=65536):
+        self.slots = slots
+        self._map = None
+
+    def open(self, path, slots=None):
+        """Map the stamps kept in path, creating the file if needed"""
+        self.close()
+        self.slots = slots or self.slots
+        size = self.slots * self.SLOT.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    @property
+    def is_open(self):
+        return self._map is not None
+
+    def record(self, user_id, when=None):
+        """Stamp user_id with when, now by default"""
+        if self._map is not None:
+            self.SLOT.pack_into(self._map, self._offset(user_id),
+                                time.time() if when is None else when)
+
+    def last(self, user_id):
+        """Unix time of the last stamp of user_id's slot, 0 if none"""
+        if self._map is None:
+            return 0.0
+        return self.SLOT.unpack_from(self._map, self._offset(user_id))[0]
+
+    def _offset(self, user_id):
+        return (user_id % self.slots) * self.SLOT.size
+
+
+class WriteTracker(object):
+    """
+    Time of each user's last write, shared by the worker processes
+
+    Users sharing a UserStamps slot only make each other's reads stay on
+    the primary a little more often.
+
+    Attributes:
+        window -- seconds a user's reads stay on the primary after a write
+        stamps -- UserStamps holding the time of the last writes
+    """
+
+    def __init__(self, app=None, window=5, slots=65536):
+        self.window = window
+        self.stamps = UserStamps(slots)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.window = app.config.get('REPLICA_STICKY_SECONDS', self.window)
+        self.stamps.close()
+        if REPLICA_BIND not in (app.config.get('SQLALCHEMY_BINDS') or {}):
+            return
+        self.stamps.open(app.config['REPLICA_WRITES_FILE'],
+                         app.config.get('REPLICA_WRITES_SLOTS'))
+
+    @property
+    def enabled(self):
+        """Whether a replica is configured to route reads to"""
+        return self.stamps.is_open
+
+    def record(self, user_id):
+        """Remember that user_id is writing now"""
+        self.stamps.record(user_id)
+
+    def is_recent(self, user_id):
+        """
+        Whether user_id wrote within the window
+
+        :rtype: bool
+        """
+        if not self.stamps.is_open:
+            return False
+        return time.time() - self.stamps.last(user_id) < self.window
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy applying the pool settings of the app config and
+    routing reads to a replica"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        if info.drivername.startswith('sqlite'):
+            # without sizing Flask-SQLAlchemy picks a static or null pool
+            for option in QUEUE_POOL_OPTIONS:
+                options.pop(option, None)
+            super(PooledSQLAlchemy, self).apply_driver_hacks(
+                app, info, options)
+            return
+
+        super(PooledSQLAlchemy, self).apply_driver_hacks(app, info, options)
+
+        options.setdefault('poolclass', InstrumentedQueuePool)
+        options['pool_pre_ping'] = app.config['SQLALCHEMY_POOL_PRE_PING']
+        timeout = app.config['SQLALCHEMY_STATEMENT_TIMEOUT']
+        if not info.drivername.startswith('postgresql') or not timeout:
+            return
+        if app.config['SQLALCHEMY_PGBOUNCER']:
+            options.setdefault('execution_options', {})[
+                'local_statement_timeout'] = timeout
+        else:
+            options.setdefault('connect_args', {})['options'] = (
+                '-c statement_timeout={:d}'.format(timeout))
+
+    def pool_metrics(self, app=None):
+        """State of the default engine's pool, see pool_metrics"""
+        return pool_metrics(self.get_engine(app))
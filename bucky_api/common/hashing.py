@@ -0,0 +1,104 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashingQueueFull(Exception):
+    """Raised when too many password hashing jobs are already pending"""
+
+
+class PasswordHasher(object):
+    """
+    Runs password hashing and verification off the request worker
+
+    Jobs are sent to a process pool so that a burst of PBKDF2 work does
+    not hold the interpreter lock of the worker serving other requests.
+    At most max_pending jobs may be in flight per worker process; further
+    callers wait up to queue_timeout for a slot and then get
+    HashingQueueFull. With workers set to 0 hashing runs inline.
+
+    Attributes:
+        method -- werkzeug hash method including the iteration count,
+            e.g. pbkdf2:sha256:150000
+        salt_length -- length of the generated salt
+        workers -- size of the process pool, 0 to hash inline
+        max_pending -- maximum number of queued or running jobs
+        queue_timeout -- seconds to wait for a free slot
+    """
+
+    def __init__(self, app=None):
+        self.method = 'pbkdf2:sha256:150000'
+        self.salt_length = 8
+        self.workers = 0
+        self.max_pending = 1
+        self.queue_timeout = 0
+        self._executor = None
+        self._executor_pid = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        method = app.config['PASSWORD_HASH_METHOD']
+        iterations = app.config.get('PASSWORD_HASH_ITERATIONS')
+        if method.startswith('pbkdf2:') and iterations:
+            method = '{}:{}'.format(method, iterations)
+        self.method = method
+        self.salt_length = app.config['PASSWORD_HASH_SALT_LENGTH']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.max_pending = app.config['PASSWORD_HASH_MAX_PENDING']
+        self.queue_timeout = app.config['PASSWORD_HASH_QUEUE_TIMEOUT']
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self.shutdown()
+
+    def hash(self, password):
+        """
+        Hash a password with the configured method
+
+        :return: werkzeug formatted password hash
+        :rtype: str
+        """
+        return self._run(generate_password_hash, password,
+                         self.method, self.salt_length)
+
+    def verify(self, password_hashed, password):
+        """
+        Check a password against a stored hash
+
+        :rtype: bool
+        """
+        return self._run(check_password_hash, password_hashed, password)
+
+    def needs_rehash(self, password_hashed):
+        """
+        Check whether a stored hash was made with a different method
+        or iteration count than the configured one
+
+        :rtype: bool
+        """
+        return password_hashed.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=False)
+        self._executor = None
+        self._executor_pid = None
+
+    def _get_executor(self):
+        # pools do not survive a fork, so each worker process gets its own
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise HashingQueueFull()
+        try:
+            return self._get_executor().submit(func, *args).result()
+        finally:
+            self._slots.release()
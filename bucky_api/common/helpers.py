@@ -1,35 +1,265 @@
-from flask import current_app, url_for, g
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from flask import current_app, json as flask_json, request, url_for, g
+from flask_restful import abort
+from flask_sqlalchemy import Pagination
 from sqlalchemy import and_
+from sqlalchemy.orm import load_only
+
+from bucky_api import db
+from bucky_api.common import status
+from bucky_api.common.search import search_bucketlists
+from bucky_api.common.serializers import compile_schema
+from bucky_api.models import BucketList, BucketListSchema, Task, User
+
+
+def encode_cursor(last_id, direction):
+    """
+    Encode a position in an id-ordered listing as an opaque cursor
+
+    :param last_id: id of the last row seen in the given direction
+    :param direction: 'next' or 'prev'
+    :rtype: str
+    """
+    raw = json.dumps({'id': last_id, 'dir': direction}).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
 
-from bucky_api.models import BucketList, BucketListSchema, User
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor made by encode_cursor, aborting with 400 if it is
+    malformed
+
+    :return: (last_id, direction) tuple
+    :rtype: tuple
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(
+            cursor.encode('ascii')).decode('utf-8'))
+        last_id, direction = int(data['id']), data['dir']
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        abort(status.HTTP_400_BAD_REQUEST, message="Invalid cursor")
+    if direction not in ('next', 'prev'):
+        abort(status.HTTP_400_BAD_REQUEST, message="Invalid cursor")
+    return last_id, direction
+
+
+def split_arg(value):
+    """Split a comma separated query argument, None if it was not sent"""
+    if value is None:
+        return None
+    return tuple(item.strip() for item in value.split(',') if item.strip())
+
+
+def get_json_ordered():
+    """
+    Parse the JSON body of the request like request.get_json, keeping
+    the order of object keys, which dicts do not before Python 3.6
+
+    :return: the body with objects as OrderedDicts, None if the request
+        is not JSON
+    """
+    if not request.is_json:
+        return None
+    try:
+        return flask_json.loads(
+            request.get_data(cache=True),
+            encoding=request.mimetype_params.get('charset'),
+            object_pairs_hook=OrderedDict)
+    except ValueError as e:
+        return request.on_json_loading_failed(e)
+
+
+def load_many(schema, items, name):
+    """
+    Validate and deserialize a JSON array of a bulk request item by item
+
+    Aborts with 413 if the array has more than BULK_MAX_ITEMS items.
+
+    :param schema: schema loading a single item
+    :param name: plural name of the items, for error messages
+    :return: (data, errors) where errors maps the index of every invalid
+        item to its validation errors
+    :rtype: tuple
+    """
+    max_items = current_app.config['BULK_MAX_ITEMS']
+    if len(items) > max_items:
+        abort(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+              message="Too many {}, send at most {}".format(name, max_items))
+    data, errors = schema.load(items, many=True)
+    # marshmallow reports items that are not objects under a top level key
+    # instead of their index
+    errors.pop('_schema', None)
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors[i] = {'_schema': ['Invalid input type.']}
+    return data, errors
+
+
+def bulk_status(succeeded, total, code=status.HTTP_200_OK):
+    """Status of a bulk response, 207 unless every item succeeded"""
+    if succeeded < total:
+        return status.HTTP_207_MULTI_STATUS
+    return code
+
+
+class BucketListProjection(object):
+    """
+    Bucket-list attributes and relations asked for by a request
+
+    Parsed from `fields=` (comma separated attribute names) and `embed=`
+    (comma separated relation names). A request with neither gets every
+    attribute and the tasks, as before. Columns that are not asked for
+    are not selected and tasks are only loaded when embedded.
+
+    Attributes:
+        fields -- attribute names to serialize
+        embed -- relation names to serialize
+    """
+    FIELDS = ('id', 'name', 'task_count')
+    EMBEDS = ('tasks',)
+
+    # schemas are built once per projection and reused across requests
+    _schemas = {}
+
+    def __init__(self, fields=FIELDS, embed=EMBEDS):
+        if not fields:
+            raise ValueError('A projection needs at least one field')
+        self.fields = tuple(fields)
+        self.embed = tuple(embed)
+
+    @classmethod
+    def from_request(cls, request):
+        """
+        Projection of the current request, aborting with 400 on unknown
+        attribute or relation names or an empty `fields=`
+
+        :rtype: BucketListProjection
+        """
+        fields = split_arg(request.args.get('fields'))
+        embed = split_arg(request.args.get('embed'))
+        if fields is None and embed is None:
+            return cls()
+        if fields is None:
+            fields = cls.FIELDS
+        elif not fields:
+            # marshmallow reads an empty only= as every field
+            abort(status.HTTP_400_BAD_REQUEST, message="No fields requested")
+        unknown = ([f for f in fields if f not in cls.FIELDS] +
+                   [e for e in embed or () if e not in cls.EMBEDS])
+        if unknown:
+            abort(status.HTTP_400_BAD_REQUEST,
+                  message="Unknown fields: " + ', '.join(unknown))
+        return cls(fields, embed or ())
+
+    @property
+    def embed_tasks(self):
+        return 'tasks' in self.embed
+
+    def apply(self, query):
+        """
+        Restrict a bucket-list query to the projected columns
+
+        :rtype: flask_sqlalchemy.BaseQuery
+        """
+        columns = set(self.fields) | {'id'}
+        return query.options(load_only(*[c for c in self.FIELDS
+                                          if c in columns]))
+
+    def prefetch(self, bucketlists):
+        """Load embedded relations of bucket-lists about to be dumped"""
+        if self.embed_tasks:
+            BucketList.prefetch_tasks(bucketlists)
+        return bucketlists
+
+    def schema(self, many=False):
+        """
+        Compiled schema dumping just the projected attributes and relations
+
+        :rtype: bucky_api.common.serializers.CompiledSchema
+        """
+        key = (self.fields, self.embed, many)
+        schema = self._schemas.get(key)
+        if schema is None:
+            schema = compile_schema(
+                BucketListSchema(only=self.fields + self.embed, many=many))
+            self._schemas[key] = schema
+        return schema
 
 
 class BucketListPaginator(object):
     """
     Helper class to handle pagination of bucket-lists
 
+    Two modes are supported. The default uses `page=` offsets. Passing
+    `cursor=` (empty for the first page) switches to keyset pagination,
+    where `next`/`prev` carry opaque cursors and each page is a single
+    `WHERE id > :cursor ORDER BY id LIMIT n` query with no COUNT.
+
+    Search results are ordered by relevance in `page=` mode; keyset pages
+    need a stable unique key and stay in id order.
+
+    `count` of an unfiltered listing comes from the user's maintained
+    bucket-list counter rather than a COUNT(*).
+
     Attributes:
         request -- request object containing info on page number
-        resource_endpoint -- name of the bucket-list collection endpoint
+        resource_endpoint -- name of the endpoint used in next/prev links,
+            defaults to the endpoint serving the request
         resource_name -- name bucket-list array that will be sent in response
-        schema -- model schema to use in serializing objects
+        schema -- model schema to use in serializing objects, defaults to
+            the schema of the requested projection
         results_per_page -- how many bucket-lists to send in response
+        projection -- attributes and relations asked for by the request
     """
 
     def __init__(self,
                  request,
                  search_term=None,
                  results_per_page = 3,
-                 resource_endpoint='bucketlists.bucketlists',
+                 resource_endpoint=None,
                  resource_name='bucket-lists',
-                 schema=BucketListSchema(many=True)):
+                 schema=None):
         self.request = request
         self.search_term = search_term
         self.resource_endpoint = resource_endpoint
         self.resource_name = resource_name
-        self.schema = schema
+        self.projection = BucketListProjection.from_request(request)
+        self.schema = schema or self.projection.schema(many=True)
         self.results_per_page = results_per_page
 
+    def base_query(self):
+        """
+        Bucket-lists of the current user matching the search term, if any
+
+        :return: (query, rank) where rank orders search results by
+            relevance, None when not searching
+        :rtype: tuple
+        """
+        query = self.projection.apply(
+            BucketList.query.filter_by(user_id=g.current_user.id))
+        if self.search_term:
+            return search_bucketlists(query, self.search_term)
+        return query, None
+
+    def total_bucketlists(self):
+        """Number of bucket-lists of the current user, from the counter"""
+        return db.session.query(User.bucketlist_count).filter(
+            User.id == g.current_user.id).scalar() or 0
+
+    def page_url(self, **params):
+        """External url of another page of the current listing"""
+        args = self.request.args.to_dict()
+        args.pop('page', None)
+        args.pop('cursor', None)
+        args.update(self.request.view_args or {})
+        args.update(params)
+        endpoint = self.resource_endpoint or self.request.endpoint
+        return url_for(endpoint, _external=True, **args)
+
     def paginate_query(self):
         """
         Make db bucket-list paginated query
@@ -37,25 +267,32 @@ class BucketListPaginator(object):
         :return: dict object of json paginated response
         :rtype: dict
         """
+        if 'cursor' in self.request.args:
+            return self.paginate_keyset(self.request.args['cursor'])
+
         # default to page 1 if none is specified
         page = self.request.args.get('page', 1, type=int)
+        query, rank = self.base_query()
+        if rank is not None:
+            query = query.order_by(rank)
+        query = query.order_by(BucketList.id)
         if self.search_term:
-            pagination = BucketList.query.filter_by(user=g.current_user).filter(BucketList.name.like('%'+self.search_term+'%')).paginate(
+            pagination = query.paginate(
                 page,
                 per_page=self.results_per_page,
                 error_out=False)
         else:
-            pagination = BucketList.query.filter_by(user=g.current_user).paginate(
-            page,
-            per_page=self.results_per_page,
-            error_out=False)
-        bucketlists = pagination.items
+            per_page = self.results_per_page
+            items = query.limit(per_page).offset((page - 1) * per_page).all()
+            pagination = Pagination(query, page, per_page,
+                                    self.total_bucketlists(), items)
+        bucketlists = self.projection.prefetch(pagination.items)
         prev = None
         if pagination.has_prev:
-            prev = url_for(self.resource_endpoint, page=page - 1, _external=True)
+            prev = self.page_url(page=page - 1)
         next = None
         if pagination.has_next:
-            next = url_for(self.resource_endpoint, page=page + 1, _external=True)
+            next = self.page_url(page=page + 1)
 
         dumped_objects = self.schema.dump(bucketlists).data
         return {
@@ -64,3 +301,156 @@ class BucketListPaginator(object):
             'next': next,
             'count': pagination.total
         }
+
+    def paginate_keyset(self, cursor):
+        """
+        Make db bucket-list keyset paginated query
+
+        :param cursor: cursor from a previous page, empty for the first page
+        :return: dict object of json paginated response, count is None
+            for searches since keyset pages do not count the matches
+        :rtype: dict
+        """
+        query, _ = self.base_query()
+        direction = 'next'
+        if cursor:
+            last_id, direction = decode_cursor(cursor)
+            if direction == 'next':
+                query = query.filter(BucketList.id > last_id)
+            else:
+                query = query.filter(BucketList.id < last_id)
+        if direction == 'next':
+            query = query.order_by(BucketList.id.asc())
+        else:
+            query = query.order_by(BucketList.id.desc())
+
+        # one extra row tells whether there is anything beyond this page
+        bucketlists = query.limit(self.results_per_page + 1).all()
+        has_more = len(bucketlists) > self.results_per_page
+        bucketlists = bucketlists[:self.results_per_page]
+        if direction == 'prev':
+            bucketlists.reverse()
+        self.projection.prefetch(bucketlists)
+
+        prev = None
+        next = None
+        if bucketlists:
+            # coming back from a later page means there is one after this
+            if has_more or direction == 'prev':
+                next = self.page_url(
+                    cursor=encode_cursor(bucketlists[-1].id, 'next'))
+            if direction == 'next' and cursor or direction == 'prev' and has_more:
+                prev = self.page_url(
+                    cursor=encode_cursor(bucketlists[0].id, 'prev'))
+
+        dumped_objects = self.schema.dump(bucketlists).data
+        return {
+            self.resource_name: dumped_objects,
+            "prev": prev,
+            'next': next,
+            'count': None if self.search_term else self.total_bucketlists()
+        }
+
+
+class TaskPaginator(object):
+    """
+    Helper class to handle keyset pagination of the tasks of a bucket-list
+
+    Pages are requested with `cursor=` as for bucket-lists and hold at
+    most `limit=` tasks, capped at TASKS_MAX_PER_PAGE. `q=` keeps tasks
+    whose description contains the given text and `sort=` is either `id`
+    (oldest first, the default) or `-id` (newest first).
+
+    Ownership of the bucket-list and the page of tasks come from a single
+    query: the bucket-list is outer joined to its tasks so that a missing
+    bucket-list yields no row and an empty page yields one row without a
+    task.
+
+    Attributes:
+        request -- request object containing the pagination arguments
+        bucket_id -- id of the bucket-list whose tasks are listed
+        schema -- model schema to use in serializing tasks
+        resource_name -- name of task array that will be sent in response
+        results_per_page -- how many tasks to send in response
+        search_term -- text descriptions have to contain, if any
+        descending -- whether tasks are listed newest first
+    """
+    SORTS = ('id', '-id')
+
+    def __init__(self, request, bucket_id, schema, resource_name='tasks'):
+        self.request = request
+        self.bucket_id = bucket_id
+        self.schema = schema
+        self.resource_name = resource_name
+        limit = request.args.get('limit', current_app.config['TASKS_PER_PAGE'],
+                                 type=int)
+        self.results_per_page = max(
+            1, min(limit, current_app.config['TASKS_MAX_PER_PAGE']))
+        self.search_term = request.args.get('q') or None
+        sort = request.args.get('sort', 'id')
+        if sort not in self.SORTS:
+            abort(status.HTTP_400_BAD_REQUEST, message="Unknown sort: " + sort)
+        self.descending = sort == '-id'
+
+    def page_url(self, **params):
+        """External url of another page of the current listing"""
+        args = self.request.args.to_dict()
+        args.pop('cursor', None)
+        args.update(self.request.view_args or {})
+        args.update(params)
+        return url_for(self.request.endpoint, _external=True, **args)
+
+    def paginate_query(self):
+        """
+        Make db task keyset paginated query
+
+        :return: dict object of json paginated response, None if the
+            bucket-list does not exist. count is None when filtering by `q=`
+        :rtype: dict
+        """
+        cursor = self.request.args.get('cursor')
+        direction = 'next'
+        if cursor:
+            last_id, direction = decode_cursor(cursor)
+        ascending = self.descending == (direction == 'prev')
+
+        on = [Task.bucketlist_id == BucketList.id,
+              Task.user_id == BucketList.user_id]
+        if cursor:
+            on.append(Task.id > last_id if ascending else Task.id < last_id)
+        if self.search_term:
+            on.append(Task.description.contains(self.search_term,
+                                                autoescape=True))
+        # one extra row tells whether there is anything beyond this page
+        rows = (db.session.query(BucketList.task_count, Task)
+                .outerjoin(Task, and_(*on))
+                .filter(BucketList.id == self.bucket_id,
+                        BucketList.user_id == g.current_user.id)
+                .order_by(Task.id.asc() if ascending else Task.id.desc())
+                .limit(self.results_per_page + 1)
+                .all())
+        if not rows:
+            return None
+        tasks = [task for _, task in rows if task is not None]
+        has_more = len(tasks) > self.results_per_page
+        tasks = tasks[:self.results_per_page]
+        if direction == 'prev':
+            tasks.reverse()
+
+        prev = None
+        next = None
+        if tasks:
+            # coming back from a later page means there is one after this
+            if has_more or direction == 'prev':
+                next = self.page_url(
+                    cursor=encode_cursor(tasks[-1].id, 'next'))
+            if direction == 'next' and cursor or direction == 'prev' and has_more:
+                prev = self.page_url(
+                    cursor=encode_cursor(tasks[0].id, 'prev'))
+
+        return {
+            self.resource_name: self.schema.dump(tasks).data,
+            'prev': prev,
+            'next': next,
+            'count': None if self.search_term else rows[0][0]
+        }
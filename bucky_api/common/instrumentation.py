@@ -0,0 +1,169 @@
+"""
+Per-request timing of phases and SQL statements
+
+When INSTRUMENTATION_ENABLED is set, every request gets a RequestTimer
+collecting:
+
+- db, the time spent executing SQL statements, and their number
+- auth, dump and encode, the time spent verifying credentials,
+  serializing with the schemas and encoding the JSON response
+- total, the whole request
+
+and reports them in a Server-Timing header. Phases overlap, e.g. auth
+includes the queries it makes. Requests over SLOW_REQUEST_MS or
+SLOW_REQUEST_STATEMENTS (0 disables either) are logged as warnings.
+
+With instrumentation disabled nothing is registered on the app or the
+engines, and functions decorated with timed() only check a module flag.
+"""
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request
+from flask_restful.representations import json as json_representation
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# set once an app enabled instrumentation, so phase() is free otherwise
+_enabled = False
+
+
+class RequestTimer(object):
+    """
+    Timings of a single request
+
+    Attributes:
+        start -- perf_counter value when the request started
+        phases -- seconds spent per phase, in the order phases were entered
+        statements -- number of SQL statements executed
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = OrderedDict()
+        self.statements = 0
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def elapsed(self):
+        """Seconds since the request started"""
+        return time.perf_counter() - self.start
+
+    def server_timing(self, total):
+        """
+        Value of the Server-Timing header, durations in milliseconds
+
+        :rtype: str
+        """
+        metrics = []
+        for name, seconds in self.phases.items():
+            metric = '{};dur={:.1f}'.format(name, seconds * 1000)
+            if name == 'db':
+                metric += ';desc="{} statements"'.format(self.statements)
+            metrics.append(metric)
+        metrics.append('total;dur={:.1f}'.format(total * 1000))
+        return ', '.join(metrics)
+
+
+def current_timer():
+    """RequestTimer of the request being handled, None if there is none"""
+    if not _enabled or not has_app_context():
+        return None
+    return g.get('request_timer')
+
+
+@contextmanager
+def phase(name):
+    """Add the time spent in the with block to phase name of the request"""
+    timer = current_timer()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
+
+
+def timed(name):
+    """Decorate a function to add its running time to phase name"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if not _enabled:
+                return f(*args, **kwargs)
+            with phase(name):
+                return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
+@timed('encode')
+def output_json(data, code, headers=None):
+    """Flask-RESTful's JSON representation, timed as the encode phase"""
+    return json_representation.output_json(data, code, headers)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if context is not None and current_timer() is not None:
+        context.instrumentation_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    timer = current_timer()
+    start = getattr(context, 'instrumentation_start', None)
+    if timer is not None and start is not None:
+        timer.statements += 1
+        timer.add('db', time.perf_counter() - start)
+
+
+class Instrumentation(object):
+    """Registers request timing on apps that enable it"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        global _enabled
+        if not app.config.get('INSTRUMENTATION_ENABLED'):
+            return
+        if not event.contains(Engine, 'before_cursor_execute',
+                              _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute',
+                         _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute',
+                         _after_cursor_execute)
+        _enabled = True
+        app.before_request(start_timer)
+        app.after_request(report_timer)
+
+
+def start_timer():
+    # sub-requests of a batch count towards the batch request
+    if g.get('batch_identity') is None:
+        g.request_timer = RequestTimer()
+
+
+def report_timer(response):
+    timer = g.get('request_timer')
+    if timer is None or g.get('batch_identity') is not None:
+        return response
+    total = timer.elapsed()
+    response.headers['Server-Timing'] = timer.server_timing(total)
+    slow_ms = current_app.config.get('SLOW_REQUEST_MS', 0)
+    slow_statements = current_app.config.get('SLOW_REQUEST_STATEMENTS', 0)
+    if ((slow_ms and total * 1000 > slow_ms) or
+            (slow_statements and timer.statements > slow_statements)):
+        current_app.logger.warning(
+            'Slow request %s %s: %d %.1f ms, %d statements (%s)',
+            request.method, request.full_path.rstrip('?'),
+            response.status_code, total * 1000, timer.statements,
+            timer.server_timing(total))
+    return response
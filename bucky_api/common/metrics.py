@@ -0,0 +1,435 @@
+"""
+Prometheus metrics shared by the worker processes
+
+Each process writes its samples to its own file in METRICS_DIR, mapped
+into memory, so recording a sample is a dict lookup and a write into the
+mapping without any lock shared between processes. /metrics reads the
+files of every process and merges them: counters and histograms are
+summed, gauges are reported per live process with a pid label. It first
+folds the counters and histograms of processes that exited into an
+archive file and deletes their files, so METRICS_DIR does not grow with
+every worker restart; a lock file in METRICS_DIR keeps a file from being
+folded twice or while a process reusing its pid opens it.
+
+A pid alone does not tell whether a file's process is alive, the pid
+may have been given to a new process since. Each process stores its
+start time, read from /proc, in its file under PROCESS_START and a file
+only counts as live while its pid has the same start time.
+
+/metrics is not authenticated, METRICS_ENABLED should only be set where
+the port is not reachable from the outside.
+
+Samples are recorded for every request, batch sub-requests excluded:
+a counter per endpoint, method and status, and a latency histogram per
+endpoint. Endpoints are the names the resources are added with, e.g.
+bucketlists or bucketlists/search. Pool statistics and auth cache
+counters are copied into the process' file after each request.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import Response, g, request
+
+# upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+           float('inf'))
+
+# name -> (type, help) of every metric family, in exposition order
+FAMILIES = OrderedDict([
+    ('bucky_requests_total',
+     ('counter', 'Requests handled, by endpoint, method and status')),
+    ('bucky_request_duration_seconds',
+     ('histogram', 'Time to handle a request, by endpoint')),
+    ('bucky_db_pool_size', ('gauge', 'Connections the pool keeps open')),
+    ('bucky_db_pool_checked_out', ('gauge', 'Connections in use')),
+    ('bucky_db_pool_overflow', ('gauge', 'Connections opened over size')),
+    ('bucky_db_pool_saturation',
+     ('gauge', 'Share of size plus max overflow in use')),
+    ('bucky_db_pool_checkouts_total',
+     ('counter', 'Connections handed out by the pool')),
+    ('bucky_db_pool_timeouts_total',
+     ('counter', 'Checkouts that gave up waiting for a connection')),
+    ('bucky_db_pool_wait_seconds_total',
+     ('counter', 'Time spent waiting for a connection')),
+    ('bucky_auth_cache_hits_total',
+     ('counter', 'Credential checks answered by the cache')),
+    ('bucky_auth_cache_misses_total',
+     ('counter', 'Credential checks that went to the database')),
+    ('bucky_auth_cache_hit_ratio',
+     ('gauge', 'Share of credential checks answered by the cache')),
+])
+POOL_GAUGES = ('size', 'checked_out', 'overflow', 'saturation')
+POOL_COUNTERS = {'checkouts': 'checkouts_total',
+                 'timeouts': 'timeouts_total',
+                 'wait_seconds': 'wait_seconds_total'}
+
+# file the samples of processes that exited are folded into
+ARCHIVE = 'archive'
+# key of the start time of a file's process, in clock ticks after boot
+PROCESS_START = 'process_start_ticks'
+
+_HEADER = struct.Struct('i4x')
+_LENGTH = struct.Struct('i')
+_VALUE = struct.Struct('d')
+
+
+def _padded(size):
+    return size + (-size % 8)
+
+
+def labels(**values):
+    """Format label values as a Prometheus label set"""
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in sorted(values.items())) + '}'
+
+
+def _entries(buffer):
+    """(key, offset of the value) of the entries of a metrics file"""
+    if len(buffer) < _HEADER.size:
+        return
+    used = _HEADER.unpack_from(buffer, 0)[0]
+    offset = _HEADER.size
+    while offset < used:
+        length = _LENGTH.unpack_from(buffer, offset)[0]
+        key_end = offset + _LENGTH.size + length
+        key = bytes(buffer[offset + _LENGTH.size:key_end]).decode('utf-8')
+        offset = _padded(key_end)
+        yield key, offset
+        offset += _VALUE.size
+
+
+def read_samples(path):
+    """
+    Samples of a metrics file
+
+    :return: sample key -> value
+    :rtype: dict
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    return {key: _VALUE.unpack_from(data, offset)[0]
+            for key, offset in _entries(data)}
+
+
+class MetricsFile(object):
+    """
+    Samples of one process, stored in a file mapped into memory
+
+    Entries are appended as a key length, the key padded to 8 bytes and
+    the value. The header holds the number of bytes in use and is only
+    updated after an entry is complete, so other processes can read the
+    file at any time.
+
+    Attributes:
+        path -- file holding the samples
+    """
+
+    INITIAL_SIZE = 64 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            size = os.fstat(fd).st_size
+            if size < self.INITIAL_SIZE:
+                os.ftruncate(fd, self.INITIAL_SIZE)
+                size = self.INITIAL_SIZE
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._used = _HEADER.unpack_from(self._map, 0)[0] or _HEADER.size
+        # an earlier process with the same pid left samples to build on
+        self._offsets = dict(_entries(self._map))
+
+    def _append(self, key):
+        encoded = key.encode('utf-8')
+        value_offset = _padded(self._used + _LENGTH.size + len(encoded))
+        end = value_offset + _VALUE.size
+        if end > len(self._map):
+            self._grow(end)
+        _LENGTH.pack_into(self._map, self._used, len(encoded))
+        self._map[self._used + _LENGTH.size:
+                  self._used + _LENGTH.size + len(encoded)] = encoded
+        _VALUE.pack_into(self._map, value_offset, 0.0)
+        self._used = end
+        _HEADER.pack_into(self._map, 0, end)
+        self._offsets[key] = value_offset
+        return value_offset
+
+    def _grow(self, needed):
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+        self._map.close()
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def inc(self, key, amount=1.0):
+        offset = self._offsets.get(key)
+        if offset is None:
+            offset = self._append(key)
+        _VALUE.pack_into(self._map, offset,
+                         _VALUE.unpack_from(self._map, offset)[0] + amount)
+
+    def set(self, key, value):
+        offset = self._offsets.get(key)
+        if offset is None:
+            offset = self._append(key)
+        _VALUE.pack_into(self._map, offset, value)
+
+    def close(self):
+        self._map.close()
+
+
+class Metrics(object):
+    """
+    Records request metrics of apps that enable them and serves /metrics
+
+    Attributes:
+        directory -- where the processes keep their metrics files
+    """
+
+    def __init__(self, app=None):
+        self.directory = None
+        self._file = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('METRICS_ENABLED'):
+            return
+        self.directory = app.config['METRICS_DIR']
+        os.makedirs(self.directory, exist_ok=True)
+        app.before_request(start_clock)
+        app.after_request(self.record_request)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+    def _process_file(self):
+        # workers forked after init_app must not share the parent's file
+        path = os.path.join(self.directory, '{}.db'.format(os.getpid()))
+        if self._file is None or self._file.path != path:
+            if self._file is not None:
+                self._file.close()
+            with _locked(self.directory):
+                self._file = MetricsFile(path)
+                started = _process_start(os.getpid())
+                if started is not None:
+                    self._file.set(PROCESS_START, started)
+        return self._file
+
+    def _archive_dead(self):
+        """Fold the files of processes that exited into the archive"""
+        with _locked(self.directory):
+            dead = []
+            for filename in os.listdir(self.directory):
+                pid = _pid(filename)
+                if pid is None:
+                    continue
+                path = os.path.join(self.directory, filename)
+                samples = read_samples(path)
+                if not _is_alive(pid, samples.get(PROCESS_START)):
+                    dead.append((path, samples))
+            if not dead:
+                return
+            archive = MetricsFile(os.path.join(self.directory,
+                                               ARCHIVE + '.db'))
+            try:
+                for path, samples in dead:
+                    for key, value in samples.items():
+                        if (key != PROCESS_START and
+                                FAMILIES[_family(key)][0] != 'gauge'):
+                            archive.inc(key, value)
+                    os.remove(path)
+            finally:
+                archive.close()
+
+    def record_request(self, response):
+        start = g.get('metrics_start')
+        if start is None or g.get('batch_identity') is not None:
+            return response
+        seconds = time.perf_counter() - start
+        rule = request.url_rule
+        endpoint = rule.endpoint.split('.')[-1] if rule else 'none'
+        with self._lock:
+            store = self._process_file()
+            store.inc('bucky_requests_total' + labels(
+                endpoint=endpoint, method=request.method,
+                status=response.status_code))
+            name = 'bucky_request_duration_seconds'
+            for bound in BUCKETS:
+                if seconds <= bound:
+                    store.inc(name + '_bucket' + labels(
+                        endpoint=endpoint,
+                        le='+Inf' if bound == float('inf') else bound))
+            store.inc(name + '_sum' + labels(endpoint=endpoint), seconds)
+            store.inc(name + '_count' + labels(endpoint=endpoint))
+            self._record_process(store)
+        return response
+
+    @staticmethod
+    def _record_process(store):
+        from bucky_api import credential_cache, db
+        for name, value in db.pool_metrics().items():
+            if name in POOL_GAUGES:
+                store.set('bucky_db_pool_' + name, value)
+            elif name in POOL_COUNTERS:
+                store.set('bucky_db_pool_' + POOL_COUNTERS[name], value)
+        stats = credential_cache.stats()
+        store.set('bucky_auth_cache_hits_total', stats['hits'])
+        store.set('bucky_auth_cache_misses_total', stats['misses'])
+
+    def collect(self):
+        """
+        Merge the samples of every process
+
+        :return: family name -> list of (sample key, value)
+        :rtype: OrderedDict
+        """
+        with self._lock:
+            self._record_process(self._process_file())
+        self._archive_dead()
+        merged = {}
+        gauges = []
+        for filename in sorted(os.listdir(self.directory)):
+            pid = _pid(filename)
+            if pid is None and filename != ARCHIVE + '.db':
+                continue
+            try:
+                samples = read_samples(os.path.join(self.directory,
+                                                    filename))
+            except FileNotFoundError:
+                # archived by another process since it was listed
+                continue
+            alive = pid is not None and _is_alive(
+                pid, samples.get(PROCESS_START))
+            for key, value in samples.items():
+                if key == PROCESS_START:
+                    continue
+                family = _family(key)
+                if FAMILIES[family][0] != 'gauge':
+                    merged[key] = merged.get(key, 0.0) + value
+                elif alive:
+                    gauges.append((key + labels(pid=pid), value))
+
+        hits = merged.get('bucky_auth_cache_hits_total', 0.0)
+        misses = merged.get('bucky_auth_cache_misses_total', 0.0)
+        if hits + misses:
+            gauges.append(('bucky_auth_cache_hit_ratio',
+                           hits / (hits + misses)))
+
+        families = OrderedDict((name, []) for name in FAMILIES)
+        for key, value in sorted(merged.items()) + sorted(gauges):
+            families[_family(key)].append((key, value))
+        return families
+
+    def render(self):
+        """
+        Metrics of all processes in Prometheus text exposition format
+
+        :rtype: str
+        """
+        lines = []
+        for name, samples in self.collect().items():
+            if not samples:
+                continue
+            kind, help_text = FAMILIES[name]
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            if kind == 'histogram':
+                samples = _histogram_order(samples)
+            for key, value in samples:
+                lines.append('{} {}'.format(key, repr(value)))
+        return '\n'.join(lines) + '\n'
+
+    def view(self):
+        return Response(self.render(), mimetype='text/plain',
+                        content_type='text/plain; version=0.0.4')
+
+
+def start_clock():
+    # sub-requests of a batch count towards the batch request
+    if g.get('batch_identity') is None:
+        g.metrics_start = time.perf_counter()
+
+
+def _family(key):
+    name = key.split('{', 1)[0]
+    if name not in FAMILIES:
+        name = name.rsplit('_', 1)[0]
+    return name
+
+
+def _histogram_order(samples):
+    def order(sample):
+        key = sample[0]
+        name, _, label_set = key.partition('{')
+        endpoint = label_set.split('endpoint="', 1)[-1].split('"', 1)[0]
+        suffix = name.rsplit('_', 1)[1]
+        bound = float('inf')
+        if suffix == 'bucket':
+            bound = float(label_set.split('le="', 1)[1].split('"', 1)[0])
+        return endpoint, ('bucket', 'sum', 'count').index(suffix), bound
+    return sorted(samples, key=order)
+
+
+def _pid(filename):
+    """Pid of the process a metrics file belongs to, None for others"""
+    pid, ext = os.path.splitext(filename)
+    if ext != '.db' or not pid.isdigit():
+        return None
+    return int(pid)
+
+
+@contextmanager
+def _locked(directory):
+    """Hold the lock of a metrics directory, shared by the processes"""
+    fd = os.open(os.path.join(directory, 'lock'), os.O_RDWR | os.O_CREAT,
+                 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _process_start(pid):
+    """Start time of a process in clock ticks after boot, None if unknown"""
+    try:
+        with open('/proc/{}/stat'.format(pid), 'rb') as f:
+            stat = f.read()
+        # fields after the command name, which may hold spaces, from the
+        # state onwards; the start time is the 22nd field
+        return float(stat.rsplit(b')', 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _is_alive(pid, started=None):
+    """
+    Whether pid is running and, if started is given and the start time
+    of processes can be read, is still the process that started then
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    if started is not None:
+        current = _process_start(pid)
+        if current is not None and current != started:
+            return False
+    return True
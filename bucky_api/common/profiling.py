@@ -0,0 +1,260 @@
+"""
+On-demand request profiling
+
+With PROFILER_ENABLED set, a request runs under cProfile when it carries
+an X-Profile header holding PROFILER_TOKEN, or when it is drawn at
+PROFILER_SAMPLE_RATE. The PROFILER_KEEP slowest profiles of the process
+are kept and served, to holders of the token only, by:
+
+- GET /profiles, listing them slowest first
+- GET /profiles/<id>?format=pstats, for pstats.Stats or snakeviz
+- GET /profiles/<id>?format=collapsed, folded stacks for flamegraph.pl
+  or speedscope
+
+cProfile records calls between functions rather than whole stacks, so
+collapsed stacks share each function's time out among its callers in
+proportion to the time each caller spent in it.
+
+With the profiler disabled nothing is registered on the app. Profiles
+are kept per worker process, the listing gives the pid that served it.
+"""
+import cProfile
+import heapq
+import hmac
+import itertools
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+
+from flask import Response, current_app, g, jsonify, request
+
+from bucky_api.common import status
+
+# deepest stack written out in collapsed format
+MAX_STACK_DEPTH = 100
+
+
+class RequestProfile(object):
+    """
+    Profile of a single request
+
+    Attributes:
+        id -- identifier of the profile within its process
+        method -- HTTP method of the request
+        path -- path and query string of the request
+        endpoint -- endpoint that handled the request, None if none did
+        status -- status code of the response
+        duration -- seconds the request took under the profiler
+        started -- unix time the request started
+        stats -- pstats dict of the profile
+    """
+
+    def __init__(self, id, method, path, endpoint, status, duration,
+                 started, stats):
+        self.id = id
+        self.method = method
+        self.path = path
+        self.endpoint = endpoint
+        self.status = status
+        self.duration = duration
+        self.started = started
+        self.stats = stats
+
+    def summary(self):
+        return {'id': self.id, 'pid': os.getpid(), 'method': self.method,
+                'path': self.path, 'endpoint': self.endpoint,
+                'status': self.status,
+                'duration_ms': round(self.duration * 1000, 3),
+                'started': self.started}
+
+    def pstats_data(self):
+        """Profile in the format written by pstats.Stats.dump_stats"""
+        return marshal.dumps(self.stats)
+
+    def collapsed(self):
+        """
+        Profile as collapsed stacks, one "frame;frame;frame microseconds"
+        line per stack
+
+        :rtype: str
+        """
+        callees = {}
+        for func, (_, _, _, _, callers) in self.stats.items():
+            for caller, edge in callers.items():
+                callees.setdefault(caller, {})[func] = edge[3]
+        roots = [(func, cumulative) for func, (_, _, _, cumulative, callers)
+                 in self.stats.items() if not callers]
+        # stacks below a ten thousandth of the total would not show on a
+        # flame graph, skipping them bounds the number of stacks walked
+        threshold = sum(cumulative for _, cumulative in roots) / 10000
+        lines = {}
+
+        def walk(func, seconds, stack):
+            cumulative = self.stats[func][3]
+            if (not cumulative or seconds < threshold or
+                    len(stack) >= MAX_STACK_DEPTH):
+                return
+            share = min(seconds / cumulative, 1.0)
+            stack = stack + (_frame_label(func),)
+            own = min(self.stats[func][2] * share, seconds)
+            if own >= 1e-6:
+                key = ';'.join(stack)
+                lines[key] = lines.get(key, 0) + int(own * 1e6)
+            children = [(callee, edge_seconds * share) for callee, edge_seconds
+                        in callees.get(func, {}).items()
+                        if _frame_label(callee) not in stack]
+            # recursion counts time twice in cProfile's cumulative times,
+            # callees cannot have spent more than the caller did
+            total = sum(child_seconds for _, child_seconds in children)
+            scale = min(1.0, (seconds - own) / total) if total else 0
+            for callee, child_seconds in children:
+                walk(callee, child_seconds * scale, stack)
+
+        for func, cumulative in roots:
+            walk(func, cumulative, ())
+        return ''.join('{} {}\n'.format(stack, micros)
+                       for stack, micros in sorted(lines.items()))
+
+
+def _frame_label(func):
+    filename, line, name = func
+    if filename == '~':
+        label = name
+    else:
+        label = '{} ({}:{})'.format(name, os.path.basename(filename), line)
+    return label.replace(';', ':')
+
+
+class ProfileStore(object):
+    """
+    Bounded store of the slowest request profiles
+
+    Attributes:
+        size -- number of profiles kept
+    """
+
+    def __init__(self, size=20):
+        self.size = size
+        self._heap = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        return next(self._ids)
+
+    def add(self, profile):
+        """Keep profile if it is among the slowest seen"""
+        with self._lock:
+            entry = (profile.duration, profile.id, profile)
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, entry)
+            elif entry[:2] > self._heap[0][:2]:
+                heapq.heapreplace(self._heap, entry)
+
+    def get(self, profile_id):
+        with self._lock:
+            for _, _, profile in self._heap:
+                if profile.id == profile_id:
+                    return profile
+        return None
+
+    def slowest(self):
+        """
+        Kept profiles, slowest first
+
+        :rtype: list
+        """
+        with self._lock:
+            return [profile for _, _, profile in
+                    sorted(self._heap, key=lambda e: e[:2], reverse=True)]
+
+    def clear(self):
+        with self._lock:
+            del self._heap[:]
+
+
+class Profiler(object):
+    """Profiles requests of apps that enable it"""
+
+    def __init__(self, app=None):
+        self.store = ProfileStore()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('PROFILER_ENABLED'):
+            return
+        self.store.size = app.config.get('PROFILER_KEEP', self.store.size)
+        self.store.clear()
+        app.before_request(self._start)
+        app.after_request(self._record_status)
+        app.teardown_request(self._stop)
+        app.add_url_rule('/profiles', 'profiles', self.list_view)
+        app.add_url_rule('/profiles/<int:profile_id>', 'profile',
+                         self.profile_view)
+
+    @staticmethod
+    def _is_admin():
+        token = current_app.config.get('PROFILER_TOKEN')
+        given = request.headers.get('X-Profile', '')
+        return bool(token) and hmac.compare_digest(
+            given.encode('utf-8'), token.encode('utf-8'))
+
+    def _start(self):
+        # sub-requests of a batch run inside the batch's profile
+        if g.get('batch_identity') is not None:
+            return
+        rate = current_app.config.get('PROFILER_SAMPLE_RATE', 0)
+        if not (rate and random.random() < rate) and not (
+                'X-Profile' in request.headers and self._is_admin()):
+            return
+        g.profile_started = time.time()
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+    @staticmethod
+    def _record_status(response):
+        if g.get('profiler') is not None:
+            g.profile_status = response.status_code
+        return response
+
+    def _stop(self, exc):
+        profiler = g.get('profiler')
+        if profiler is None or g.get('batch_identity') is not None:
+            return
+        profiler.disable()
+        g.pop('profiler')
+        started = g.pop('profile_started')
+        stats = pstats.Stats(profiler).stats
+        self.store.add(RequestProfile(
+            self.store.next_id(), request.method,
+            request.full_path.rstrip('?'), request.endpoint,
+            g.pop('profile_status', status.HTTP_500_INTERNAL_SERVER_ERROR),
+            time.time() - started, started, stats))
+
+    def list_view(self):
+        if not self._is_admin():
+            return jsonify(message='Forbidden'), status.HTTP_403_FORBIDDEN
+        return jsonify(profiles=[p.summary() for p in self.store.slowest()])
+
+    def profile_view(self, profile_id):
+        if not self._is_admin():
+            return jsonify(message='Forbidden'), status.HTTP_403_FORBIDDEN
+        profile = self.store.get(profile_id)
+        if profile is None:
+            return (jsonify(message='Profile not found'),
+                    status.HTTP_404_NOT_FOUND)
+        fmt = request.args.get('format', 'pstats')
+        if fmt == 'pstats':
+            return Response(profile.pstats_data(),
+                            mimetype='application/octet-stream',
+                            headers={'Content-Disposition':
+                                     'attachment; filename=profile-{}.pstats'
+                                     .format(profile_id)})
+        if fmt == 'collapsed':
+            return Response(profile.collapsed(), mimetype='text/plain')
+        return (jsonify(message='Unknown format: ' + fmt),
+                status.HTTP_400_BAD_REQUEST)
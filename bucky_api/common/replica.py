@@ -0,0 +1,32 @@
+"""
+Routing of read-only requests to the database replica
+
+Reads of a user who wrote within REPLICA_STICKY_SECONDS stay on the
+primary, so that nobody sees their own write disappear while the
+replica catches up.
+"""
+from functools import wraps
+
+from flask import g
+
+from bucky_api import db, write_tracker
+
+
+def replica_reads(f):
+    """
+    Decorate a resource's get method to read from the replica
+
+    Only applies when a replica bind is configured. Authentication has
+    already run on the primary by the time the method is called.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not write_tracker.enabled or write_tracker.is_recent(
+                g.current_user.id):
+            return f(*args, **kwargs)
+        db.session.info['use_replica'] = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            db.session.info.pop('use_replica', None)
+    return decorated
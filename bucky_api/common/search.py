@@ -0,0 +1,93 @@
+"""
+Full-text search over bucket-list names
+
+Terms are split into words and every word is matched as a prefix, so
+`buck 3` finds `my bucket 3`. Matching is index-backed and ranked:
+
+- PostgreSQL: GIN index over to_tsvector('simple', name), ranked with
+  ts_rank
+- SQLite: FTS5 shadow table kept in sync with triggers, ranked with bm25
+
+Other databases fall back to an unranked LIKE scan.
+"""
+import re
+
+from sqlalchemy import DDL, event, func, literal_column, table, column
+
+from bucky_api import db
+from bucky_api.models import BucketList
+
+SQLITE_FTS_TABLE = 'bucketlists_fts'
+
+SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE bucketlists_fts USING fts5("
+    "name, content='bucketlists', content_rowid='id')",
+    "CREATE TRIGGER bucketlists_fts_ai AFTER INSERT ON bucketlists BEGIN "
+    "INSERT INTO bucketlists_fts(rowid, name) VALUES (new.id, new.name); "
+    "END",
+    "CREATE TRIGGER bucketlists_fts_ad AFTER DELETE ON bucketlists BEGIN "
+    "INSERT INTO bucketlists_fts(bucketlists_fts, rowid, name) "
+    "VALUES ('delete', old.id, old.name); "
+    "END",
+    "CREATE TRIGGER bucketlists_fts_au AFTER UPDATE OF name ON bucketlists "
+    "BEGIN "
+    "INSERT INTO bucketlists_fts(bucketlists_fts, rowid, name) "
+    "VALUES ('delete', old.id, old.name); "
+    "INSERT INTO bucketlists_fts(rowid, name) VALUES (new.id, new.name); "
+    "END",
+)
+
+POSTGRESQL_DDL = (
+    "CREATE INDEX ix_bucketlists_name_tsv ON bucketlists "
+    "USING gin (to_tsvector('simple'::regconfig, coalesce(name, '')))",
+)
+
+# keep the search structures in step with db.create_all / db.drop_all
+for statement in SQLITE_DDL:
+    event.listen(BucketList.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite'))
+event.listen(BucketList.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS bucketlists_fts')
+             .execute_if(dialect='sqlite'))
+for statement in POSTGRESQL_DDL:
+    event.listen(BucketList.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='postgresql'))
+
+_fts = table(SQLITE_FTS_TABLE, column('rowid'), column('rank'))
+_tsvector = func.to_tsvector(literal_column("'simple'::regconfig"),
+                             func.coalesce(BucketList.name, ''))
+
+
+def search_words(search_term):
+    """
+    Words of a search term, stripped of query syntax
+
+    :rtype: list
+    """
+    return re.findall(r'\w+', search_term, re.UNICODE)
+
+
+def search_bucketlists(query, search_term):
+    """
+    Restrict a bucket-list query to names matching search_term
+
+    :param query: bucket-list query to restrict
+    :param search_term: raw search term from the request
+    :return: (query, rank) where rank is an expression to order by for
+        best matches first, or None if the backend cannot rank
+    :rtype: tuple
+    """
+    words = search_words(search_term)
+    dialect = db.session.get_bind().dialect.name
+    if words and dialect == 'sqlite':
+        match = ' '.join('"{}"*'.format(word) for word in words)
+        query = (query.join(_fts, _fts.c.rowid == BucketList.id)
+                 .filter(literal_column(SQLITE_FTS_TABLE).op('MATCH')(match)))
+        # fts5 rank is bm25, smaller is better
+        return query, _fts.c.rank.asc()
+    if words and dialect == 'postgresql':
+        tsquery = func.to_tsquery(literal_column("'simple'::regconfig"),
+                                  ' & '.join(w + ':*' for w in words))
+        query = query.filter(_tsvector.op('@@')(tsquery))
+        return query, func.ts_rank(_tsvector, tsquery).desc()
+    return query.filter(BucketList.name.like('%' + search_term + '%')), None
@@ -0,0 +1,144 @@
+"""
+Bulk generation of synthetic users, bucket-lists and tasks
+
+Rows are generated in Python from a random.Random seeded by the caller,
+so the same seed and counts produce the same names on an empty database,
+and written without building ORM objects:
+
+- PostgreSQL: COPY ... FROM STDIN, one per table and batch, followed by
+  resetting the id sequences and ANALYZE
+- other databases: executemany Core inserts
+
+Ids are assigned here, after the highest existing id of each table, so
+tasks can reference the bucket-lists of their batch without reading
+ids back. Every user shares one password, hashed once. Each batch is
+committed on its own, an interrupted run keeps the batches written.
+"""
+import csv
+import io
+import random
+
+from bucky_api import db
+from bucky_api.models import BucketList, Task, User
+
+# words bucket-list names and task descriptions are drawn from
+VERBS = (
+    'visit', 'climb', 'learn', 'build', 'cook', 'paint', 'run', 'swim',
+    'read', 'write', 'photograph', 'sail', 'ride', 'explore', 'taste',
+    'plant', 'restore', 'record', 'teach', 'cross',
+)
+ADJECTIVES = (
+    'ancient', 'quiet', 'frozen', 'hidden', 'northern', 'golden', 'wild',
+    'tiny', 'famous', 'distant', 'red', 'old', 'green', 'tropical',
+    'forgotten', 'sunny', 'deep', 'vast', 'local', 'rare',
+)
+NOUNS = (
+    'mountain', 'river', 'castle', 'island', 'desert', 'forest', 'temple',
+    'volcano', 'glacier', 'canyon', 'market', 'lighthouse', 'garden',
+    'bridge', 'museum', 'reef', 'valley', 'harbour', 'library', 'festival',
+    'guitar', 'language', 'marathon', 'recipe', 'novel', 'boat', 'cabin',
+    'telescope', 'vineyard', 'waterfall',
+)
+
+
+def _bucketlist_name(rng, number):
+    # the number keeps names unique per user
+    return '{} {} {}'.format(rng.choice(ADJECTIVES), rng.choice(NOUNS),
+                             number)
+
+
+def _task_description(rng, number):
+    return '{} the {} {} {}'.format(rng.choice(VERBS),
+                                    rng.choice(ADJECTIVES),
+                                    rng.choice(NOUNS), number)
+
+
+def _next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+def _copy(table, rows):
+    """Write rows of table through COPY in the session's transaction"""
+    columns = list(rows[0])
+    data = io.StringIO()
+    writer = csv.writer(data)
+    for row in rows:
+        writer.writerow([row[c] for c in columns])
+    data.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+            table.name, ', '.join(columns)), data)
+    finally:
+        cursor.close()
+
+
+def _write(table, rows, use_copy):
+    if not rows:
+        return
+    if use_copy:
+        _copy(table, rows)
+    else:
+        db.session.execute(table.insert(), rows)
+
+
+def seed(users, bucketlists, tasks, password, seed=0, batch_size=10000,
+         progress=None):
+    """
+    Insert users each having bucketlists bucket-lists of tasks tasks
+
+    :param password: password of every generated user
+    :param seed: seed of the generated names
+    :param batch_size: rows written per transaction, approximately;
+        users are never split across batches
+    :param progress: called with the number of users written after
+        every batch
+    :return: number of users, bucket-lists and tasks inserted
+    :rtype: tuple
+    """
+    rng = random.Random(seed)
+    use_copy = db.session.get_bind().dialect.name == 'postgresql'
+    password_hashed = User(password=password).password_hashed
+    user_id = _next_id(User)
+    bucketlist_id = _next_id(BucketList)
+    task_id = _next_id(Task)
+    first_user_id = user_id
+    per_user = 1 + bucketlists + bucketlists * tasks
+    users_per_batch = max(1, batch_size // per_user)
+
+    for batch_start in range(0, users, users_per_batch):
+        user_rows, bucketlist_rows, task_rows = [], [], []
+        for _ in range(min(users_per_batch, users - batch_start)):
+            user_rows.append({
+                'id': user_id, 'username': 'user{}'.format(user_id),
+                'password_hashed': password_hashed, 'credential_version': 1,
+                'bucketlist_count': bucketlists, 'data_version': 0})
+            for b in range(bucketlists):
+                bucketlist_rows.append({
+                    'id': bucketlist_id, 'name': _bucketlist_name(rng, b),
+                    'user_id': user_id, 'task_count': tasks, 'version': 0})
+                for t in range(tasks):
+                    task_rows.append({
+                        'id': task_id,
+                        'description': _task_description(rng, t),
+                        'user_id': user_id, 'bucketlist_id': bucketlist_id})
+                    task_id += 1
+                bucketlist_id += 1
+            user_id += 1
+        _write(User.__table__, user_rows, use_copy)
+        _write(BucketList.__table__, bucketlist_rows, use_copy)
+        _write(Task.__table__, task_rows, use_copy)
+        db.session.commit()
+        if progress is not None:
+            progress(user_id - first_user_id)
+
+    if use_copy:
+        # rows written with explicit ids leave the sequences behind
+        for model in (User, BucketList, Task):
+            db.session.execute(
+                "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                "coalesce(max(id), 0) + 1, false) FROM {0}".format(
+                    model.__tablename__))
+        db.session.execute('ANALYZE users, bucketlists, tasks')
+        db.session.commit()
+    return users, users * bucketlists, users * bucketlists * tasks
@@ -0,0 +1,201 @@
+"""
+Precompiled serializers for marshmallow schemas
+
+compile_schema reads a schema's field definitions once and generates
+plain Python dump and load functions specialised to those fields, without
+per-call field lookups, accessor dispatch or error bookkeeping.
+
+The generated code only handles the shapes it can prove identical to
+marshmallow: declared Integer, String and Nested fields holding values of
+their exact type. Anything else, e.g. a missing required field or a value
+of the wrong type, raises _Fallback inside the generated function and the
+whole call is redone by marshmallow itself. Output and validation errors
+are therefore those of marshmallow, and only the common path is fast.
+"""
+from marshmallow import Schema, fields, missing
+from marshmallow.schema import MarshalResult, UnmarshalResult
+
+from bucky_api.common.instrumentation import timed
+
+
+class _Fallback(Exception):
+    """Raised by generated code when marshmallow has to handle a value"""
+
+
+class _Unsupported(Exception):
+    """Raised at compile time for schemas the compiler cannot specialise"""
+
+
+_SIMPLE_TYPES = {fields.Integer: 'int', fields.String: 'str'}
+
+
+def _check_field(field):
+    if type(field) not in _SIMPLE_TYPES and type(field) is not fields.Nested:
+        raise _Unsupported(type(field).__name__)
+    if field.default is not missing or field.missing is not missing:
+        raise _Unsupported('default')
+    if field.validators or field.load_from or field.allow_none:
+        raise _Unsupported('validation options')
+    if field.attribute and '.' in field.attribute:
+        raise _Unsupported('dotted attribute')
+    if isinstance(field, fields.Number) and field.as_string:
+        raise _Unsupported('as_string')
+
+
+def _check_schema(schema):
+    if schema._has_processors or schema.ordered:
+        raise _Unsupported('processors')
+    if schema.opts.fields or schema.opts.additional:
+        raise _Unsupported('implicit fields')
+    if type(schema).get_attribute is not Schema.get_attribute:
+        raise _Unsupported('custom accessor')
+    for field in schema.fields.values():
+        _check_field(field)
+
+
+def _build(source, name, namespace):
+    code = compile(source, '<compiled {}>'.format(name), 'exec')
+    exec(code, namespace)
+    return namespace[name]
+
+
+def compile_dump(schema):
+    """
+    Generate a function dumping a single object like schema.dump
+
+    :return: function taking an object and returning the dumped dict,
+        raising _Fallback for values it does not handle
+    """
+    _check_schema(schema)
+    namespace = {'MISSING': missing, '_Fallback': _Fallback}
+    dump_fields = [(name, field) for name, field in schema.fields.items()
+                   if not field.load_only]
+
+    lines = ['def dump(obj):',
+             '    if type(obj) is dict:']
+    for i, (name, field) in enumerate(dump_fields):
+        lines.append('        v{} = obj.get({!r}, MISSING)'.format(
+            i, field.attribute or name))
+    lines += ['        pass',
+              "    elif hasattr(obj, '__getitem__'):",
+              '        raise _Fallback()',
+              '    else:']
+    for i, (name, field) in enumerate(dump_fields):
+        lines.append('        v{} = getattr(obj, {!r}, MISSING)'.format(
+            i, field.attribute or name))
+    lines += ['        pass',
+              '    out = {}']
+    for i, (name, field) in enumerate(dump_fields):
+        key = field.dump_to or name
+        lines.append('    if v{} is None:'.format(i))
+        lines.append('        out[{!r}] = None'.format(key))
+        if type(field) is fields.Nested:
+            nested = 'dump_{}'.format(i)
+            namespace[nested] = compile_dump(field.schema)
+            lines.append('    elif v{} is not MISSING:'.format(i))
+            if field.many:
+                lines.append('        out[{!r}] = [{}(x) for x in v{}]'.format(
+                    key, nested, i))
+            else:
+                lines.append('        out[{!r}] = {}(v{})'.format(
+                    key, nested, i))
+        else:
+            lines.append('    elif type(v{}) is {}:'.format(
+                i, _SIMPLE_TYPES[type(field)]))
+            lines.append('        out[{!r}] = v{}'.format(key, i))
+            lines.append('    elif v{} is not MISSING:'.format(i))
+            lines.append('        raise _Fallback()')
+    lines.append('    return out')
+    return _build('\n'.join(lines) + '\n', 'dump', namespace)
+
+
+def compile_load(schema):
+    """
+    Generate a function loading a single dict like schema.load
+
+    :return: function taking input data and returning the loaded dict,
+        raising _Fallback for input it does not handle
+    """
+    _check_schema(schema)
+    namespace = {'MISSING': missing, '_Fallback': _Fallback}
+    load_fields = [(name, field) for name, field in schema.fields.items()
+                   if not field.dump_only]
+
+    lines = ['def load(data):',
+             '    if type(data) is not dict:',
+             '        raise _Fallback()',
+             '    out = {}']
+    for i, (name, field) in enumerate(load_fields):
+        if type(field) is fields.Nested:
+            raise _Unsupported('nested load')
+        lines.append('    v{} = data.get({!r}, MISSING)'.format(i, name))
+        lines.append('    if type(v{}) is {}:'.format(
+            i, _SIMPLE_TYPES[type(field)]))
+        lines.append('        out[{!r}] = v{}'.format(
+            field.attribute or name, i))
+        if field.required:
+            lines.append('    else:')
+        else:
+            lines.append('    elif v{} is not MISSING:'.format(i))
+        lines.append('        raise _Fallback()')
+    lines.append('    return out')
+    return _build('\n'.join(lines) + '\n', 'load', namespace)
+
+
+class CompiledSchema(object):
+    """
+    Drop-in replacement for a marshmallow schema's dump and load
+
+    Results are MarshalResult/UnmarshalResult tuples like marshmallow's.
+    Directions the compiler cannot specialise use the schema directly.
+
+    Attributes:
+        schema -- the marshmallow schema the functions were generated from
+        many -- default for the many argument of dump and load
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.many = schema.many
+        try:
+            self._dump = compile_dump(schema)
+        except _Unsupported:
+            self._dump = None
+        try:
+            self._load = compile_load(schema)
+        except _Unsupported:
+            self._load = None
+
+    @timed('dump')
+    def dump(self, obj, many=None):
+        many = self.many if many is None else bool(many)
+        if self._dump is not None:
+            try:
+                if many:
+                    return MarshalResult([self._dump(o) for o in obj], {})
+                return MarshalResult(self._dump(obj), {})
+            except (_Fallback, TypeError):
+                pass
+        return self.schema.dump(obj, many=many)
+
+    def load(self, data, many=None):
+        many = self.many if many is None else bool(many)
+        if self._load is not None:
+            try:
+                if many:
+                    if type(data) is not list:
+                        raise _Fallback()
+                    return UnmarshalResult([self._load(d) for d in data], {})
+                return UnmarshalResult(self._load(data), {})
+            except _Fallback:
+                pass
+        return self.schema.load(data, many=many)
+
+
+def compile_schema(schema):
+    """
+    Compile a schema instance into a CompiledSchema
+
+    :rtype: CompiledSchema
+    """
+    return CompiledSchema(schema)
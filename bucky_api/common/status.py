@@ -4,10 +4,15 @@ HTTP status codes
 
 HTTP_200_OK = 200
 HTTP_201_CREATED = 201
+HTTP_207_MULTI_STATUS = 207
+HTTP_304_NOT_MODIFIED = 304
 HTTP_400_BAD_REQUEST = 400
 HTTP_401_UNAUTHORIZED = 401
 HTTP_403_FORBIDDEN = 403
 HTTP_404_NOT_FOUND = 404
 HTTP_409_CONFLICT = 409
+HTTP_413_REQUEST_ENTITY_TOO_LARGE = 413
 HTTP_422_UNPROCESSABLE_ENTITY = 422
+HTTP_424_FAILED_DEPENDENCY = 424
 HTTP_500_INTERNAL_SERVER_ERROR = 500
+HTTP_503_SERVICE_UNAVAILABLE = 503
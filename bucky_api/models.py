@@ -1,9 +1,92 @@
+import time
+from functools import lru_cache
+
 from flask import current_app
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from marshmallow import Schema, fields
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import case
+
+from bucky_api import credential_cache, db, password_hasher, write_tracker
+
+
+######## TOKENS ########
+
+@lru_cache(maxsize=16)
+def _token_serializer(secret_key, expires_in=None):
+    """Serializers are stateless, so build one per key and expiry only"""
+    return Serializer(secret_key, expires_in=expires_in)
+
+
+def _generate_auth_token(identity, expiration):
+    s = _token_serializer(current_app.config['SECRET_KEY'], expiration)
+    return s.dumps({'id': identity.id,
+                    'username': identity.username,
+                    'ver': identity.credential_version})
+
+
+def _load_auth_token(token):
+    s = _token_serializer(current_app.config['SECRET_KEY'])
+    try:
+        return s.loads(token)
+    except:
+        return None
+
+
+######## BULK HELPERS ########
+
+def _chunks(values):
+    """Split values into lists of BULK_CHUNK_SIZE, small enough for the
+    bound parameter limits of every backend"""
+    values = list(values)
+    size = current_app.config['BULK_CHUNK_SIZE']
+    return [values[start:start + size]
+            for start in range(0, len(values), size)]
+
 
-from bucky_api import db
+def _existing_values(model, key, values, **scope):
+    """
+    Rows of model within scope whose key column is one of values
+
+    Looked up with one IN query per chunk of values.
+
+    :return: ids of the matching rows by key
+    :rtype: dict
+    """
+    column = getattr(model, key)
+    existing = {}
+    for chunk in _chunks(values):
+        rows = db.session.query(column, model.id).filter_by(**scope).filter(
+            column.in_(chunk))
+        existing.update(rows)
+    return existing
+
+
+def _insert_many(model, key, values, **scope):
+    """
+    Insert one row of model per value of its key column in the current
+    transaction
+
+    Rows are sent as multi-row INSERT statements, one per chunk, without
+    building ORM objects. Every row gets the scope columns, within which
+    key has to be unique for the new ids to be told apart.
+
+    :return: ids of the new rows by key
+    :rtype: dict
+    """
+    table = model.__table__
+    returning = db.session.get_bind().dialect.name == 'postgresql'
+    ids = {}
+    for chunk in _chunks(values):
+        rows = [dict(scope, **{key: value}) for value in chunk]
+        statement = table.insert().values(rows)
+        if returning:
+            ids.update((value, id) for id, value in db.session.execute(
+                statement.returning(table.c.id, table.c[key])))
+        else:
+            # no RETURNING, read the ids back by their unique keys
+            db.session.execute(statement)
+            ids.update(_existing_values(model, key, chunk, **scope))
+    return ids
 
 
 ######## MODELS ########
@@ -17,11 +100,23 @@ class User(db.Model):
         id -- unique identification of user
         username -- username of user
         password_hashed -- hashed user password
+        credential_version -- bumped on every password change, invalidates
+            tokens issued before the change; in stateless mode workers on
+            other hosts notice within AUTH_CACHE_TTL
+        bucketlist_count -- number of bucket-lists owned by the user
+        data_version -- bumped on every write to the user's data, used to
+            answer conditional requests
     """
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, index=True)
     password_hashed = db.Column(db.String(128))
+    credential_version = db.Column(db.Integer, nullable=False,
+                                   default=1, server_default='1')
+    bucketlist_count = db.Column(db.Integer, nullable=False,
+                                 default=0, server_default='0')
+    data_version = db.Column(db.Integer, nullable=False,
+                             default=0, server_default='0')
     bucketlists = db.relationship('BucketList', backref='user', lazy='dynamic')
     tasks = db.relationship('Task', backref='user', lazy='dynamic')
 
@@ -31,28 +126,130 @@ class User(db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hashed = generate_password_hash(password)
+        self.password_hashed = password_hasher.hash(password)
+        self.credential_version = (self.credential_version or 0) + 1
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hashed, password)
+        return password_hasher.verify(self.password_hashed, password)
+
+    def upgrade_password_hash(self, password):
+        """
+        Rehash a verified password if the configured strength changed
+
+        Unlike setting the password this keeps the credential version,
+        so tokens already issued stay valid.
+
+        :return: True if the stored hash was replaced
+        :rtype: bool
+        """
+        if not password_hasher.needs_rehash(self.password_hashed):
+            return False
+        self.password_hashed = password_hasher.hash(password)
+        return True
 
     def generate_auth_token(self, expiration=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expires_in=expiration)
-        return s.dumps({'id': self.id})
+        return _generate_auth_token(self, expiration)
+
+    @staticmethod
+    def record_write(user_id, bucketlist_delta=0):
+        """
+        Bump a user's data version in the current transaction, adding
+        bucketlist_delta to the bucket-list counter on the way
+
+        Every write to a user's data goes through here so that conditional
+        requests can tell whether anything changed, and so that the user's
+        reads stay on the primary database for a while.
+        """
+        write_tracker.record(user_id)
+        values = {User.data_version: User.data_version + 1}
+        if bucketlist_delta:
+            values[User.bucketlist_count] = (User.bucketlist_count +
+                                             bucketlist_delta)
+        User.query.filter_by(id=user_id).update(
+            values, synchronize_session=False)
 
     @staticmethod
     def verify_auth_token(token):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-        except:
+        """
+        Verify a token against the database
+
+        :return: the token's user, None if the token is invalid, expired
+            or was issued before the user's last password change
+        :rtype: User
+        """
+        data = _load_auth_token(token)
+        if data is None:
+            return None
+        user = User.query.get(data['id'])
+        if user is None or data.get('ver', 1) != user.credential_version:
+            return None
+        return user
+
+    @staticmethod
+    def verify_auth_token_claims(token):
+        """
+        Verify a token from its signed claims and the user's cached
+        credential version, without loading the user
+
+        The version is read from the database on a cache miss. Tokens
+        issued before claims were embedded fall back to verify_auth_token.
+
+        :return: identity of the token's user or None if the token is
+            invalid, expired or was issued before the user's last password
+            change
+        :rtype: UserIdentity
+        """
+        data = _load_auth_token(token)
+        if data is None:
+            return None
+        if 'ver' not in data or 'username' not in data:
+            user = User.verify_auth_token(token)
+            return UserIdentity.from_user(user) if user else None
+        version = credential_cache.get_version(data['id'])
+        if version is None:
+            checked_at = time.time()
+            version = db.session.query(User.credential_version).filter_by(
+                id=data['id']).scalar()
+            if version is None:
+                return None
+            credential_cache.set_version(data['id'], version, checked_at)
+        if data['ver'] != version:
             return None
-        return User.query.get(data['id'])
+        return UserIdentity(data['id'], data['username'], data['ver'])
 
     def __repr__(self):
         return 'User <{}>'.format(self.username)
 
 
+class UserIdentity(object):
+    """Lightweight stand-in for an authenticated user
+
+    Built from verified credentials without touching the database. It
+    is shared through the credential cache, handlers that need the user
+    row query it themselves.
+
+    Attributes:
+        id -- unique identification of user
+        username -- username of user
+        credential_version -- credential version the identity was issued for
+    """
+
+    def __init__(self, id, username, credential_version):
+        self.id = id
+        self.username = username
+        self.credential_version = credential_version
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.credential_version)
+
+    def generate_auth_token(self, expiration=3600):
+        return _generate_auth_token(self, expiration)
+
+    def __repr__(self):
+        return 'UserIdentity <{}>'.format(self.username)
+
+
 class BucketList(db.Model):
     """Class for bucket-list instances
 
@@ -62,12 +259,139 @@ class BucketList(db.Model):
         id -- unique identification of bucket-list
         name -- name of the bucket-list
         user_id -- id of the user that owns the bucket-list
+        task_count -- number of tasks in the bucket-list
+        version -- bumped on every write to the bucket-list or its tasks,
+            used to answer conditional requests for them
     """
     __tablename__ = 'bucketlists'
+    __table_args__ = (
+        # serves listings, WHERE user_id = ? AND id > ? ORDER BY id, and
+        # covers the name so id/name projections skip the table; the task
+        # counter and version are left out as they change on every task
+        # write
+        db.Index('ix_bucketlists_user_id_id_name', 'user_id', 'id', 'name'),
+        # bucket-list names are unique per user
+        db.Index('uq_bucketlists_user_id_name', 'user_id', 'name',
+                 unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64))
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    tasks = db.relationship('Task', backref='bucketlist', lazy='dynamic')
+    task_count = db.Column(db.Integer, nullable=False,
+                           default=0, server_default='0')
+    version = db.Column(db.Integer, nullable=False,
+                        default=0, server_default='0')
+    # the database deletes tasks along with their bucket-list
+    tasks = db.relationship('Task', backref='bucketlist', lazy='dynamic',
+                            cascade='all, delete-orphan', passive_deletes=True)
+
+    @property
+    def task_list(self):
+        """Tasks of the bucket-list, the prefetched ones if available"""
+        prefetched = self.__dict__.get('_prefetched_tasks')
+        if prefetched is not None:
+            return prefetched
+        return self.tasks.order_by(Task.id).all()
+
+    @staticmethod
+    def record_write(bucketlist_id, task_delta=0):
+        """
+        Bump a bucket-list's version in the current transaction, adding
+        task_delta to the task counter on the way
+
+        Every write to a bucket-list's tasks goes through here, as well
+        as User.record_write, so that conditional requests for the
+        bucket-list alone can tell whether it changed.
+        """
+        values = {BucketList.version: BucketList.version + 1}
+        if task_delta:
+            values[BucketList.task_count] = BucketList.task_count + task_delta
+        BucketList.query.filter_by(id=bucketlist_id).update(
+            values, synchronize_session=False)
+
+    @staticmethod
+    def prefetch_tasks(bucketlists):
+        """
+        Load the tasks of many bucket-lists with a single query
+
+        Serializing bucket-lists afterwards does not hit the database
+        once per bucket-list.
+
+        :return: the same bucket-lists
+        :rtype: list
+        """
+        by_bucketlist = dict((bucketlist.id, []) for bucketlist in bucketlists)
+        if by_bucketlist:
+            tasks = Task.query.filter(
+                Task.bucketlist_id.in_(list(by_bucketlist))).order_by(Task.id)
+            for task in tasks:
+                by_bucketlist[task.bucketlist_id].append(task)
+        for bucketlist in bucketlists:
+            bucketlist._prefetched_tasks = by_bucketlist[bucketlist.id]
+        return bucketlists
+
+    @staticmethod
+    def existing_names(user_id, names):
+        """
+        Bucket-lists of a user having one of the given names
+
+        :return: ids of the bucket-lists by name
+        :rtype: dict
+        """
+        return _existing_values(BucketList, 'name', names, user_id=user_id)
+
+    @staticmethod
+    def insert_many(user_id, names):
+        """
+        Insert bucket-lists for a user in the current transaction, see
+        _insert_many. Names must not exist for the user yet.
+
+        :return: ids of the new bucket-lists by name
+        :rtype: dict
+        """
+        return _insert_many(BucketList, 'name', names, user_id=user_id)
+
+    @staticmethod
+    def owned_ids(user_id, ids):
+        """
+        Which of the given bucket-list ids belong to a user
+
+        :return: current names of the owned bucket-lists by id
+        :rtype: dict
+        """
+        owned = {}
+        for chunk in _chunks(ids):
+            owned.update(db.session.query(BucketList.id, BucketList.name)
+                         .filter(BucketList.user_id == user_id,
+                                 BucketList.id.in_(chunk)))
+        return owned
+
+    @staticmethod
+    def rename_many(user_id, names_by_id):
+        """Rename bucket-lists of a user with one UPDATE per chunk in the
+        current transaction, bumping their versions"""
+        for chunk in _chunks(names_by_id):
+            BucketList.query.filter(
+                BucketList.user_id == user_id,
+                BucketList.id.in_(chunk)
+            ).update({BucketList.name: case(
+                dict((id, names_by_id[id]) for id in chunk),
+                value=BucketList.id),
+                BucketList.version: BucketList.version + 1},
+                synchronize_session=False)
+
+    @staticmethod
+    def delete_many(user_id, ids):
+        """
+        Delete bucket-lists of a user in the current transaction
+
+        One DELETE per chunk, their tasks go with them through the
+        ON DELETE CASCADE foreign key.
+        """
+        for chunk in _chunks(ids):
+            BucketList.query.filter(
+                BucketList.user_id == user_id,
+                BucketList.id.in_(chunk)).delete(synchronize_session=False)
 
     def __repr__(self):
         return 'BucketList <{}>'.format(self.name)
@@ -83,10 +407,43 @@ class Task(db.Model):
         bucketlist_id -- id of bucket-list that the task belongs to
         """
     __tablename__ = 'tasks'
+    __table_args__ = (
+        # serves task listings, WHERE bucketlist_id = ? AND user_id = ?
+        # AND id > ? ORDER BY id, and covers the description so listings
+        # and q= filters are answered from the index alone
+        db.Index('ix_tasks_bucketlist_id_user_id_id_description',
+                 'bucketlist_id', 'user_id', 'id', 'description'),
+        # task descriptions are unique per bucket-list
+        db.Index('uq_tasks_bucketlist_id_description',
+                 'bucketlist_id', 'description', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     description = db.Column(db.String(64))
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    bucketlist_id = db.Column(db.Integer, db.ForeignKey('bucketlists.id'))
+    bucketlist_id = db.Column(db.Integer, db.ForeignKey('bucketlists.id',
+                                                        ondelete='CASCADE'))
+
+    @staticmethod
+    def existing_descriptions(bucketlist_id, descriptions):
+        """
+        Which of the given descriptions a bucket-list already has a task for
+
+        :rtype: set
+        """
+        return set(_existing_values(Task, 'description', descriptions,
+                                    bucketlist_id=bucketlist_id))
+
+    @staticmethod
+    def insert_many(bucketlist_id, user_id, descriptions):
+        """
+        Insert tasks into a bucket-list in the current transaction,
+        see _insert_many. Descriptions must not exist in the bucket-list yet.
+
+        :return: ids of the new tasks by description
+        :rtype: dict
+        """
+        return _insert_many(Task, 'description', descriptions,
+                            bucketlist_id=bucketlist_id, user_id=user_id)
 
     def __repr__(self):
         return 'Task <{}>'.format(self.description)
@@ -103,7 +460,9 @@ class TaskSchema(Schema):
 class BucketListSchema(Schema):
     id = fields.Int(dump_only=True)
     name = fields.Str(required=True)
-    tasks = fields.Nested(TaskSchema, many=True, dump_only=True)
+    task_count = fields.Int(dump_only=True)
+    tasks = fields.Nested(TaskSchema, many=True, dump_only=True,
+                          attribute='task_list')
 
 
 class UserSchema(Schema):
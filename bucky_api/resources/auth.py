@@ -1,17 +1,23 @@
+import time
 from functools import wraps
 
-from flask import g, request, Blueprint, make_response
+from flask import g, request, Blueprint, make_response, current_app
 from flask_httpauth import HTTPBasicAuth
-from flask_restful import Resource, Api
-from sqlalchemy.exc import SQLAlchemyError
-from bucky_api import db
+from flask_restful import Resource, Api, abort
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from bucky_api import db, credential_cache
 
 from bucky_api.common import status
-from bucky_api.models import User, UserSchema
+from bucky_api.common.database import is_unique_violation
+from bucky_api.common.hashing import HashingQueueFull
+from bucky_api.common.instrumentation import output_json, timed
+from bucky_api.common.serializers import compile_schema
+from bucky_api.models import User, UserIdentity, UserSchema
 
 # CREATE BLUEPRINT
 auth_bp = Blueprint('auth', __name__)
 auth_api = Api(auth_bp)
+auth_api.representation('application/json')(output_json)
 
 
 # CUSTOM HTTP BASIC AUTH CLASS
@@ -37,23 +43,54 @@ auth = CustomHTTPBasicAuth()
 
 
 @auth.verify_password
+@timed('auth')
 def verify_credentials(username_or_token, password):
     """callback func to be used by resources that need authentication"""
+    if g.get('batch_identity') is not None:
+        # sub-request of a batch, whose credentials were already verified
+        g.current_user = g.batch_identity
+        return True
     if not username_or_token:
         # impossible to verify
         return False
+    # cached checks are only trusted if no worker invalidated the user
+    # after this time
+    g.credentials_checked_at = time.time()
     if not password:
         # using token
-        g.current_user = User.verify_auth_token(username_or_token)
+        if current_app.config['AUTH_TOKEN_STATELESS']:
+            g.current_user = User.verify_auth_token_claims(username_or_token)
+        else:
+            g.current_user = User.verify_auth_token(username_or_token)
         g.token_used = True
         return g.current_user is not None
-        # using username and password
-    user = User.query.filter_by(username=username_or_token).first()
-    if user and user.verify_password(password):
-        g.current_user = user
+    # using username and password
+    identity = credential_cache.get(username_or_token, password)
+    if identity is not None:
+        g.current_user = identity
         g.token_used = False
         return True
-    return False
+    user = User.query.filter_by(username=username_or_token).first()
+    try:
+        if not user or not user.verify_password(password):
+            return False
+    except HashingQueueFull:
+        abort(status.HTTP_503_SERVICE_UNAVAILABLE,
+              message="Server busy, try again later")
+    # the old hash still verifies, failed upgrades wait for a later login
+    try:
+        if user.upgrade_password_hash(password):
+            db.session.commit()
+    except HashingQueueFull:
+        pass
+    except SQLAlchemyError:
+        db.session.rollback()
+    credential_cache.set(username_or_token, password, user.id,
+                         UserIdentity.from_user(user),
+                         g.credentials_checked_at)
+    g.current_user = user
+    g.token_used = False
+    return True
 
 
 class AuthRequiredResource(Resource):
@@ -69,12 +106,16 @@ class TokenResource(AuthRequiredResource):
         if g.token_used:
             return {"message": "Invalid credentials"}, status.HTTP_401_UNAUTHORIZED
         token = g.current_user.generate_auth_token(expiration=3600)
+        # spares the first use of the token a credential version query
+        credential_cache.set_version(g.current_user.id,
+                                     g.current_user.credential_version,
+                                     g.credentials_checked_at)
         return {'token': token.decode('ascii'),
                 'expiration': 3600}
 
 
 # INDIVIDUAL USER RESOURCE
-user_schema = UserSchema()
+user_schema = compile_schema(UserSchema())
 
 
 class UserResource(AuthRequiredResource):
@@ -108,13 +149,18 @@ class UserResource(AuthRequiredResource):
 
         # patch user object
         # only password can be changed for this app
-        user.password = data['password']
+        try:
+            user.password = data['password']
+        except HashingQueueFull:
+            return {"message": "Server busy, try again later"}, status.HTTP_503_SERVICE_UNAVAILABLE
 
         try:
             db.session.add(user)
-            db.session.commit()
-            # serialize user object
+            User.record_write(user.id)
+            # serialize user object before the commit expires it
             result = user_schema.dump(user)
+            db.session.commit()
+            credential_cache.invalidate_user(user_id)
             return result.data
 
         except SQLAlchemyError as e:
@@ -137,23 +183,29 @@ class UserCollectionResource(Resource):
         if errors:
             return errors, status.HTTP_422_UNPROCESSABLE_ENTITY
 
-        # check if user already exists
-        user = User.query.filter_by(username=data['username']).first()
-        if user:
-            return {"message": "This username already exist"}, status.HTTP_409_CONFLICT
-
-        # create user
-        user = User(username=data['username'],
-                    password=data['password'])
+        # create user, the unique index rejects existing usernames
+        try:
+            user = User(username=data['username'],
+                        password=data['password'])
+        except HashingQueueFull:
+            return {"message": "Server busy, try again later"}, status.HTTP_503_SERVICE_UNAVAILABLE
 
         try:
             db.session.add(user)
+            db.session.flush()
+            # serialize user object before the commit expires it
+            result = user_schema.dump(user)
             db.session.commit()
-            # serialize user object
-            result = user_schema.dump(User.query.get(user.id))
             return {"message": "User registered",
                     "user": result.data}, status.HTTP_201_CREATED
 
+        except IntegrityError as e:
+            db.session.rollback()
+            if not is_unique_violation(e, User.__table__, 'ix_users_username'):
+                return {"message": "Failed to create",
+                        "error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+            return {"message": "This username already exist"}, status.HTTP_409_CONFLICT
+
         except SQLAlchemyError as e:
             db.session.rollback()
             return {"message": "Failed to create",
@@ -0,0 +1,159 @@
+import json
+
+from flask import request, Blueprint, g, current_app
+from flask_restful import Api
+
+from bucky_api import db
+from bucky_api.common import status
+from bucky_api.common.instrumentation import output_json
+from bucky_api.common.helpers import bulk_status, get_json_ordered
+from bucky_api.models import User, UserIdentity
+from bucky_api.resources.auth import AuthRequiredResource
+
+# CREATE BLUEPRINT
+batch_bp = Blueprint('batch', __name__)
+batch_api = Api(batch_bp)
+batch_api.representation('application/json')(output_json)
+
+BATCH_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+
+def parse_sub_request(item):
+    """
+    Check a sub-request of a batch
+
+    :return: (method, path, body), or None if the sub-request is malformed
+    :rtype: tuple
+    """
+    if not isinstance(item, dict):
+        return None
+    method = item.get('method')
+    path = item.get('path')
+    if not isinstance(method, str) or method.upper() not in BATCH_METHODS:
+        return None
+    if not isinstance(path, str) or not path.startswith('/'):
+        return None
+    return method.upper(), path, item.get('body')
+
+
+def dispatch(method, path, body):
+    """
+    Run a sub-request through the app's own views
+
+    The sub-request shares the application context, and with it g and the
+    database session, of the batch request.
+
+    :rtype: flask.Response
+    """
+    data = None if body is None else json.dumps(body)
+    with current_app.test_request_context(path, base_url=request.host_url,
+                                          method=method, data=data,
+                                          content_type='application/json'):
+        if request.endpoint == 'batch.batch':
+            return None
+        return current_app.full_dispatch_request()
+
+
+def sub_result(response):
+    """Status and body of a sub-request's response, decoded if JSON"""
+    body = response.get_data(as_text=True)
+    if body and response.mimetype == 'application/json':
+        body = json.loads(body)
+    return {"status": response.status_code, "body": body or None}
+
+
+class BatchTransaction(object):
+    """
+    Runs a batch's sub-requests in one database transaction
+
+    The session serving the batch is bound to a connection whose
+    transaction is begun up front. The commits made by the resources then
+    only end subtransactions, and nothing is written unless the batch
+    commits as a whole.
+
+    Attributes:
+        connection -- connection holding the outer transaction
+        transaction -- the outer transaction
+    """
+
+    def __init__(self):
+        db.session.remove()
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        # no per-table binds, or they would take precedence over bind
+        db.session.registry.set(
+            db.create_session({'bind': self.connection, 'binds': {}})())
+
+    def finish(self, commit):
+        """Commit or roll back everything, then restore the usual session"""
+        try:
+            if commit:
+                self.transaction.commit()
+            elif self.transaction.is_active:
+                self.transaction.rollback()
+        finally:
+            db.session.remove()
+            self.connection.close()
+
+
+# BATCH RESOURCE
+class BatchResource(AuthRequiredResource):
+    """
+    Batch endpoint running many API calls under one authentication
+
+    Methods:
+        post -- run an array of sub-requests in order
+    """
+
+    def post(self):
+        # sub-request bodies are passed on with their keys in order
+        json_data = get_json_ordered()
+        if not json_data or not isinstance(json_data, dict):
+            return {"message": "No input data provided"}, status.HTTP_400_BAD_REQUEST
+        sub_requests = json_data.get('requests')
+        if not sub_requests or not isinstance(sub_requests, list):
+            return {"message": "No input data provided"}, status.HTTP_400_BAD_REQUEST
+        max_requests = current_app.config['BATCH_MAX_REQUESTS']
+        if len(sub_requests) > max_requests:
+            return {"message": "Too many requests, send at most {}".format(
+                max_requests)}, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        atomic = bool(json_data.get('atomic'))
+
+        # sub-requests reuse the identity verified for the batch itself
+        identity = g.current_user
+        if isinstance(identity, User):
+            identity = UserIdentity.from_user(identity)
+        g.batch_identity = identity
+
+        transaction = BatchTransaction() if atomic else None
+        results = []
+        failed = False
+        try:
+            for item in sub_requests:
+                if failed:
+                    results.append({"status": status.HTTP_424_FAILED_DEPENDENCY,
+                                    "body": {"message": "Not run"}})
+                    continue
+                parsed = parse_sub_request(item)
+                response = dispatch(*parsed) if parsed else None
+                if response is None:
+                    result = {"status": status.HTTP_400_BAD_REQUEST,
+                              "body": {"message": "Invalid request"}}
+                else:
+                    result = sub_result(response)
+                results.append(result)
+                # one failure undoes an atomic batch, skip the rest
+                failed = atomic and result["status"] >= 400
+        except Exception:
+            failed = True
+            raise
+        finally:
+            g.pop('batch_identity', None)
+            if transaction is not None:
+                transaction.finish(commit=not failed)
+
+        succeeded = sum(r["status"] < 400 for r in results)
+        return {"results": results}, bulk_status(succeeded, len(results))
+
+
+batch_api.add_resource(BatchResource, '/batch', endpoint='batch')
@@ -1,19 +1,28 @@
+from collections import OrderedDict
+
 from flask import request, Blueprint, g
 from flask_restful import Api
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
 from bucky_api import db
-from bucky_api.common.helpers import BucketListPaginator
-from bucky_api.models import BucketListSchema, BucketList
+from bucky_api.common.caching import conditional, conditional_on_bucketlist
+from bucky_api.common.replica import replica_reads
+from bucky_api.common.helpers import (BucketListPaginator, BucketListProjection,
+                                      bulk_status, get_json_ordered, load_many)
+from bucky_api.common.serializers import compile_schema
+from bucky_api.models import BucketListSchema, BucketList, User
 from bucky_api.common import status
+from bucky_api.common.database import is_unique_violation
+from bucky_api.common.instrumentation import output_json
 from bucky_api.resources.auth import AuthRequiredResource
 
 # CREATE BLUEPRINT
 bucketlists_bp = Blueprint('bucketlists', __name__)
 bucket_api = Api(bucketlists_bp)
+bucket_api.representation('application/json')(output_json)
 
 # INDIVIDUAL BUCKETLIST RESOURCE
-bucketlist_schema = BucketListSchema()
+bucketlist_schema = compile_schema(BucketListSchema())
 
 
 class BucketListResource(AuthRequiredResource):
@@ -26,15 +35,19 @@ class BucketListResource(AuthRequiredResource):
         delete -- delete a bucket-list by id
     """
 
+    @replica_reads
+    @conditional_on_bucketlist
     def get(self, bucket_id):
-        bucketlist = BucketList.query.filter_by(user=g.current_user, id=bucket_id).first()
+        projection = BucketListProjection.from_request(request)
+        bucketlist = projection.apply(BucketList.query).filter_by(user_id=g.current_user.id, id=bucket_id).first()
         if not bucketlist:
             return {"message": "Bucket-list not found"}, status.HTTP_404_NOT_FOUND
-        result = bucketlist_schema.dump(bucketlist)
+        projection.prefetch([bucketlist])
+        result = projection.schema().dump(bucketlist)
         return result.data
 
     def patch(self, bucket_id):
-        bucketlist = BucketList.query.filter_by(id=bucket_id, user=g.current_user).first()
+        bucketlist = BucketList.query.filter_by(id=bucket_id, user_id=g.current_user.id).first()
         if not bucketlist:
             return {"message": "Bucket-list not found"}, status.HTTP_404_NOT_FOUND
 
@@ -47,29 +60,41 @@ class BucketListResource(AuthRequiredResource):
         if errors:
             return errors, status.HTTP_422_UNPROCESSABLE_ENTITY
 
-        # patch bucket-list object
+        # patch bucket-list object, the version in the same UPDATE
         bucketlist.name = data['name']
+        bucketlist.version = BucketList.version + 1
 
         try:
             db.session.add(bucketlist)
+            User.record_write(g.current_user.id)
+            # serialize bucket-list object before the commit expires it
+            result = bucketlist_schema.dump(bucketlist)
             db.session.commit()
-            # serialize bucket-list object
-            result = bucketlist_schema.dump(BucketList.query.get(bucketlist.id))
             return {"message": "Bucket-list modified",
                     "bucketList": result.data}
 
+        except IntegrityError as e:
+            db.session.rollback()
+            if not is_unique_violation(e, BucketList.__table__, 'uq_bucketlists_user_id_name'):
+                return {"message": "Failed to patch",
+                        "error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+            return {"message": "Bucket-list already exists"}, status.HTTP_409_CONFLICT
+
         except SQLAlchemyError as e:
             db.session.rollback()
             return {"message": "Failed to patch",
                     "error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
 
     def delete(self, bucket_id):
-        bucketlist = BucketList.query.filter_by(id=bucket_id, user=g.current_user).first()
-        if not bucketlist:
-            return {"message": "Bucket-list does not exist"}, status.HTTP_404_NOT_FOUND
-
         try:
-            db.session.delete(bucketlist)
+            # tasks are deleted by the database, however many there are
+            deleted = BucketList.query.filter_by(
+                id=bucket_id, user_id=g.current_user.id
+            ).delete(synchronize_session=False)
+            if not deleted:
+                db.session.rollback()
+                return {"message": "Bucket-list does not exist"}, status.HTTP_404_NOT_FOUND
+            User.record_write(g.current_user.id, bucketlist_delta=-1)
             db.session.commit()
             return {"message": "Deleted bucket-list"}
 
@@ -79,7 +104,7 @@ class BucketListResource(AuthRequiredResource):
 
 
 # BUCKET-LIST COLLECTION RESOURCE
-bucketlists_schema = BucketListSchema(many=True)
+bucketlists_schema = compile_schema(BucketListSchema(many=True))
 
 
 class BucketListCollectionResource(AuthRequiredResource):
@@ -88,9 +113,13 @@ class BucketListCollectionResource(AuthRequiredResource):
     
     Methods:
         get -- get all bucket-lists of current user
-        post -- create a new bucket-list
+        post -- create a new bucket-list, or many from an array
+        patch -- rename many bucket-lists from a map of ids to names
+        delete -- delete many bucket-lists from an array of ids
     """
 
+    @replica_reads
+    @conditional
     def get(self):
         bucketlist_paginator = BucketListPaginator(request)
         result = bucketlist_paginator.paginate_query()
@@ -100,32 +129,212 @@ class BucketListCollectionResource(AuthRequiredResource):
         json_data = request.get_json()
         if not json_data:
             return {"message": "No input data provided"}, status.HTTP_400_BAD_REQUEST
+        if isinstance(json_data, list):
+            return self.post_many(json_data)
 
         # validate and deserialize input
         data, errors = bucketlist_schema.load(json_data)
         if errors:
             return errors, status.HTTP_422_UNPROCESSABLE_ENTITY
 
-        # check if bucket-list already exists
-        bucketlist = BucketList.query.filter_by(name=data['name'], user=g.current_user).first()
-        if bucketlist:
-            return {"message": "Bucket-list already exists"}, status.HTTP_409_CONFLICT
-
-        # create new bucketlist
-        bucketlist = BucketList(name=data['name'], user=g.current_user)
+        # create new bucketlist, the unique index rejects existing names
+        bucketlist = BucketList(name=data['name'], user_id=g.current_user.id)
 
         try:
             db.session.add(bucketlist)
+            User.record_write(g.current_user.id, bucketlist_delta=1)
+            db.session.flush()
+            # serialize bucket-list object before the commit expires it,
+            # a new bucket-list has no tasks to load
+            bucketlist._prefetched_tasks = []
+            result = bucketlist_schema.dump(bucketlist)
             db.session.commit()
-            # serialize bucket-list object
-            result = bucketlist_schema.dump(BucketList.query.get(bucketlist.id))
             return {"message": "Created bucket-list",
                     "bucketList": result.data}, status.HTTP_201_CREATED
 
+        except IntegrityError as e:
+            db.session.rollback()
+            if not is_unique_violation(e, BucketList.__table__, 'uq_bucketlists_user_id_name'):
+                return {"error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+            return {"message": "Bucket-list already exists"}, status.HTTP_409_CONFLICT
+
         except SQLAlchemyError as e:
             db.session.rollback()
             return {"error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
 
+    def post_many(self, json_data):
+        """
+        Create the bucket-lists of a JSON array in one transaction
+
+        Every item gets its own result, in request order: 201 with the
+        bucket-list, 409 if the name already exists or appears earlier in
+        the array, or 422 with its validation errors. The response is 201
+        if every item was created, 207 otherwise.
+        """
+        # validate and deserialize input
+        data, errors = load_many(bucketlist_schema, json_data, 'bucket-lists')
+
+        names = [item['name'] for i, item in enumerate(data)
+                 if i not in errors]
+        existing = set(BucketList.existing_names(g.current_user.id, names))
+        new = []
+        for name in names:
+            if name not in existing:
+                existing.add(name)
+                new.append(name)
+
+        ids = {}
+        if new:
+            try:
+                ids = BucketList.insert_many(g.current_user.id, new)
+                User.record_write(g.current_user.id,
+                                  bucketlist_delta=len(new))
+                db.session.commit()
+            except IntegrityError as e:
+                # a name was taken since it was checked
+                db.session.rollback()
+                if not is_unique_violation(e, BucketList.__table__, 'uq_bucketlists_user_id_name'):
+                    return {"error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+                return {"message": "Bucket-lists changed concurrently, try again"}, status.HTTP_409_CONFLICT
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                return {"error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+        results = []
+        for i in range(len(json_data)):
+            if i in errors:
+                results.append({"status": status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                "errors": errors[i]})
+                continue
+            name = data[i]['name']
+            bucket_id = ids.pop(name, None)
+            if bucket_id is None:
+                results.append({"status": status.HTTP_409_CONFLICT,
+                                "message": "Bucket-list already exists"})
+            else:
+                bucketlist = {'id': bucket_id, 'name': name,
+                              'task_count': 0, 'task_list': []}
+                results.append({"status": status.HTTP_201_CREATED,
+                                "bucketList": bucketlist_schema.dump(
+                                    bucketlist).data})
+
+        code = bulk_status(len(new), len(json_data), status.HTTP_201_CREATED)
+        return {"message": "Created {} of {} bucket-lists".format(
+                    len(new), len(json_data)),
+                "results": results}, code
+
+    def patch(self):
+        # results follow the order of the ids in the request
+        json_data = get_json_ordered()
+        if not json_data or not isinstance(json_data, dict):
+            return {"message": "No input data provided"}, status.HTTP_400_BAD_REQUEST
+
+        # validate and deserialize input, keys are bucket-list ids
+        keys = list(json_data)
+        data, errors = load_many(bucketlist_schema,
+                                 [{'name': json_data[key]} for key in keys],
+                                 'bucket-lists')
+        results = dict((key, {"id": key}) for key in keys)
+        names_by_id = OrderedDict()
+        for i, key in enumerate(keys):
+            try:
+                bucket_id = int(key)
+            except ValueError:
+                results[key].update(
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    errors={"id": ["Not a valid integer."]})
+                continue
+            if i in errors or bucket_id in names_by_id:
+                results[key].update(
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    errors=errors.get(i, {"id": ["Duplicate id."]}))
+                continue
+            results[key]["id"] = bucket_id
+            names_by_id[bucket_id] = (key, data[i]['name'])
+
+        # one lookup for ownership, one for names taken by other lists
+        owned = BucketList.owned_ids(g.current_user.id, names_by_id)
+        taken = BucketList.existing_names(
+            g.current_user.id, set(name for _, name in names_by_id.values()))
+        renames = {}
+        for bucket_id, (key, name) in names_by_id.items():
+            if bucket_id not in owned:
+                results[key].update(status=status.HTTP_404_NOT_FOUND,
+                                    message="Bucket-list not found")
+            elif taken.get(name, bucket_id) != bucket_id:
+                results[key].update(status=status.HTTP_409_CONFLICT,
+                                    message="Bucket-list already exists")
+            else:
+                taken[name] = bucket_id
+                renames[bucket_id] = name
+                results[key].update(status=status.HTTP_200_OK, name=name)
+
+        if renames:
+            try:
+                BucketList.rename_many(g.current_user.id, renames)
+                User.record_write(g.current_user.id)
+                db.session.commit()
+            except IntegrityError as e:
+                # a name was taken since it was checked
+                db.session.rollback()
+                if not is_unique_violation(e, BucketList.__table__, 'uq_bucketlists_user_id_name'):
+                    return {"message": "Failed to patch",
+                            "error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+                return {"message": "Bucket-lists changed concurrently, try again"}, status.HTTP_409_CONFLICT
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                return {"message": "Failed to patch",
+                        "error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+        return {"message": "Renamed {} of {} bucket-lists".format(
+                    len(renames), len(keys)),
+                "results": [results[key] for key in keys]
+                }, bulk_status(len(renames), len(keys))
+
+    def delete(self):
+        json_data = request.get_json()
+        if not json_data or not isinstance(json_data, list):
+            return {"message": "No input data provided"}, status.HTTP_400_BAD_REQUEST
+
+        ids = [bucket_id for bucket_id in json_data
+               if isinstance(bucket_id, int) and not isinstance(bucket_id, bool)]
+        owned = BucketList.owned_ids(g.current_user.id, set(ids))
+        if owned:
+            try:
+                BucketList.delete_many(g.current_user.id, owned)
+                User.record_write(g.current_user.id,
+                                  bucketlist_delta=-len(owned))
+                db.session.commit()
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                return {"error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+        results = []
+        seen = set()
+        for bucket_id in json_data:
+            if not isinstance(bucket_id, int) or isinstance(bucket_id, bool):
+                results.append({"id": bucket_id,
+                                "status": status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                "errors": {"id": ["Not a valid integer."]}})
+                continue
+            if bucket_id in seen:
+                results.append({"id": bucket_id,
+                                "status": status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                "errors": {"id": ["Duplicate id."]}})
+            elif owned.pop(bucket_id, None) is None:
+                results.append({"id": bucket_id,
+                                "status": status.HTTP_404_NOT_FOUND,
+                                "message": "Bucket-list does not exist"})
+            else:
+                results.append({"id": bucket_id,
+                                "status": status.HTTP_200_OK})
+            seen.add(bucket_id)
+
+        deleted = sum(r["status"] == status.HTTP_200_OK for r in results)
+        return {"message": "Deleted {} of {} bucket-lists".format(
+                    deleted, len(json_data)),
+                "results": results}, bulk_status(deleted, len(json_data))
+
 
 # BUCKET-LIST SEARCH RESOURCE
 
@@ -138,6 +347,8 @@ class BucketListSearchResource(AuthRequiredResource):
         get -- get all bucket-lists of current user matching query
     """
 
+    @replica_reads
+    @conditional
     def get(self, search_term):
         bucketlist_paginator = BucketListPaginator(request, search_term=search_term)
         result = bucketlist_paginator.paginate_query()
@@ -152,6 +363,8 @@ class BucketListLimitedCollectionResource(AuthRequiredResource):
         get -- get all bucket-lists of current user
     """
 
+    @replica_reads
+    @conditional
     def get(self, limit):
         bucketlist_paginator = BucketListPaginator(request, results_per_page=limit)
         result = bucketlist_paginator.paginate_query()
@@ -1,18 +1,25 @@
 from flask import request, jsonify, Blueprint, g
 from flask_restful import Api
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
 from bucky_api import db
 from bucky_api.resources.auth import AuthRequiredResource
 from bucky_api.common import status
-from bucky_api.models import BucketList, Task, TaskSchema
+from bucky_api.common.database import is_unique_violation
+from bucky_api.common.instrumentation import output_json
+from bucky_api.common.caching import conditional_on_bucketlist
+from bucky_api.common.replica import replica_reads
+from bucky_api.common.helpers import TaskPaginator, bulk_status, load_many
+from bucky_api.common.serializers import compile_schema
+from bucky_api.models import BucketList, Task, TaskSchema, User
 
 # CREATE BLUEPRINT
 tasks_bp = Blueprint('tasks', __name__)
 task_api = Api(tasks_bp)
+task_api.representation('application/json')(output_json)
 
 # INDIVIDUAL TASK RESOURCE
-task_schema = TaskSchema()
+task_schema = compile_schema(TaskSchema())
 
 
 class TaskResource(AuthRequiredResource):
@@ -27,7 +34,7 @@ class TaskResource(AuthRequiredResource):
     def patch(self, bucket_id, task_id):
         task = Task.query.filter_by(id=task_id,
                                     bucketlist_id=bucket_id,
-                                    user=g.current_user).first()
+                                    user_id=g.current_user.id).first()
 
         if not task:
             return {"message": "Task does not exist"}, status.HTTP_404_NOT_FOUND
@@ -46,12 +53,21 @@ class TaskResource(AuthRequiredResource):
 
         try:
             db.session.add(task)
+            BucketList.record_write(bucket_id)
+            User.record_write(g.current_user.id)
+            # serialize task object before the commit expires it
+            result = task_schema.dump(task)
             db.session.commit()
-            # serialize task object
-            result = task_schema.dump(Task.query.get(task.id))
             return {"message": "Task modified",
                     "task": result.data}
 
+        except IntegrityError as e:
+            db.session.rollback()
+            if not is_unique_violation(e, Task.__table__, 'uq_tasks_bucketlist_id_description'):
+                return {"message": "Failed to patch",
+                        "error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+            return {"message": "This task already exists"}, status.HTTP_409_CONFLICT
+
         except SQLAlchemyError as e:
             db.session.rollback()
             return {"message": "Failed to patch",
@@ -60,13 +76,15 @@ class TaskResource(AuthRequiredResource):
     def delete(self, bucket_id, task_id):
         task = Task.query.filter_by(id=task_id,
                                     bucketlist_id=bucket_id,
-                                    user=g.current_user).first()
+                                    user_id=g.current_user.id).first()
 
         if not task:
             return {"message": "Task does not exist"}, status.HTTP_404_NOT_FOUND
 
         try:
             db.session.delete(task)
+            BucketList.record_write(bucket_id, task_delta=-1)
+            User.record_write(g.current_user.id)
             db.session.commit()
             return {"message": "Task deleted"}
 
@@ -77,29 +95,35 @@ class TaskResource(AuthRequiredResource):
 
 
 # TASK COLLECTION RESOURCE
-tasks_schema = TaskSchema(many=True)
+tasks_schema = compile_schema(TaskSchema(many=True))
 
 
 class TaskCollectionResource(AuthRequiredResource):
+    """
+    Collection endpoint for the tasks of a bucket-list
+
+    Methods:
+        get -- get a page of tasks of a bucket-list, see TaskPaginator
+        post -- create a new task in a bucket-list, or many from an array
+    """
+
+    @replica_reads
+    @conditional_on_bucketlist
     def get(self, bucket_id):
-        bucketlist = BucketList.query.filter_by(id=bucket_id,
-                                                user=g.current_user).first()
-        if not bucketlist:
+        task_paginator = TaskPaginator(request, bucket_id, tasks_schema)
+        result = task_paginator.paginate_query()
+        if result is None:
             return {"message": "This bucket-list does not exist"}, status.HTTP_404_NOT_FOUND
-
-        tasks = Task.query.filter_by(bucketlist_id=bucket_id,
-                                     user=g.current_user).all()
-        if not tasks:
+        if not result['tasks']:
             return {"message": "No tasks found"}, status.HTTP_404_NOT_FOUND
-
-        # serialize queryset
-        result = tasks_schema.dump(tasks)
-        return {"tasks": result.data}
+        return result
 
     def post(self, bucket_id):
         json_data = request.get_json()
         if not json_data:
             return {"message": "No input data provided"}, status.HTTP_400_BAD_REQUEST
+        if isinstance(json_data, list):
+            return self.post_many(bucket_id, json_data)
 
         # validate and deserialize input
         data, errors = task_schema.load(json_data)
@@ -108,34 +132,106 @@ class TaskCollectionResource(AuthRequiredResource):
 
         # check if bucket-list exists
         bucketlist = BucketList.query.filter_by(id=bucket_id,
-                                                user=g.current_user).first()
+                                                user_id=g.current_user.id).first()
         if not bucketlist:
             return {"message": "This bucket-list does not exist"}, status.HTTP_404_NOT_FOUND
 
-        # check if task already exists
-        task = Task.query.filter_by(description=data['description'],
-                                    bucketlist=bucketlist).first()
-        if task:
-            return {"message": "This task already exists"}, status.HTTP_409_CONFLICT
-
-        # create task
+        # create task, the unique index rejects existing descriptions
         task = Task(description=data['description'],
                     bucketlist=bucketlist,
-                    user=g.current_user)
+                    user_id=g.current_user.id)
 
         try:
             db.session.add(task)
+            BucketList.record_write(bucketlist.id, task_delta=1)
+            User.record_write(g.current_user.id)
+            db.session.flush()
+            # serialize task object before the commit expires it
+            result = task_schema.dump(task)
             db.session.commit()
-            # serialize task object
-            result = task_schema.dump(Task.query.get(task.id))
             return {"message": "Task created",
                     "task": result.data}, status.HTTP_201_CREATED
 
+        except IntegrityError as e:
+            db.session.rollback()
+            if not is_unique_violation(e, Task.__table__, 'uq_tasks_bucketlist_id_description'):
+                return {"message": "Failed to create",
+                        "error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+            return {"message": "This task already exists"}, status.HTTP_409_CONFLICT
+
         except SQLAlchemyError as e:
             db.session.rollback()
             return {"message": "Failed to create",
                     "error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
 
+    def post_many(self, bucket_id, json_data):
+        """
+        Create the tasks of a JSON array in one transaction
+
+        Every item gets its own result, in request order: 201 with the
+        task, 409 if its description already exists in the bucket-list or
+        earlier in the array, or 422 with its validation errors. The
+        response is 201 if every item was created, 207 otherwise.
+        """
+        # validate and deserialize input
+        data, errors = load_many(task_schema, json_data, 'tasks')
+
+        # check if bucket-list exists
+        bucketlist = BucketList.query.filter_by(id=bucket_id,
+                                                user_id=g.current_user.id).first()
+        if not bucketlist:
+            return {"message": "This bucket-list does not exist"}, status.HTTP_404_NOT_FOUND
+
+        valid = [(i, item['description']) for i, item in enumerate(data)
+                 if i not in errors]
+        existing = Task.existing_descriptions(
+            bucketlist.id, set(description for _, description in valid))
+        new = []
+        for i, description in valid:
+            if description not in existing:
+                existing.add(description)
+                new.append(description)
+
+        ids = {}
+        if new:
+            try:
+                ids = Task.insert_many(bucketlist.id, g.current_user.id, new)
+                BucketList.record_write(bucketlist.id, task_delta=len(new))
+                User.record_write(g.current_user.id)
+                db.session.commit()
+            except IntegrityError as e:
+                # a description was taken since it was checked
+                db.session.rollback()
+                if not is_unique_violation(e, Task.__table__, 'uq_tasks_bucketlist_id_description'):
+                    return {"message": "Failed to create",
+                            "error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+                return {"message": "Tasks changed concurrently, try again"}, status.HTTP_409_CONFLICT
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                return {"message": "Failed to create",
+                        "error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+        results = []
+        for i in range(len(json_data)):
+            if i in errors:
+                results.append({"status": status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                "errors": errors[i]})
+                continue
+            description = data[i]['description']
+            task_id = ids.pop(description, None)
+            if task_id is None:
+                results.append({"status": status.HTTP_409_CONFLICT,
+                                "message": "This task already exists"})
+            else:
+                task = {'id': task_id, 'description': description}
+                results.append({"status": status.HTTP_201_CREATED,
+                                "task": task_schema.dump(task).data})
+
+        code = bulk_status(len(new), len(json_data), status.HTTP_201_CREATED)
+        return {"message": "Created {} of {} tasks".format(
+                    len(new), len(json_data)),
+                "results": results}, code
+
 
 task_api.add_resource(TaskResource, '/bucketlists/<int:bucket_id>/tasks/<int:task_id>', endpoint='task')
 task_api.add_resource(TaskCollectionResource, '/bucketlists/<int:bucket_id>/tasks/', endpoint='tasks')
@@ -1,8 +1,11 @@
 import os
+import time
 
+import click
 from flask_migrate import Migrate
 
 from bucky_api import create_app, db
+from bucky_api.common.seeding import seed as seed_database
 from bucky_api.models import User, BucketList, Task
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
@@ -12,3 +15,26 @@ migrate = Migrate(app, db)
 @app.shell_context_processor
 def make_shell_context():
     return dict(app=app, db=db, User=User, BucketList=BucketList, Task=Task)
+
+
+@app.cli.command()
+@click.option('--users', default=1000, help='Users to create.')
+@click.option('--bucketlists', default=10, help='Bucket-lists per user.')
+@click.option('--tasks', default=10, help='Tasks per bucket-list.')
+@click.option('--seed', default=0, help='Seed of the generated names.')
+@click.option('--batch-size', default=10000,
+              help='Rows written per transaction.')
+@click.option('--password', default='password',
+              help='Password of every generated user.')
+def seed(users, bucketlists, tasks, seed, batch_size, password):
+    """Bulk-generate synthetic users, bucket-lists and tasks."""
+    start = time.perf_counter()
+
+    def progress(done):
+        click.echo('{}/{} users, {:.1f} s'.format(
+            done, users, time.perf_counter() - start), err=True)
+
+    counts = seed_database(users, bucketlists, tasks, password, seed=seed,
+                           batch_size=batch_size, progress=progress)
+    click.echo('Seeded {} users, {} bucket-lists and {} tasks in {:.1f} s'
+               .format(*counts + (time.perf_counter() - start,)))
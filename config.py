@@ -1,4 +1,5 @@
 import os
+import tempfile
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
@@ -6,6 +7,78 @@ class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'xGA45@f1'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     BUCKETS_PER_PAGE = 3
+    # tasks per page of a bucket-list, clients may ask for up to the max
+    TASKS_PER_PAGE = 20
+    TASKS_MAX_PER_PAGE = 100
+    # bulk writes: items per request, rows per INSERT / UPDATE / IN query
+    BULK_MAX_ITEMS = 5000
+    BULK_CHUNK_SIZE = 300
+    # sub-requests accepted by one call to /batch
+    BATCH_MAX_REQUESTS = 50
+    # answer If-None-Match on bucket-list and task reads with 304
+    ETAGS_ENABLED = True
+    # verified username:password pairs kept per worker process; a
+    # password change is stamped in AUTH_STAMPS_FILE, shared by the
+    # workers of a host, and evicts their entries on the next lookup,
+    # workers of other hosts keep them for up to AUTH_CACHE_TTL
+    AUTH_CACHE_SIZE = 1024
+    AUTH_CACHE_TTL = 60
+    AUTH_STAMPS_FILE = os.environ.get('AUTH_STAMPS_FILE') or os.path.join(
+        tempfile.gettempdir(), 'bucky-credential-stamps')
+    AUTH_STAMPS_SLOTS = 65536
+    # trust the signed claims of a token instead of loading its user,
+    # checking its credential version against the auth cache
+    AUTH_TOKEN_STATELESS = True
+    # stored hashes made with another method or iteration count are
+    # upgraded on the user's next successful password login
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256'
+    PASSWORD_HASH_ITERATIONS = 150000
+    PASSWORD_HASH_SALT_LENGTH = 8
+    # hashing runs on a per-worker process pool, 0 workers hashes inline
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_MAX_PENDING = 8
+    PASSWORD_HASH_QUEUE_TIMEOUT = 1.0
+    # connection pool of each worker process, not used with SQLite;
+    # checkouts wait up to POOL_TIMEOUT seconds once size + overflow are
+    # in use, connections are replaced after POOL_RECYCLE seconds
+    SQLALCHEMY_POOL_SIZE = 5
+    SQLALCHEMY_MAX_OVERFLOW = 5
+    SQLALCHEMY_POOL_TIMEOUT = 10
+    SQLALCHEMY_POOL_RECYCLE = 1800
+    # test connections on checkout, replacing ones the server dropped
+    SQLALCHEMY_POOL_PRE_PING = True
+    # milliseconds a PostgreSQL statement may run, 0 for no limit
+    SQLALCHEMY_STATEMENT_TIMEOUT = 0
+    # behind pgbouncer in transaction pooling mode: keep no session state
+    # on server connections, the statement timeout is set per transaction
+    SQLALCHEMY_PGBOUNCER = os.environ.get('PGBOUNCER', '') == '1'
+    # read-only GETs use the 'replica' bind if there is one; a user's
+    # reads stay on the primary for REPLICA_STICKY_SECONDS after each of
+    # their writes, recorded in a file shared by the worker processes
+    SQLALCHEMY_BINDS = ({'replica': os.environ['REPLICA_DATABASE_URL']}
+                        if os.environ.get('REPLICA_DATABASE_URL') else None)
+    REPLICA_STICKY_SECONDS = 5
+    REPLICA_WRITES_FILE = os.environ.get('REPLICA_WRITES_FILE') or os.path.join(
+        tempfile.gettempdir(), 'bucky-replica-writes')
+    REPLICA_WRITES_SLOTS = 65536
+    # time each request by phase and count its SQL statements, reported
+    # in a Server-Timing header; requests over either budget are logged
+    INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION', '') == '1'
+    SLOW_REQUEST_MS = 500
+    SLOW_REQUEST_STATEMENTS = 30
+    # serve /metrics in Prometheus format, merged from the files each
+    # worker process keeps in METRICS_DIR; it is not authenticated, only
+    # enable it where the port is private
+    METRICS_ENABLED = os.environ.get('METRICS', '') == '1'
+    METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(
+        tempfile.gettempdir(), 'bucky-metrics')
+    # profile requests sent with an X-Profile: <PROFILER_TOKEN> header
+    # and a PROFILER_SAMPLE_RATE share of all requests, keeping the
+    # PROFILER_KEEP slowest for download from /profiles
+    PROFILER_ENABLED = os.environ.get('PROFILER', '') == '1'
+    PROFILER_TOKEN = os.environ.get('PROFILER_TOKEN')
+    PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE', 0))
+    PROFILER_KEEP = 20
 
     @staticmethod
     def init_app(app):
@@ -15,16 +88,28 @@ class Config(object):
 class DevelopmentConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DEV_DATABASE_URL')
     DEBUG = True
+    INSTRUMENTATION_ENABLED = True
+    SQLALCHEMY_POOL_SIZE = 2
 
 
 class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL')
     TESTING = True
     WTF_CSRF_ENABLED = False
+    PASSWORD_HASH_ITERATIONS = 1000
+    PASSWORD_HASH_WORKERS = 0
+    SQLALCHEMY_BINDS = None
+    INSTRUMENTATION_ENABLED = False
+    METRICS_ENABLED = False
+    PROFILER_ENABLED = False
 
 
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+    SQLALCHEMY_POOL_SIZE = 10
+    SQLALCHEMY_MAX_OVERFLOW = 10
+    SQLALCHEMY_POOL_TIMEOUT = 5
+    SQLALCHEMY_STATEMENT_TIMEOUT = 5000
 
 config = {
     'development': DevelopmentConfig,
@@ -0,0 +1,50 @@
+"""cascade deletes from bucketlists to tasks
+
+Tasks left without a bucket-list by earlier deletes are removed, then
+tasks.bucketlist_id is recreated with ON DELETE CASCADE.
+
+Revision ID: 1aa3bc155460
+Revises: 42402777873a
+Create Date: 2026-10-16 17:05:12.661093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1aa3bc155460'
+down_revision = '42402777873a'
+branch_labels = None
+depends_on = None
+
+# names the unnamed foreign keys of SQLite so batch mode can drop them
+SQLITE_NAMING = {
+    'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+
+
+def replace_foreign_key(ondelete):
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        with op.batch_alter_table('tasks',
+                                  naming_convention=SQLITE_NAMING) as batch_op:
+            batch_op.drop_constraint('fk_tasks_bucketlist_id_bucketlists',
+                                     type_='foreignkey')
+            batch_op.create_foreign_key('fk_tasks_bucketlist_id_bucketlists',
+                                        'bucketlists', ['bucketlist_id'],
+                                        ['id'], ondelete=ondelete)
+    else:
+        op.drop_constraint('tasks_bucketlist_id_fkey', 'tasks',
+                           type_='foreignkey')
+        op.create_foreign_key('tasks_bucketlist_id_fkey', 'tasks',
+                              'bucketlists', ['bucketlist_id'], ['id'],
+                              ondelete=ondelete)
+
+
+def upgrade():
+    op.execute("DELETE FROM tasks WHERE bucketlist_id IS NULL")
+    replace_foreign_key('CASCADE')
+
+
+def downgrade():
+    replace_foreign_key(None)
@@ -0,0 +1,42 @@
+"""widen the listing indexes into covering indexes
+
+bucketlists (user_id, id) becomes (user_id, id, name) and
+tasks (bucketlist_id, user_id, id) becomes
+(bucketlist_id, user_id, id, description), so listings and their
+projections are answered from the index. Lookups by id go through the
+primary keys, name and description checks through the unique indexes.
+
+Revision ID: 3e710eed45f5
+Revises: 1aa3bc155460
+Create Date: 2026-10-16 17:48:29.304417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e710eed45f5'
+down_revision = '1aa3bc155460'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_bucketlists_user_id_id_name', 'bucketlists',
+                    ['user_id', 'id', 'name'], unique=False)
+    op.drop_index('ix_bucketlists_user_id_id', table_name='bucketlists')
+    op.create_index('ix_tasks_bucketlist_id_user_id_id_description', 'tasks',
+                    ['bucketlist_id', 'user_id', 'id', 'description'],
+                    unique=False)
+    op.drop_index('ix_tasks_bucketlist_id_user_id_id', table_name='tasks')
+
+
+def downgrade():
+    op.create_index('ix_tasks_bucketlist_id_user_id_id', 'tasks',
+                    ['bucketlist_id', 'user_id', 'id'], unique=False)
+    op.drop_index('ix_tasks_bucketlist_id_user_id_id_description',
+                  table_name='tasks')
+    op.create_index('ix_bucketlists_user_id_id', 'bucketlists',
+                    ['user_id', 'id'], unique=False)
+    op.drop_index('ix_bucketlists_user_id_id_name', table_name='bucketlists')
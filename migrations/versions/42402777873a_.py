@@ -0,0 +1,46 @@
+"""add unique indexes on bucket-list names and task descriptions
+
+Earlier versions let duplicates in. All but the oldest row of every
+set of duplicates get their id appended, e.g. `buck (42)`, so the
+indexes can be built without losing any data.
+
+Revision ID: 42402777873a
+Revises: e99629eefd18
+Create Date: 2026-10-16 16:21:40.873215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '42402777873a'
+down_revision = 'e99629eefd18'
+branch_labels = None
+depends_on = None
+
+
+# appends ' (<id>)' to the rows of table having an older row with the same
+# key in scope, cut to fit 64 characters
+RENAME_DUPLICATES = (
+    "UPDATE {table} SET {key} = "
+    "substr({key}, 1, 64 - length(' (' || id || ')')) || ' (' || id || ')' "
+    "WHERE EXISTS (SELECT 1 FROM {table} AS older "
+    "WHERE older.{scope} = {table}.{scope} AND older.{key} = {table}.{key} "
+    "AND older.id < {table}.id)")
+
+
+def upgrade():
+    op.execute(RENAME_DUPLICATES.format(table='bucketlists', key='name',
+                                        scope='user_id'))
+    op.execute(RENAME_DUPLICATES.format(table='tasks', key='description',
+                                        scope='bucketlist_id'))
+    op.create_index('uq_bucketlists_user_id_name', 'bucketlists',
+                    ['user_id', 'name'], unique=True)
+    op.create_index('uq_tasks_bucketlist_id_description', 'tasks',
+                    ['bucketlist_id', 'description'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_tasks_bucketlist_id_description', table_name='tasks')
+    op.drop_index('uq_bucketlists_user_id_name', table_name='bucketlists')
@@ -0,0 +1,58 @@
+"""full-text search index over bucketlists.name
+
+Revision ID: 79d73db613d4
+Revises: ddba702ed314
+Create Date: 2026-10-16 11:24:50.118274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '79d73db613d4'
+down_revision = 'ddba702ed314'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("CREATE INDEX ix_bucketlists_name_tsv ON bucketlists "
+                   "USING gin (to_tsvector('simple'::regconfig, "
+                   "coalesce(name, '')))")
+    elif dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE bucketlists_fts USING fts5("
+                   "name, content='bucketlists', content_rowid='id')")
+        op.execute("CREATE TRIGGER bucketlists_fts_ai AFTER INSERT ON "
+                   "bucketlists BEGIN "
+                   "INSERT INTO bucketlists_fts(rowid, name) "
+                   "VALUES (new.id, new.name); "
+                   "END")
+        op.execute("CREATE TRIGGER bucketlists_fts_ad AFTER DELETE ON "
+                   "bucketlists BEGIN "
+                   "INSERT INTO bucketlists_fts(bucketlists_fts, rowid, name) "
+                   "VALUES ('delete', old.id, old.name); "
+                   "END")
+        op.execute("CREATE TRIGGER bucketlists_fts_au AFTER UPDATE OF name ON "
+                   "bucketlists BEGIN "
+                   "INSERT INTO bucketlists_fts(bucketlists_fts, rowid, name) "
+                   "VALUES ('delete', old.id, old.name); "
+                   "INSERT INTO bucketlists_fts(rowid, name) "
+                   "VALUES (new.id, new.name); "
+                   "END")
+        # index the bucket-lists that already exist
+        op.execute("INSERT INTO bucketlists_fts(bucketlists_fts) "
+                   "VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.drop_index('ix_bucketlists_name_tsv', table_name='bucketlists')
+    elif dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS bucketlists_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS bucketlists_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS bucketlists_fts_ai")
+        op.execute("DROP TABLE IF EXISTS bucketlists_fts")
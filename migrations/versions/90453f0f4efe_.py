@@ -0,0 +1,25 @@
+"""add users.credential_version
+
+Revision ID: 90453f0f4efe
+Revises: 3953cfbe17e2
+Create Date: 2026-10-16 09:12:41.208311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '90453f0f4efe'
+down_revision = '3953cfbe17e2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('credential_version', sa.Integer(),
+                                     nullable=False, server_default='1'))
+
+
+def downgrade():
+    op.drop_column('users', 'credential_version')
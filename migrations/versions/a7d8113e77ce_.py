@@ -0,0 +1,25 @@
+"""add users.data_version
+
+Revision ID: a7d8113e77ce
+Revises: f90c42dcb52d
+Create Date: 2026-10-16 14:02:17.530912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d8113e77ce'
+down_revision = 'f90c42dcb52d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('data_version', sa.Integer(),
+                                     nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('users', 'data_version')
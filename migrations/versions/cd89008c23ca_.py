@@ -0,0 +1,25 @@
+"""add bucketlists.version
+
+Revision ID: cd89008c23ca
+Revises: 3e710eed45f5
+Create Date: 2026-10-17 10:21:44.905317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'cd89008c23ca'
+down_revision = '3e710eed45f5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('bucketlists', sa.Column('version', sa.Integer(),
+                                           nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('bucketlists', 'version')
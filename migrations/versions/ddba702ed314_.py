@@ -0,0 +1,25 @@
+"""index bucketlists on (user_id, id) for keyset pagination
+
+Revision ID: ddba702ed314
+Revises: 90453f0f4efe
+Create Date: 2026-10-16 10:02:17.530964
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ddba702ed314'
+down_revision = '90453f0f4efe'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_bucketlists_user_id_id', 'bucketlists',
+                    ['user_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_bucketlists_user_id_id', table_name='bucketlists')
@@ -0,0 +1,25 @@
+"""add composite index on tasks for paginated listings
+
+Revision ID: e99629eefd18
+Revises: a7d8113e77ce
+Create Date: 2026-10-16 14:48:55.102736
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e99629eefd18'
+down_revision = 'a7d8113e77ce'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_tasks_bucketlist_id_user_id_id', 'tasks',
+                    ['bucketlist_id', 'user_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tasks_bucketlist_id_user_id_id', table_name='tasks')
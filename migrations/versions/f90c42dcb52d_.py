@@ -0,0 +1,35 @@
+"""add users.bucketlist_count and bucketlists.task_count counters
+
+Revision ID: f90c42dcb52d
+Revises: 79d73db613d4
+Create Date: 2026-10-16 12:40:03.671845
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f90c42dcb52d'
+down_revision = '79d73db613d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('bucketlist_count', sa.Integer(),
+                                     nullable=False, server_default='0'))
+    op.add_column('bucketlists', sa.Column('task_count', sa.Integer(),
+                                           nullable=False, server_default='0'))
+    # backfill the counters from the existing rows
+    op.execute("UPDATE users SET bucketlist_count = "
+               "(SELECT count(*) FROM bucketlists "
+               "WHERE bucketlists.user_id = users.id)")
+    op.execute("UPDATE bucketlists SET task_count = "
+               "(SELECT count(*) FROM tasks "
+               "WHERE tasks.bucketlist_id = bucketlists.id)")
+
+
+def downgrade():
+    op.drop_column('bucketlists', 'task_count')
+    op.drop_column('users', 'bucketlist_count')
@@ -1,5 +1,25 @@
+import json
+from base64 import b64encode
+
 import pytest
+from sqlalchemy import event
+
 from bucky_api import create_app, db
+from bucky_api.common import status
+from config import TestingConfig
+
+BUCKETLIST_ENDPOINT = '/api/v1.0/bucketlists/'
+USER_ENDPOINT = '/api/v1.0/auth/users/'
+
+
+def get_api_headers(username, password):
+    """Helper function for creating request headers with http authentication"""
+    return {
+        'Authorization': 'Basic ' + b64encode(
+            (username + ':' + password).encode('utf-8')).decode('utf-8'),
+        'Accept': 'application/json',
+        'Content-Type': 'application/json'
+    }
 
 
 @pytest.fixture
@@ -22,3 +42,58 @@ def client(request, app):
     request.addfinalizer(teardown)
 
     return client
+
+
+@pytest.fixture
+def statements(app):
+    """List that records every SQL statement sent to the database
+    while the test runs"""
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    engine = db.get_engine(app)
+    event.listen(engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+@pytest.fixture
+def api_headers():
+    """Function creating request headers with http authentication"""
+    return get_api_headers
+
+
+@pytest.fixture
+def make_client(monkeypatch):
+    """Factory of test clients of apps built with TestingConfig overrides,
+    each having a registered user <User username:arny, password:passy>
+    with the named bucket-lists"""
+    contexts = []
+
+    def make(bucketlists=(), **overrides):
+        for name, value in overrides.items():
+            monkeypatch.setattr(TestingConfig, name, value)
+        app = create_app('testing')
+        context = app.app_context()
+        context.push()
+        contexts.append(context)
+        db.create_all()
+        client = app.test_client()
+        client.post(USER_ENDPOINT,
+                    data=json.dumps({'username': 'arny',
+                                     'password': 'passy'}),
+                    content_type='application/json')
+        for name in bucketlists:
+            response = client.post(BUCKETLIST_ENDPOINT,
+                                   headers=get_api_headers('arny', 'passy'),
+                                   data=json.dumps({'name': name}))
+            assert response.status_code == status.HTTP_201_CREATED
+        return client
+
+    yield make
+    for context in reversed(contexts):
+        db.session.remove()
+        db.drop_all()
+        context.pop()
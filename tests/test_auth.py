@@ -2,9 +2,12 @@ import json
 from base64 import b64encode
 
 import pytest
+from flask import current_app
 
-from bucky_api import db
+from bucky_api import db, credential_cache, password_hasher
 from bucky_api.common import status
+from bucky_api.common.cache import CredentialCache
+from bucky_api.common.hashing import HashingQueueFull
 from bucky_api.models import User
 
 TOKEN_ENDPOINT = '/api/v1.0/auth/get_token/'
@@ -77,6 +80,66 @@ def test__access_protected_resources_with_token__success(client_with_user):
     assert b'arny' in response.data
 
 
+def test__token_auth_without_user_query__succeeds(client_with_user,
+                                                  statements):
+    """Make sure stateless token verification does not load the user,
+    nor its credential version once cached"""
+    response = client_with_user.get(TOKEN_ENDPOINT,
+                                    headers=get_api_headers('arny', 'passy'))
+    token = json.loads(response.data.decode('utf-8'))['token']
+    for _ in range(2):
+        del statements[:]
+        response = client_with_user.get('/api/v1.0/bucketlists/',
+                                        headers=get_api_headers(token, ''))
+        assert response.status_code == status.HTTP_200_OK
+    assert not any('users.password_hashed' in statement or
+                   'users.credential_version' in statement
+                   for statement in statements)
+
+
+def test__token_rejected_after_password_change__succeeds(client_with_user):
+    """Make sure tokens issued before a password change stop working"""
+    user_id = User.query.first().id  # User <arny>
+    response = client_with_user.get(TOKEN_ENDPOINT,
+                                    headers=get_api_headers('arny', 'passy'))
+    token = json.loads(response.data.decode('utf-8'))['token']
+    response = client_with_user.get(USER_ENDPOINT + str(user_id),
+                                    headers=get_api_headers(token, ''))
+    assert response.status_code == status.HTTP_200_OK
+    response = client_with_user.patch(USER_ENDPOINT + str(user_id),
+                                      headers=get_api_headers('arny', 'passy'),
+                                      data=json.dumps({'username': 'arny',
+                                                       'password': 'passi'}))
+    assert response.status_code == status.HTTP_200_OK
+    for stateless in (True, False):
+        current_app.config['AUTH_TOKEN_STATELESS'] = stateless
+        response = client_with_user.get(USER_ENDPOINT + str(user_id),
+                                        headers=get_api_headers(token, ''))
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test__token_rejected_after_password_change_in_other_worker__succeeds(
+        client_with_user):
+    """Make sure a password change made by another worker process stops
+    the tokens and credentials this worker has cached"""
+    current_app.config['AUTH_TOKEN_STATELESS'] = True
+    response = client_with_user.get(TOKEN_ENDPOINT,
+                                    headers=get_api_headers('arny', 'passy'))
+    token = json.loads(response.data.decode('utf-8'))['token']
+    other_worker = CredentialCache()
+    other_worker.stamps.open(current_app.config['AUTH_STAMPS_FILE'])
+    user = User.query.first()  # User <arny>
+    user.password = 'passi'
+    db.session.commit()
+    other_worker.invalidate_user(user.id)
+    other_worker.stamps.close()
+    for headers in (get_api_headers(token, ''),
+                    get_api_headers('arny', 'passy')):
+        response = client_with_user.get(USER_ENDPOINT + str(user.id),
+                                        headers=headers)
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
 def test__get_new_token_using_current_token__fails(client_with_user):
     """Make sure registered user can access protected resources with
     a token"""
@@ -228,3 +291,113 @@ def test__change_password_of_non_existent_user__fails(client_with_user):
                                       content_type='application/json')
     assert response.status_code == status.HTTP_404_NOT_FOUND
     assert b'User does not exist' in response.data
+
+
+# CREDENTIAL CACHE TESTS
+def test__repeated_password_auth_served_from_cache__succeeds(client_with_user):
+    """Make sure a verified username:password pair is answered from
+    the credential cache on the next request"""
+    credential_cache.clear()
+    headers = get_api_headers('arny', 'passy')
+    for _ in range(3):
+        response = client_with_user.get(TOKEN_ENDPOINT, headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+    assert credential_cache.stats()['misses'] == 1
+    assert credential_cache.stats()['hits'] == 2
+
+
+def test__wrong_password_is_not_cached__succeeds(client_with_user):
+    """Make sure failed verifications never make it into the cache"""
+    credential_cache.clear()
+    headers = get_api_headers('arny', 'wrong')
+    for _ in range(2):
+        response = client_with_user.get(TOKEN_ENDPOINT, headers=headers)
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert credential_cache.stats()['hits'] == 0
+    assert credential_cache.stats()['size'] == 0
+
+
+def test__old_password_rejected_after_change__succeeds(client_with_user):
+    """Make sure changing a password evicts the cached old credentials"""
+    user = User.query.first()  # User <arny>
+    response = client_with_user.get(TOKEN_ENDPOINT,
+                                    headers=get_api_headers('arny', 'passy'))
+    assert response.status_code == status.HTTP_200_OK
+    response = client_with_user.patch(USER_ENDPOINT + str(user.id),
+                                      headers=get_api_headers('arny', 'passy'),
+                                      data=json.dumps({'username': 'arny',
+                                                       'password': 'passi'}),
+                                      content_type='application/json')
+    assert response.status_code == status.HTTP_200_OK
+    response = client_with_user.get(TOKEN_ENDPOINT,
+                                    headers=get_api_headers('arny', 'passy'))
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    response = client_with_user.get(TOKEN_ENDPOINT,
+                                    headers=get_api_headers('arny', 'passi'))
+    assert response.status_code == status.HTTP_200_OK
+
+
+# PASSWORD HASH UPGRADE TESTS
+def test__weak_hash_upgraded_on_login__succeeds(client_with_user):
+    """Make sure a hash made with an outdated work factor is
+    replaced on the next successful login, without revoking tokens"""
+    user = User.query.first()  # User <arny>
+    old_hash = user.password_hashed
+    credential_version = user.credential_version
+    credential_cache.clear()
+    password_hasher.method = 'pbkdf2:sha256:2000'
+    try:
+        response = client_with_user.get(
+            TOKEN_ENDPOINT, headers=get_api_headers('arny', 'passy'))
+        assert response.status_code == status.HTTP_200_OK
+    finally:
+        password_hasher.init_app(current_app)
+    user = User.query.first()
+    assert user.password_hashed != old_hash
+    assert user.password_hashed.startswith('pbkdf2:sha256:2000$')
+    assert user.credential_version == credential_version
+    assert user.verify_password('passy')
+
+
+def test__busy_hasher_skips_hash_upgrade__succeeds(client_with_user,
+                                                   monkeypatch):
+    """Make sure a login still succeeds, keeping the old hash, when the
+    hashing pool is too busy to upgrade it"""
+    def busy(password):
+        raise HashingQueueFull()
+
+    old_hash = User.query.first().password_hashed  # User <arny>
+    credential_cache.clear()
+    monkeypatch.setattr(password_hasher, 'needs_rehash', lambda h: True)
+    monkeypatch.setattr(password_hasher, 'hash', busy)
+    response = client_with_user.get(TOKEN_ENDPOINT,
+                                    headers=get_api_headers('arny', 'passy'))
+    assert response.status_code == status.HTTP_200_OK
+    db.session.remove()
+    assert User.query.first().password_hashed == old_hash
+
+
+def test__user_writes_statement_counts__succeeds(client_with_user,
+                                                 statements):
+    """Make sure user writes serialize what they wrote without reading
+    it back"""
+    del statements[:]
+    response = client_with_user.post(USER_ENDPOINT,
+                                     data=json.dumps({'username': 'bob',
+                                                      'password': 'pass'}),
+                                     content_type='application/json')
+    assert response.status_code == status.HTTP_201_CREATED
+    # insert, duplicates are caught by the unique index
+    assert len(statements) == 1
+
+    headers = get_api_headers('arny', 'passy')
+    client_with_user.get(TOKEN_ENDPOINT, headers=headers)
+    user_id = User.query.filter_by(username='arny').one().id
+    del statements[:]
+    response = client_with_user.patch(USER_ENDPOINT + str(user_id),
+                                      headers=headers,
+                                      data=json.dumps({'username': 'arny',
+                                                       'password': 'passi'}))
+    assert response.status_code == status.HTTP_200_OK
+    # user, password update, data version
+    assert len(statements) == 3
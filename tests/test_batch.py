@@ -0,0 +1,113 @@
+import json
+from base64 import b64encode
+
+import pytest
+
+from bucky_api.common import status
+from bucky_api.models import User, BucketList, Task
+
+BATCH_ENDPOINT = '/api/v1.0/batch'
+BUCKETLIST_ENDPOINT = '/api/v1.0/bucketlists/'
+USER_ENDPOINT = '/api/v1.0/auth/users/'
+
+
+# TEST HELPERS
+def get_api_headers(username, password):
+    """Helper function for creating request headers with http authentication"""
+    return {
+        'Authorization': 'Basic ' + b64encode(
+            (username + ':' + password).encode('utf-8')).decode('utf-8'),
+        'Accept': 'application/json',
+        'Content-Type': 'application/json'
+    }
+
+
+def batch(client, sub_requests, headers=None, **options):
+    """Helper function sending a batch of sub-requests"""
+    options['requests'] = sub_requests
+    response = client.post(BATCH_ENDPOINT,
+                           headers=headers or get_api_headers('arny',
+                                                              'passy'),
+                           data=json.dumps(options))
+    return response, json.loads(response.data.decode('utf-8'))
+
+
+# PY.TEST FIXTURES
+@pytest.fixture
+def client_with_user(client):
+    """A version of test client which has already
+     registered a user <User username:arny, password:passy>
+    """
+    response = client.post(USER_ENDPOINT,
+                           data=json.dumps({'username': 'arny',
+                                            'password': 'passy'}),
+                           content_type='application/json')
+
+    assert response.status_code == status.HTTP_201_CREATED
+    return client
+
+
+def test__batch_of_requests__succeeds(client_with_user, statements):
+    """Make sure sub-requests run in order and authenticate only once"""
+    del statements[:]
+    response, data = batch(client_with_user, [
+        {'method': 'POST', 'path': '/api/v1.0/bucketlists/',
+         'body': {'name': 'buck'}},
+        {'method': 'POST', 'path': '/api/v1.0/bucketlists/1/tasks/',
+         'body': {'description': 'tasky'}},
+        {'method': 'GET', 'path': '/api/v1.0/bucketlists/1?fields=name'},
+    ])
+    assert response.status_code == status.HTTP_200_OK
+    assert [r['status'] for r in data['results']] == [201, 201, 200]
+    assert data['results'][2]['body'] == {'name': 'buck'}
+    # credentials are verified for the batch alone
+    assert len([s for s in statements if 'users.password_hashed' in s]) == 1
+
+
+def test__batch_with_bad_requests__fails(client_with_user, app):
+    """Make sure malformed, unknown, nested and oversized batches are
+    reported"""
+    response, data = batch(client_with_user, [
+        {'method': 'FETCH', 'path': '/api/v1.0/bucketlists/'},
+        {'method': 'GET', 'path': '/api/v1.0/nowhere'},
+        {'method': 'POST', 'path': BATCH_ENDPOINT, 'body': {}},
+        {'method': 'GET', 'path': '/api/v1.0/bucketlists/'},
+    ])
+    assert response.status_code == status.HTTP_207_MULTI_STATUS
+    assert [r['status'] for r in data['results']] == [400, 404, 400, 200]
+
+    app.config['BATCH_MAX_REQUESTS'] = 1
+    response, data = batch(client_with_user, [{}, {}])
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+    response = client_with_user.post(
+        BATCH_ENDPOINT, headers=get_api_headers('arny', 'wrong'),
+        data=json.dumps({'requests': [{}]}))
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test__atomic_batch_rolls_back__succeeds(client_with_user):
+    """Make sure a failing sub-request of an atomic batch undoes the
+    earlier ones and skips the rest"""
+    response, data = batch(client_with_user, [
+        {'method': 'POST', 'path': '/api/v1.0/bucketlists/',
+         'body': {'name': 'buck'}},
+        {'method': 'POST', 'path': '/api/v1.0/bucketlists/',
+         'body': {'name': 'buck'}},
+        {'method': 'POST', 'path': '/api/v1.0/bucketlists/',
+         'body': {'name': 'other'}},
+    ], atomic=True)
+    assert response.status_code == status.HTTP_207_MULTI_STATUS
+    assert [r['status'] for r in data['results']] == [201, 409, 424]
+    assert BucketList.query.count() == 0
+    assert User.query.first().bucketlist_count == 0
+
+    response, data = batch(client_with_user, [
+        {'method': 'POST', 'path': '/api/v1.0/bucketlists/',
+         'body': {'name': 'buck'}},
+        {'method': 'POST', 'path': '/api/v1.0/bucketlists/1/tasks/',
+         'body': [{'description': 'a'}, {'description': 'b'}]},
+    ], atomic=True)
+    assert response.status_code == status.HTTP_200_OK
+    assert BucketList.query.count() == 1
+    assert Task.query.count() == 2
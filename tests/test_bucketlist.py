@@ -1,11 +1,13 @@
 import json
 from base64 import b64encode
+from collections import OrderedDict
 
 import pytest
 
 from bucky_api import db
 from bucky_api.common import status
-from bucky_api.models import User, BucketList
+from bucky_api.common.helpers import BucketListProjection
+from bucky_api.models import User, BucketList, Task
 
 BUCKETLIST_ENDPOINT = '/api/v1.0/bucketlists/'
 USER_ENDPOINT = '/api/v1.0/auth/users/'
@@ -303,3 +305,519 @@ def test__get_specific_number_of_bucketlists__succeeds(client_with_user):
                                     content_type='application/json')
     assert b'buck 5' in response.data
     assert b'buck 4' not in response.data
+
+
+# KEYSET PAGINATION
+def test__get_bucketlists_with_cursor__succeeds(client_with_user):
+    """Make sure a user can walk bucket-lists forwards and backwards
+    using opaque cursors"""
+    user = User.query.first()  # User <arny>
+    bucket_names = ('buck 1', 'buck 2', 'buck 3', 'buck 4', 'buck 5')
+    db.session.add_all([BucketList(name=bucket_name, user=user)
+                        for bucket_name in bucket_names])
+    db.session.commit()
+    headers = get_api_headers('arny', 'passy')
+
+    # first page
+    response = client_with_user.get(BUCKETLIST_ENDPOINT, headers=headers,
+                                    query_string={'cursor': ''})
+    assert response.status_code == status.HTTP_200_OK
+    data = json.loads(response.data.decode('utf-8'))
+    names = [b['name'] for b in data['bucket-lists']]
+    assert names == ['buck 1', 'buck 2', 'buck 3']
+    assert data['prev'] is None
+    assert 'cursor=' in data['next']
+
+    # second page
+    response = client_with_user.get(data['next'], headers=headers)
+    data = json.loads(response.data.decode('utf-8'))
+    names = [b['name'] for b in data['bucket-lists']]
+    assert names == ['buck 4', 'buck 5']
+    assert data['next'] is None
+
+    # back to the first page
+    response = client_with_user.get(data['prev'], headers=headers)
+    data = json.loads(response.data.decode('utf-8'))
+    names = [b['name'] for b in data['bucket-lists']]
+    assert names == ['buck 1', 'buck 2', 'buck 3']
+    assert data['prev'] is None
+    assert data['next']
+
+
+def test__get_bucketlists_with_cursor_keeps_endpoint__succeeds(
+        client_with_user):
+    """Make sure cursor links of search and limit listings point back
+    at the same listing"""
+    user = User.query.first()  # User <arny>
+    bucket_names = ('buck 1', 'buck 2', 'buck 3', 'other', 'buck 4')
+    db.session.add_all([BucketList(name=bucket_name, user=user)
+                        for bucket_name in bucket_names])
+    db.session.commit()
+    headers = get_api_headers('arny', 'passy')
+
+    response = client_with_user.get(BUCKETLIST_ENDPOINT + 'limit/2',
+                                    headers=headers,
+                                    query_string={'cursor': ''})
+    data = json.loads(response.data.decode('utf-8'))
+    assert '/bucketlists/limit/2?' in data['next']
+    response = client_with_user.get(data['next'], headers=headers)
+    data = json.loads(response.data.decode('utf-8'))
+    names = [b['name'] for b in data['bucket-lists']]
+    assert names == ['buck 3', 'other']
+
+    response = client_with_user.get(BUCKETLIST_ENDPOINT + 'search/buck',
+                                    headers=headers,
+                                    query_string={'cursor': ''})
+    data = json.loads(response.data.decode('utf-8'))
+    assert '/bucketlists/search/buck?' in data['next']
+    response = client_with_user.get(data['next'], headers=headers)
+    data = json.loads(response.data.decode('utf-8'))
+    names = [b['name'] for b in data['bucket-lists']]
+    assert names == ['buck 4']
+
+
+def test__get_bucketlists_with_bad_cursor__fails(client_with_user):
+    """Make sure a malformed cursor is rejected"""
+    response = client_with_user.get(BUCKETLIST_ENDPOINT,
+                                    headers=get_api_headers('arny', 'passy'),
+                                    query_string={'cursor': 'junk'})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert b'Invalid cursor' in response.data
+
+
+# QUERY COUNTS
+def get_token(client):
+    """Helper function fetching a token for <User username:arny>"""
+    response = client.get('/api/v1.0/auth/get_token/',
+                          headers=get_api_headers('arny', 'passy'))
+    return json.loads(response.data.decode('utf-8'))['token']
+
+
+def create_bucketlists_with_tasks(user, count, tasks_per_bucketlist=3):
+    """Helper function creating bucket-lists that each have tasks"""
+    for i in range(count):
+        bucket = BucketList(name='buck {}'.format(i), user=user,
+                            task_count=tasks_per_bucketlist)
+        db.session.add(bucket)
+        db.session.add_all([Task(description='task {}'.format(j),
+                                 bucketlist=bucket, user=user)
+                            for j in range(tasks_per_bucketlist)])
+    db.session.commit()
+
+
+def test__bucketlist_page_query_count_is_constant__succeeds(
+        client_with_user, statements):
+    """Make sure serializing a page of N bucket-lists with their tasks
+    costs the same number of statements whatever N is"""
+    headers = get_api_headers(get_token(client_with_user), '')
+    user = User.query.first()  # User <arny>
+    counts = []
+    for count in (2, 10):
+        create_bucketlists_with_tasks(user, count)
+        for query_string in ({'page': 1}, {'cursor': ''}):
+            del statements[:]
+            response = client_with_user.get(
+                BUCKETLIST_ENDPOINT + 'limit/' + str(count),
+                headers=headers, query_string=query_string)
+            assert response.status_code == status.HTTP_200_OK
+            data = json.loads(response.data.decode('utf-8'))
+            assert len(data['bucket-lists']) == count
+            assert all(len(b['tasks']) == 3 for b in data['bucket-lists'])
+            counts.append(len(statements))
+        BucketList.query.delete()
+        Task.query.delete()
+        db.session.commit()
+    # data version, bucket-lists, counter, tasks
+    assert counts == [4, 4, 4, 4]
+
+
+# FULL-TEXT SEARCH
+def search(client, term, **query_string):
+    """Helper function returning bucket-list names matching term"""
+    response = client.get(BUCKETLIST_ENDPOINT + 'search/' + term,
+                          headers=get_api_headers('arny', 'passy'),
+                          query_string=query_string)
+    assert response.status_code == status.HTTP_200_OK
+    data = json.loads(response.data.decode('utf-8'))
+    return [b['name'] for b in data['bucket-lists']]
+
+
+def test__search_results_ranked_by_relevance__succeeds(
+        client_with_user, statements):
+    """Make sure search uses the full-text index and returns the best
+    matches first"""
+    user = User.query.first()  # User <arny>
+    bucket_names = ('travel plans for the coming year', 'groceries',
+                    'travel', 'summer travel')
+    db.session.add_all([BucketList(name=bucket_name, user=user)
+                        for bucket_name in bucket_names])
+    db.session.commit()
+    del statements[:]
+    assert search(client_with_user, 'trav') == [
+        'travel', 'summer travel', 'travel plans for the coming year']
+    assert any('MATCH' in statement for statement in statements)
+    assert search(client_with_user, 'summer trav') == ['summer travel']
+    assert search(client_with_user, 'nothing') == []
+
+
+def test__search_index_follows_renames_and_deletes__succeeds(
+        client_with_user_n_bkt):
+    """Make sure the search index is kept in sync with bucket-lists"""
+    bucket = BucketList.query.first()  # BucketList <buck>
+    assert search(client_with_user_n_bkt, 'buck') == ['buck']
+    response = client_with_user_n_bkt.patch(
+        BUCKETLIST_ENDPOINT + str(bucket.id),
+        headers=get_api_headers('arny', 'passy'),
+        data=json.dumps({'name': 'renamed'}))
+    assert response.status_code == status.HTTP_200_OK
+    assert search(client_with_user_n_bkt, 'buck') == []
+    assert search(client_with_user_n_bkt, 'renam') == ['renamed']
+    response = client_with_user_n_bkt.delete(
+        BUCKETLIST_ENDPOINT + str(bucket.id),
+        headers=get_api_headers('arny', 'passy'))
+    assert response.status_code == status.HTTP_200_OK
+    assert search(client_with_user_n_bkt, 'renam') == []
+
+
+# MAINTAINED COUNTERS
+def test__counters_follow_creates_and_deletes__succeeds(
+        client_with_user_n_bkt, statements):
+    """Make sure bucket-list and task counters are maintained by the
+    write endpoints and used instead of COUNT(*)"""
+    headers = get_api_headers('arny', 'passy')
+    bucket = BucketList.query.first()  # BucketList <buck>
+    for description in ('task 1', 'task 2'):
+        response = client_with_user_n_bkt.post(
+            BUCKETLIST_ENDPOINT + str(bucket.id) + '/tasks/',
+            headers=headers, data=json.dumps({'description': description}))
+        assert response.status_code == status.HTTP_201_CREATED
+    task = Task.query.first()
+    response = client_with_user_n_bkt.delete(
+        BUCKETLIST_ENDPOINT + str(bucket.id) + '/tasks/' + str(task.id),
+        headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    response = client_with_user_n_bkt.post(BUCKETLIST_ENDPOINT,
+                                           headers=headers,
+                                           data=json.dumps({'name': 'buck 2'}))
+    assert response.status_code == status.HTTP_201_CREATED
+    assert User.query.first().bucketlist_count == 2
+    assert BucketList.query.get(bucket.id).task_count == 1
+
+    del statements[:]
+    for query_string in ({'page': 2}, {'cursor': ''}):
+        response = client_with_user_n_bkt.get(
+            BUCKETLIST_ENDPOINT + 'limit/1', headers=headers,
+            query_string=query_string)
+        data = json.loads(response.data.decode('utf-8'))
+        assert data['count'] == 2
+    assert not any('count(' in statement.lower()
+                   for statement in statements)
+
+    response = client_with_user_n_bkt.get(
+        BUCKETLIST_ENDPOINT + str(bucket.id), headers=headers)
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['task_count'] == 1
+
+    response = client_with_user_n_bkt.delete(
+        BUCKETLIST_ENDPOINT + str(bucket.id), headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert User.query.first().bucketlist_count == 1
+
+
+# SPARSE FIELDSETS AND EMBEDDING
+def test__get_bucketlists_with_sparse_fields__succeeds(
+        client_with_user, statements):
+    """Make sure fields= limits both the payload and the columns read,
+    and that tasks are only loaded when embedded"""
+    user = User.query.first()  # User <arny>
+    create_bucketlists_with_tasks(user, 2)
+    headers = get_api_headers('arny', 'passy')
+
+    del statements[:]
+    response = client_with_user.get(BUCKETLIST_ENDPOINT, headers=headers,
+                                    query_string={'fields': 'id,name'})
+    assert response.status_code == status.HTTP_200_OK
+    data = json.loads(response.data.decode('utf-8'))
+    assert [sorted(b) for b in data['bucket-lists']] == [['id', 'name']] * 2
+    assert not any('FROM tasks' in statement for statement in statements)
+    assert not any('bucketlists.task_count' in statement
+                   for statement in statements)
+
+    response = client_with_user.get(BUCKETLIST_ENDPOINT + 'search/buck',
+                                    headers=headers,
+                                    query_string={'fields': 'name',
+                                                  'embed': 'tasks'})
+    data = json.loads(response.data.decode('utf-8'))
+    assert [sorted(b) for b in data['bucket-lists']] == [['name', 'tasks']] * 2
+    assert len(data['bucket-lists'][0]['tasks']) == 3
+
+    bucket = BucketList.query.first()
+    response = client_with_user.get(BUCKETLIST_ENDPOINT + str(bucket.id),
+                                    headers=headers,
+                                    query_string={'fields': 'task_count'})
+    data = json.loads(response.data.decode('utf-8'))
+    assert data == {'task_count': 3}
+
+
+def test__get_bucketlists_with_unknown_fields__fails(client_with_user):
+    """Make sure unknown fields= or embed= names are rejected"""
+    for query_string in ({'fields': 'id,password'}, {'embed': 'user'}):
+        response = client_with_user.get(
+            BUCKETLIST_ENDPOINT, headers=get_api_headers('arny', 'passy'),
+            query_string=query_string)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert b'Unknown fields' in response.data
+
+
+def test__get_bucketlists_with_empty_fields__fails(client_with_user,
+                                                   statements):
+    """Make sure an empty fields= is rejected before any bucket-list or
+    task is read, rather than dumping every field"""
+    create_bucketlists_with_tasks(User.query.first(), 2)
+    del statements[:]
+    response = client_with_user.get(
+        BUCKETLIST_ENDPOINT, headers=get_api_headers('arny', 'passy'),
+        query_string={'fields': ''})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert b'No fields requested' in response.data
+    assert not any('FROM bucketlists' in statement or 'FROM tasks' in statement
+                   for statement in statements)
+
+
+def test__projection_schemas_are_cached__succeeds():
+    """Make sure a projection's schema is built once and reused"""
+    first = BucketListProjection(('id', 'name'), ()).schema(many=True)
+    second = BucketListProjection(('id', 'name'), ()).schema(many=True)
+    assert first is second
+    assert BucketListProjection(('id', 'name'), ()).schema() is not first
+
+
+# CONDITIONAL REQUESTS
+def test__unchanged_bucketlists_not_modified__succeeds(
+        client_with_user_n_bkt, statements):
+    """Make sure repeating a read with its ETag answers 304 without
+    touching the bucket-list or task tables"""
+    headers = get_api_headers(get_token(client_with_user_n_bkt), '')
+    response = client_with_user_n_bkt.get(BUCKETLIST_ENDPOINT,
+                                          headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'no-cache, must-revalidate'
+
+    del statements[:]
+    headers['If-None-Match'] = etag
+    response = client_with_user_n_bkt.get(BUCKETLIST_ENDPOINT,
+                                          headers=headers)
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.headers['ETag'] == etag
+    assert response.data == b''
+    assert len(statements) == 1
+    assert 'bucketlists' not in statements[0]
+    assert 'tasks' not in statements[0]
+
+
+def test__changed_bucketlists_get_new_etag__succeeds(client_with_user_n_bkt):
+    """Make sure a write to any of the user's data invalidates ETags"""
+    headers = get_api_headers('arny', 'passy')
+    response = client_with_user_n_bkt.get(BUCKETLIST_ENDPOINT,
+                                          headers=headers)
+    etag = response.headers['ETag']
+
+    bucket = BucketList.query.first()
+    response = client_with_user_n_bkt.post(
+        BUCKETLIST_ENDPOINT + str(bucket.id) + '/tasks/',
+        headers=headers, data=json.dumps({'description': 'new task'}))
+    assert response.status_code == status.HTTP_201_CREATED
+
+    headers['If-None-Match'] = etag
+    response = client_with_user_n_bkt.get(BUCKETLIST_ENDPOINT,
+                                          headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['ETag'] != etag
+
+
+def test__bucketlist_etags_follow_that_bucketlist__succeeds(
+        client_with_user_n_bkt):
+    """Make sure the ETags of a bucket-list and of its tasks only change
+    with writes to that bucket-list"""
+    headers = get_api_headers('arny', 'passy')
+    bucket = BucketList.query.first()
+    other = client_with_user_n_bkt.post(BUCKETLIST_ENDPOINT, headers=headers,
+                                        data=json.dumps({'name': 'other'}))
+    other_id = json.loads(other.data.decode('utf-8'))['bucketList']['id']
+    client_with_user_n_bkt.post(
+        BUCKETLIST_ENDPOINT + str(bucket.id) + '/tasks/',
+        headers=headers, data=json.dumps({'description': 'a task'}))
+    urls = (BUCKETLIST_ENDPOINT + str(bucket.id),
+            BUCKETLIST_ENDPOINT + str(bucket.id) + '/tasks/')
+
+    def etags():
+        return [client_with_user_n_bkt.get(url, headers=headers)
+                .headers['ETag'] for url in urls]
+
+    before = etags()
+    response = client_with_user_n_bkt.patch(
+        BUCKETLIST_ENDPOINT + str(other_id), headers=headers,
+        data=json.dumps({'name': 'renamed'}))
+    assert response.status_code == status.HTTP_200_OK
+    assert etags() == before
+
+    task_id = Task.query.filter_by(bucketlist_id=bucket.id).first().id
+    response = client_with_user_n_bkt.patch(
+        BUCKETLIST_ENDPOINT + str(bucket.id) + '/tasks/' + str(task_id),
+        headers=headers, data=json.dumps({'description': 'edited'}))
+    assert response.status_code == status.HTTP_200_OK
+    after_edit = etags()
+    assert after_edit[0] != before[0] and after_edit[1] != before[1]
+
+    response = client_with_user_n_bkt.patch(
+        BUCKETLIST_ENDPOINT, headers=headers,
+        data=json.dumps({str(bucket.id): 'renamed in bulk'}))
+    assert response.status_code == status.HTTP_200_OK
+    assert etags()[0] != after_edit[0]
+
+
+# BULK OPERATIONS
+def bulk(client, method, data):
+    """Helper function sending a bulk request to the collection endpoint"""
+    response = getattr(client, method)(
+        BUCKETLIST_ENDPOINT, headers=get_api_headers('arny', 'passy'),
+        data=json.dumps(data))
+    return response, json.loads(response.data.decode('utf-8'))
+
+
+def test__create_many_bucketlists__succeeds(client_with_user_n_bkt):
+    """Make sure an array of bucket-lists is created in one go with
+    per-item results"""
+    response, data = bulk(client_with_user_n_bkt, 'post',
+                          [{'name': 'a'}, {'name': 'buck'}, {'name': 'a'},
+                           {'name': 3}, {'name': 'b'}])
+    assert response.status_code == status.HTTP_207_MULTI_STATUS
+    assert [r['status'] for r in data['results']] == [201, 409, 409,
+                                                      422, 201]
+    assert data['results'][0]['bucketList']['tasks'] == []
+    names = [b.name for b in BucketList.query.order_by(BucketList.id)]
+    assert names == ['buck', 'a', 'b']
+    created = data['results'][4]['bucketList']
+    assert created['id'] == BucketList.query.filter_by(name='b').one().id
+    assert User.query.first().bucketlist_count == 3
+    assert search(client_with_user_n_bkt, 'a') == ['a']
+
+
+def test__rename_many_bucketlists__succeeds(client_with_user, client):
+    """Make sure bucket-lists are renamed from an id to name map, scoped
+    to the current user"""
+    response, data = bulk(client_with_user, 'post',
+                          [{'name': 'a'}, {'name': 'b'}, {'name': 'c'}])
+    a, b, c = [r['bucketList']['id'] for r in data['results']]
+    other = BucketList(name='theirs', user=User(username='bob',
+                                                password='pass'))
+    db.session.add(other)
+    db.session.commit()
+
+    # the first of two renames to the same name wins
+    response, data = bulk(client_with_user, 'patch', OrderedDict([
+        (str(a), 'x'), (str(b), 'x'), (str(c), 'c'),
+        (str(other.id), 'mine'), ('nope', 'y')]))
+    assert response.status_code == status.HTTP_207_MULTI_STATUS
+    assert [(r['id'], r['status']) for r in data['results']] == [
+        (a, 200), (b, 409), (c, 200), (other.id, 404), ('nope', 422)]
+    names = [bkt.name for bkt in BucketList.query.order_by(BucketList.id)]
+    assert names == ['x', 'b', 'c', 'theirs']
+    assert search(client_with_user, 'x') == ['x']
+
+
+def test__delete_many_bucketlists__succeeds(client_with_user):
+    """Make sure bucket-lists are deleted from an id list, scoped to the
+    current user"""
+    user = User.query.first()  # User <arny>
+    create_bucketlists_with_tasks(user, 3, tasks_per_bucketlist=2)
+    user.bucketlist_count = 3
+    other = BucketList(name='theirs', user=User(username='bob',
+                                                password='pass'))
+    db.session.add(other)
+    db.session.commit()
+    first, second, third = [b.id for b in user.bucketlists]
+
+    response, data = bulk(client_with_user, 'delete',
+                          [first, third, other.id, 'x', first])
+    assert response.status_code == status.HTTP_207_MULTI_STATUS
+    assert [r['status'] for r in data['results']] == [200, 200, 404, 422,
+                                                      422]
+    assert data['results'][4]['errors'] == {'id': ['Duplicate id.']}
+    ids = [b.id for b in BucketList.query.order_by(BucketList.id)]
+    assert ids == [second, other.id]
+    assert User.query.get(user.id).bucketlist_count == 1
+
+    response, data = bulk(client_with_user, 'delete', [second])
+    assert response.status_code == status.HTTP_200_OK
+
+
+# WRITE STATEMENT COUNTS
+def test__bucketlist_writes_statement_counts__succeeds(client_with_user,
+                                                       statements):
+    """Make sure bucket-list writes serialize what they wrote without
+    reading it back"""
+    headers = get_api_headers(get_token(client_with_user), '')
+    del statements[:]
+    response = client_with_user.post(BUCKETLIST_ENDPOINT, headers=headers,
+                                     data=json.dumps({'name': 'buck'}))
+    assert response.status_code == status.HTTP_201_CREATED
+    assert json.loads(response.data.decode('utf-8'))['bucketList'] == {
+        'id': 1, 'name': 'buck', 'task_count': 0, 'tasks': []}
+    # insert, counters
+    assert len(statements) == 2
+
+    del statements[:]
+    response = client_with_user.patch(BUCKETLIST_ENDPOINT + '1',
+                                      headers=headers,
+                                      data=json.dumps({'name': 'bucky'}))
+    assert response.status_code == status.HTTP_200_OK
+    assert b'bucky' in response.data
+    # bucket-list, update, data version, its tasks
+    assert len(statements) == 4
+
+
+# UNIQUENESS
+def test__rename_bucketlist_to_existing_name__fails(client_with_user_n_bkt):
+    """Make sure the unique index turns a clashing rename into a 409"""
+    headers = get_api_headers('arny', 'passy')
+    response = client_with_user_n_bkt.post(BUCKETLIST_ENDPOINT,
+                                           headers=headers,
+                                           data=json.dumps({'name': 'b2'}))
+    bucket_id = json.loads(response.data.decode('utf-8'))['bucketList']['id']
+    response = client_with_user_n_bkt.patch(
+        BUCKETLIST_ENDPOINT + str(bucket_id), headers=headers,
+        data=json.dumps({'name': 'buck'}))
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert b'Bucket-list already exists' in response.data
+    assert BucketList.query.get(bucket_id).name == 'b2'
+
+
+# CASCADING DELETES
+def test__delete_bucketlist_cascades_to_tasks__succeeds(client_with_user,
+                                                        statements):
+    """Make sure deleting a bucket-list deletes its tasks in the database
+    with the same statements whatever the number of tasks"""
+    headers = get_api_headers(get_token(client_with_user), '')
+    user = User.query.first()  # User <arny>
+    create_bucketlists_with_tasks(user, 2, tasks_per_bucketlist=50)
+    user.bucketlist_count = 2
+    db.session.commit()
+    small, large = BucketList.query.order_by(BucketList.id).all()
+    db.session.add_all([Task(description='more {}'.format(i),
+                             bucketlist=large, user=user)
+                        for i in range(200)])
+    db.session.commit()
+
+    counts = []
+    for bucket_id in (small.id, large.id):
+        del statements[:]
+        response = client_with_user.delete(
+            BUCKETLIST_ENDPOINT + str(bucket_id), headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        counts.append(len(statements))
+    # delete, counters
+    assert counts == [2, 2]
+    assert Task.query.count() == 0
+    assert User.query.first().bucketlist_count == 0
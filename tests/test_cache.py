@@ -0,0 +1,72 @@
+import time
+
+from bucky_api.common.cache import CredentialCache
+
+
+def test__cached_credentials_expire_after_ttl__succeeds(monkeypatch):
+    """Make sure entries are not served once their ttl has passed"""
+    now = [1000.0]
+    monkeypatch.setattr('bucky_api.common.cache.time.monotonic',
+                        lambda: now[0])
+    cache = CredentialCache(ttl=10)
+    cache.set('arny', 'passy', 1, 'arny', time.time())
+    assert cache.get('arny', 'passy') == 'arny'
+    now[0] += 11
+    assert cache.get('arny', 'passy') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 0}
+
+
+def test__cache_evicts_least_recently_used__succeeds():
+    """Make sure the cache never grows beyond max_size"""
+    cache = CredentialCache(max_size=2)
+    cache.set('arny', 'passy', 1, 'arny', time.time())
+    cache.set('harry', 'test', 2, 'harry', time.time())
+    # touch arny so that harry is the oldest entry
+    assert cache.get('arny', 'passy') == 'arny'
+    cache.set('ron', 'weasley', 3, 'ron', time.time())
+    assert cache.get('harry', 'test') is None
+    assert cache.get('arny', 'passy') == 'arny'
+    assert cache.stats()['size'] == 2
+
+
+def test__cache_is_keyed_on_username_and_password__succeeds():
+    """Make sure a different password for a cached user is a miss"""
+    cache = CredentialCache()
+    cache.set('arny', 'passy', 1, 'arny', time.time())
+    assert cache.get('arny', 'wrong') is None
+    assert cache.get('arn', 'ypassy') is None
+
+
+def test__invalidate_user_drops_all_entries__succeeds():
+    """Make sure every entry of an invalidated user is dropped"""
+    cache = CredentialCache()
+    cache.set('arny', 'passy', 1, 'arny', time.time())
+    cache.set('ARNY', 'passy', 1, 'arny', time.time())
+    cache.set('harry', 'test', 2, 'harry', time.time())
+    cache.invalidate_user(1)
+    assert cache.get('arny', 'passy') is None
+    assert cache.get('ARNY', 'passy') is None
+    assert cache.get('harry', 'test') == 'harry'
+
+
+def test__invalidation_reaches_other_workers__succeeds(tmpdir):
+    """Make sure a password change in one worker evicts the entries and
+    versions another worker cached before it"""
+    path = str(tmpdir.join('stamps'))
+    worker, other = CredentialCache(), CredentialCache()
+    worker.stamps.open(path, 16)
+    other.stamps.open(path, 16)
+    checked_at = time.time()
+    other.set('arny', 'passy', 1, 'arny', checked_at)
+    other.set('harry', 'test', 2, 'harry', checked_at)
+    other.set_version(1, 1, checked_at)
+    worker.invalidate_user(1)
+    assert other.get('arny', 'passy') is None
+    assert other.get_version(1) is None
+    assert other.get('harry', 'test') == 'harry'
+    # verifications started after the change are cached again
+    checked_at = worker.stamps.last(1) + 1
+    other.set('arny', 'new', 1, 'arny', checked_at)
+    other.set_version(1, 2, checked_at)
+    assert other.get('arny', 'new') == 'arny'
+    assert other.get_version(1) == 2
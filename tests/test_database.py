@@ -0,0 +1,93 @@
+import pytest
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine.url import make_url
+
+from bucky_api import db
+from bucky_api.common.database import (InstrumentedQueuePool,
+                                       is_unique_violation, pool_metrics)
+from bucky_api.models import BucketList, User
+
+
+def engine_options(app, url):
+    options = {}
+    db.apply_pool_defaults(app, options)
+    db.apply_driver_hacks(app, make_url(url), options)
+    return options
+
+
+def test__postgresql_engine_gets_pool_settings__succeeds(app):
+    """Make sure server databases get the configured, instrumented pool"""
+    app.config.update(SQLALCHEMY_POOL_SIZE=7,
+                      SQLALCHEMY_STATEMENT_TIMEOUT=3000,
+                      SQLALCHEMY_PGBOUNCER=False)
+    options = engine_options(app, 'postgresql://bucky@localhost/bucky')
+    assert options['poolclass'] is InstrumentedQueuePool
+    assert options['pool_size'] == 7
+    assert options['pool_pre_ping']
+    assert options['connect_args']['options'] == (
+        '-c statement_timeout=3000')
+
+
+def test__pgbouncer_mode_keeps_no_session_state__succeeds(app):
+    """Make sure the statement timeout is set per transaction instead of
+    on the connection"""
+    app.config.update(SQLALCHEMY_STATEMENT_TIMEOUT=3000,
+                      SQLALCHEMY_PGBOUNCER=True)
+    options = engine_options(app, 'postgresql://bucky@localhost/bucky')
+    assert 'options' not in options.get('connect_args', {})
+    assert options['execution_options'] == {
+        'local_statement_timeout': 3000}
+
+
+def test__sqlite_engine_ignores_pool_sizing__succeeds(app, tmpdir):
+    """Make sure sqlite keeps a pool it can be created with"""
+    options = engine_options(app, 'sqlite:///' + str(tmpdir.join('db')))
+    assert 'pool_size' not in options
+    assert 'max_overflow' not in options
+    assert options['poolclass'].__name__ == 'NullPool'
+
+
+def test__pool_metrics_count_checkouts_and_timeouts__succeeds(tmpdir):
+    """Make sure the pool reports saturation and waits that time out"""
+    engine = create_engine('sqlite:///' + str(tmpdir.join('db')),
+                           poolclass=InstrumentedQueuePool, pool_size=1,
+                           max_overflow=0, pool_timeout=0.01)
+    connection = engine.connect()
+    metrics = pool_metrics(engine)
+    assert metrics['checked_out'] == 1
+    assert metrics['saturation'] == 1.0
+    assert metrics['checkouts'] == 1
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    connection.close()
+    metrics = pool_metrics(engine)
+    assert metrics['checked_out'] == 0
+    assert metrics['timeouts'] == 1
+    assert metrics['max_wait_seconds'] >= 0.01
+
+
+def integrity_error(*statements):
+    """Helper function returning the IntegrityError of the last of
+    statements, rolled back"""
+    with pytest.raises(exc.IntegrityError) as error:
+        for statement in statements:
+            db.session.execute(statement)
+    db.session.rollback()
+    return error.value
+
+
+def test__unique_violations_are_told_from_other_errors__succeeds(client):
+    """Make sure only the violated unique index is reported as one"""
+    table = BucketList.__table__
+    db.session.execute(User.__table__.insert().values(id=1, username='u'))
+    db.session.commit()
+    duplicate = integrity_error(
+        table.insert().values(user_id=1, name='buck'),
+        table.insert().values(user_id=1, name='buck'))
+    assert is_unique_violation(duplicate, table,
+                               'uq_bucketlists_user_id_name')
+    assert not is_unique_violation(duplicate, User.__table__,
+                                   'ix_users_username')
+    orphan = integrity_error(table.insert().values(user_id=2, name='buck'))
+    assert not is_unique_violation(orphan, table,
+                                   'uq_bucketlists_user_id_name')
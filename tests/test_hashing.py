@@ -0,0 +1,45 @@
+import threading
+
+import pytest
+
+from bucky_api.common.hashing import PasswordHasher, HashingQueueFull
+
+
+@pytest.fixture
+def hasher(app):
+    """A password hasher configured like the test app"""
+    hasher = PasswordHasher(app)
+    yield hasher
+    hasher.shutdown()
+
+
+def test__hash_uses_configured_method_and_iterations__succeeds(hasher):
+    """Make sure hashes carry the configured method and work factor"""
+    password_hashed = hasher.hash('passy')
+    assert password_hashed.startswith('pbkdf2:sha256:1000$')
+    assert hasher.verify(password_hashed, 'passy')
+    assert not hasher.verify(password_hashed, 'wrong')
+    assert not hasher.needs_rehash(password_hashed)
+    hasher.method = 'pbkdf2:sha256:2000'
+    assert hasher.needs_rehash(password_hashed)
+
+
+def test__hashing_on_process_pool__succeeds(hasher):
+    """Make sure hashing and verification work on worker processes"""
+    hasher.workers = 1
+    password_hashed = hasher.hash('passy')
+    assert hasher.verify(password_hashed, 'passy')
+    assert not hasher.verify(password_hashed, 'wrong')
+
+
+def test__hashing_beyond_queue_depth__fails(hasher):
+    """Make sure callers are turned away once max_pending jobs
+    are in flight"""
+    hasher.workers = 1
+    hasher._slots = threading.BoundedSemaphore(1)
+    hasher._slots.acquire()
+    try:
+        with pytest.raises(HashingQueueFull):
+            hasher.hash('passy')
+    finally:
+        hasher._slots.release()
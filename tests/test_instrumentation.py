@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from bucky_api.common import status
+from bucky_api.common.instrumentation import start_timer
+
+BATCH_ENDPOINT = '/api/v1.0/batch'
+BUCKETLIST_ENDPOINT = '/api/v1.0/bucketlists/'
+
+
+# TEST HELPERS
+def server_timing(response):
+    """Helper function parsing a Server-Timing header into a dict"""
+    metrics = {}
+    for metric in response.headers['Server-Timing'].split(', '):
+        name, params = metric.split(';', 1)
+        metrics[name] = params
+    return metrics
+
+
+# PY.TEST FIXTURES
+@pytest.fixture
+def timed_client(make_client):
+    """A test client of an app with instrumentation enabled, having
+    a registered user <User username:arny, password:passy> with one
+    bucket-list"""
+    return make_client(bucketlists=['buck'], INSTRUMENTATION_ENABLED=True)
+
+
+def test__responses_have_server_timing__succeeds(timed_client, api_headers):
+    """Make sure every phase of a request is reported"""
+    response = timed_client.get(BUCKETLIST_ENDPOINT,
+                                headers=api_headers('arny', 'passy'))
+    assert response.status_code == status.HTTP_200_OK
+    metrics = server_timing(response)
+    assert set(metrics) == {'auth', 'db', 'dump', 'encode', 'total'}
+    assert 'desc="' in metrics['db']
+
+
+def test__batch_reports_its_sub_requests_once__succeeds(timed_client,
+                                                        api_headers):
+    """Make sure sub-requests add to the timings of the batch"""
+    response = timed_client.post(
+        BATCH_ENDPOINT, headers=api_headers('arny', 'passy'),
+        data=json.dumps({'requests': [
+            {'method': 'GET', 'path': BUCKETLIST_ENDPOINT + '1'},
+            {'method': 'GET', 'path': BUCKETLIST_ENDPOINT + '1'}]}))
+    assert response.status_code == status.HTTP_200_OK
+    assert 'dump' in server_timing(response)
+
+
+def test__requests_over_budget_are_logged__succeeds(timed_client,
+                                                    api_headers,
+                                                    monkeypatch):
+    """Make sure requests making too many statements are logged"""
+    app = timed_client.application
+    app.config['SLOW_REQUEST_STATEMENTS'] = 1
+    warnings = []
+    monkeypatch.setattr(app.logger, 'warning',
+                        lambda msg, *args: warnings.append(msg % args))
+    timed_client.get(BUCKETLIST_ENDPOINT,
+                     headers=api_headers('arny', 'passy'))
+    assert len(warnings) == 1
+    assert warnings[0].startswith('Slow request GET /api/v1.0/bucketlists/')
+
+
+def test__disabled_instrumentation_registers_nothing__succeeds(client):
+    """Make sure apps without instrumentation pay nothing for it"""
+    assert start_timer not in client.application.before_request_funcs.get(
+        None, [])
+    response = client.get(BUCKETLIST_ENDPOINT)
+    assert 'Server-Timing' not in response.headers
@@ -0,0 +1,158 @@
+import json
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from bucky_api.common import metrics, status
+from bucky_api.common.metrics import (PROCESS_START, MetricsFile, labels,
+                                      read_samples)
+
+BATCH_ENDPOINT = '/api/v1.0/batch'
+BUCKETLIST_ENDPOINT = '/api/v1.0/bucketlists/'
+
+
+# TEST HELPERS
+def scrape(client):
+    """Helper function returning the samples of /metrics as a dict"""
+    response = client.get('/metrics')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    samples = {}
+    for line in response.data.decode('utf-8').splitlines():
+        if not line.startswith('#'):
+            key, value = line.rsplit(' ', 1)
+            samples[key] = float(value)
+    return samples
+
+
+def dead_pid():
+    """Helper function returning the pid of a process that exited"""
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+# PY.TEST FIXTURES
+@pytest.fixture
+def metrics_client(make_client, tmpdir):
+    """A test client of an app recording metrics in a temporary directory,
+    having a registered user <User username:arny, password:passy>"""
+    return make_client(METRICS_ENABLED=True, METRICS_DIR=str(tmpdir))
+
+
+def test__metrics_count_requests_per_endpoint__succeeds(metrics_client,
+                                                        api_headers):
+    """Make sure requests are counted by endpoint name and status"""
+    headers = api_headers('arny', 'passy')
+    metrics_client.get(BUCKETLIST_ENDPOINT, headers=headers)
+    listed = metrics_client.get(BUCKETLIST_ENDPOINT, headers=headers)
+    searched = metrics_client.get(BUCKETLIST_ENDPOINT + 'search/buck',
+                                  headers=headers)
+    samples = scrape(metrics_client)
+    assert samples['bucky_requests_total' + labels(
+        endpoint='bucketlists', method='GET',
+        status=listed.status_code)] == 2
+    assert samples['bucky_requests_total' + labels(
+        endpoint='bucketlists/search', method='GET',
+        status=searched.status_code)] == 1
+    assert samples['bucky_request_duration_seconds_count' + labels(
+        endpoint='bucketlists')] == 2
+    assert samples['bucky_request_duration_seconds_bucket' + labels(
+        endpoint='bucketlists', le='+Inf')] == 2
+    assert samples['bucky_auth_cache_hits_total'] == 2
+    assert samples['bucky_auth_cache_hit_ratio'] == 2 / 3
+
+
+def test__batches_are_timed_from_their_start__succeeds(metrics_client,
+                                                       api_headers,
+                                                       monkeypatch):
+    """Make sure a batch is timed from its start rather than from the
+    start of its last sub-request"""
+    # a clock advancing one second every time a request starts
+    now = [0.0]
+    monkeypatch.setattr(metrics, 'time',
+                        SimpleNamespace(perf_counter=lambda: now[0]))
+
+    def tick():
+        now[0] += 1
+
+    metrics_client.application.before_request(tick)
+    response = metrics_client.post(
+        BATCH_ENDPOINT, headers=api_headers('arny', 'passy'),
+        data=json.dumps({'requests': [
+            {'method': 'GET', 'path': BUCKETLIST_ENDPOINT},
+            {'method': 'GET', 'path': BUCKETLIST_ENDPOINT}]}))
+    assert response.status_code == status.HTTP_200_OK
+    samples = scrape(metrics_client)
+    assert samples['bucky_request_duration_seconds_sum' + labels(
+        endpoint='batch')] == 3
+    assert ('bucky_request_duration_seconds_count' + labels(
+        endpoint='bucketlists')) not in samples
+
+
+def test__metrics_merge_worker_processes__succeeds(metrics_client,
+                                                   api_headers, tmpdir):
+    """Make sure counters of other processes are added up while gauges
+    of processes that exited are left out"""
+    response = metrics_client.get(BUCKETLIST_ENDPOINT,
+                                  headers=api_headers('arny', 'passy'))
+    key = 'bucky_requests_total' + labels(
+        endpoint='bucketlists', method='GET', status=response.status_code)
+    pid = dead_pid()
+    other = MetricsFile(str(tmpdir.join('{}.db'.format(pid))))
+    other.inc(key, 5)
+    other.set('bucky_db_pool_checked_out', 3)
+    other.close()
+    samples = scrape(metrics_client)
+    assert samples[key] == 6
+    assert not any('pid="{}"'.format(pid) in key for key in samples)
+    # the exited process' counters were archived and its file removed
+    assert not tmpdir.join('{}.db'.format(pid)).exists()
+    assert read_samples(str(tmpdir.join('archive.db'))) == {key: 5}
+    assert scrape(metrics_client)[key] == 6
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/stat'),
+                    reason='process start times are read from /proc')
+def test__metrics_of_reused_pids_are_archived__succeeds(metrics_client,
+                                                        tmpdir):
+    """Make sure a file whose pid now belongs to another process is
+    treated like the file of a process that exited"""
+    scrape(metrics_client)
+    own = read_samples(str(tmpdir.join('{}.db'.format(os.getpid()))))
+    assert own[PROCESS_START] > 0
+    # the parent process is alive but did not write this file
+    path = str(tmpdir.join('{}.db'.format(os.getppid())))
+    other = MetricsFile(path)
+    other.set(PROCESS_START, -1)
+    other.set('bucky_db_pool_checked_out', 3)
+    other.inc('bucky_auth_cache_hits_total', 5)
+    other.close()
+    samples = scrape(metrics_client)
+    assert not any('pid="{}"'.format(os.getppid()) in key
+                   for key in samples)
+    assert not os.path.exists(path)
+    assert read_samples(str(tmpdir.join('archive.db'))) == {
+        'bucky_auth_cache_hits_total': 5}
+    assert PROCESS_START not in ''.join(samples)
+
+
+def test__metrics_file_grows_and_reopens__succeeds(tmpdir):
+    """Make sure a file keeps its samples past its initial size and
+    across processes reusing it"""
+    path = str(tmpdir.join('1.db'))
+    store = MetricsFile(path)
+    for i in range(5000):
+        store.inc('sample_{}'.format(i))
+    store.inc('sample_0', 2)
+    store.close()
+    store = MetricsFile(path)
+    store.inc('sample_0')
+    store.close()
+    samples = read_samples(path)
+    assert len(samples) == 5000
+    assert samples['sample_0'] == 4
+    assert samples['sample_4999'] == 1
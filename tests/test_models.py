@@ -1,7 +1,7 @@
 import pytest
 
 from bucky_api import db
-from bucky_api.models import User, BucketList, Task
+from bucky_api.models import User, UserIdentity, BucketList, Task
 
 
 @pytest.fixture
@@ -46,6 +46,28 @@ def test__user_can_generate_token__succeeds(user):
     assert unverified_user is None
 
 
+def test__token_claims_verify_without_query__succeeds(user):
+    """Make sure a token can be verified into an identity from its
+    claims alone"""
+    token = user.generate_auth_token(expiration=10)
+    identity = User.verify_auth_token_claims(token)
+    assert isinstance(identity, UserIdentity)
+    assert identity.id == user.id
+    assert identity.username == 'arny'
+    assert identity.credential_version == user.credential_version
+    assert User.verify_auth_token_claims("junk") is None
+
+
+def test__token_issued_before_password_change__fails(user):
+    """Make sure changing the password revokes tokens on the
+    database-backed verification path"""
+    token = user.generate_auth_token(expiration=10)
+    user.password = 'passi'
+    db.session.commit()
+    assert User.verify_auth_token(token) is None
+    assert User.verify_auth_token(user.generate_auth_token()).id == user.id
+
+
 def test__user_has_custom_repr__succeeds(user):
     """Make sure user object has custom text representation"""
     assert 'User <arny>' in user.__repr__()
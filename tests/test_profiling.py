@@ -0,0 +1,94 @@
+import json
+import pstats
+
+import pytest
+
+from bucky_api.common import status
+from bucky_api.common.profiling import ProfileStore, RequestProfile
+
+BUCKETLIST_ENDPOINT = '/api/v1.0/bucketlists/'
+
+
+# TEST HELPERS
+def with_profile(headers, token):
+    """Helper function adding a request for a profile with the given
+    token to headers"""
+    return dict(headers, **{'X-Profile': token})
+
+
+def list_profiles(client, token='secret'):
+    """Helper function returning the profiles kept by the app"""
+    response = client.get('/profiles', headers={'X-Profile': token})
+    assert response.status_code == status.HTTP_200_OK
+    return json.loads(response.data.decode('utf-8'))['profiles']
+
+
+# PY.TEST FIXTURES
+@pytest.fixture
+def profiled_client(make_client):
+    """A test client of an app profiling requests sent with the token
+    secret, having a registered user <User username:arny, password:passy>"""
+    return make_client(PROFILER_ENABLED=True, PROFILER_TOKEN='secret')
+
+
+def test__requests_with_admin_token_are_profiled__succeeds(profiled_client,
+                                                           api_headers,
+                                                           tmpdir):
+    """Make sure a profile is kept and downloadable in both formats"""
+    profiled_client.get(BUCKETLIST_ENDPOINT,
+                        headers=with_profile(api_headers('arny', 'passy'),
+                                             'secret'))
+    profiles = list_profiles(profiled_client)
+    assert len(profiles) == 1
+    assert profiles[0]['endpoint'] == 'bucketlists.bucketlists'
+    assert profiles[0]['status'] == status.HTTP_200_OK
+
+    url = '/profiles/{}'.format(profiles[0]['id'])
+    response = profiled_client.get(url + '?format=pstats',
+                                   headers={'X-Profile': 'secret'})
+    path = tmpdir.join('profile.pstats')
+    path.write_binary(response.data)
+    functions = [f[2] for f in pstats.Stats(str(path)).stats]
+    assert 'verify_credentials' in functions
+
+    response = profiled_client.get(url + '?format=collapsed',
+                                   headers={'X-Profile': 'secret'})
+    lines = response.data.decode('utf-8').splitlines()
+    assert any('verify_credentials' in line for line in lines)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+
+
+def test__profiles_need_admin_token__fails(profiled_client, api_headers):
+    """Make sure other tokens neither profile nor download profiles"""
+    profiled_client.get(BUCKETLIST_ENDPOINT,
+                        headers=with_profile(api_headers('arny', 'passy'),
+                                             'guess'))
+    response = profiled_client.get('/profiles',
+                                   headers={'X-Profile': 'guess'})
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+    assert list_profiles(profiled_client) == []
+
+
+def test__sampled_requests_are_profiled__succeeds(profiled_client,
+                                                  api_headers):
+    """Make sure a sample rate of 1 profiles every request"""
+    profiled_client.application.config['PROFILER_SAMPLE_RATE'] = 1
+    profiled_client.get(BUCKETLIST_ENDPOINT,
+                        headers=api_headers('arny', 'passy'))
+    profiles = list_profiles(profiled_client)
+    assert [p['endpoint'] for p in profiles] == ['bucketlists.bucketlists']
+
+
+def test__store_keeps_slowest_profiles__succeeds():
+    """Make sure only the slowest profiles are kept"""
+    store = ProfileStore(size=2)
+    for duration in (0.3, 0.1, 0.5, 0.2):
+        store.add(RequestProfile(store.next_id(), 'GET', '/', None, 200,
+                                 duration, 0, {}))
+    assert [p.duration for p in store.slowest()] == [0.5, 0.3]
+
+
+def test__disabled_profiler_registers_nothing__succeeds(client):
+    """Make sure apps without the profiler do not serve profiles"""
+    response = client.get('/profiles', headers={'X-Profile': 'secret'})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
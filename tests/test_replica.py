@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from bucky_api import db, write_tracker
+from bucky_api.common import status
+
+BATCH_ENDPOINT = '/api/v1.0/batch'
+BUCKETLIST_ENDPOINT = '/api/v1.0/bucketlists/'
+
+
+# PY.TEST FIXTURES
+@pytest.fixture
+def replica_client(make_client, tmpdir):
+    """A test client whose app has an empty replica, a sqlite file, and
+    a registered user <User username:arny, password:passy> with one
+    bucket-list"""
+    client = make_client(
+        bucketlists=['buck'],
+        SQLALCHEMY_BINDS={'replica': 'sqlite:///' + str(
+            tmpdir.join('replica.sqlite'))},
+        REPLICA_WRITES_FILE=str(tmpdir.join('writes')))
+    replica = db.get_engine(client.application, 'replica')
+    db.Model.metadata.create_all(replica)
+    yield client
+    db.Model.metadata.drop_all(replica)
+
+
+def test__reads_stay_on_primary_after_a_write__succeeds(replica_client,
+                                                        api_headers):
+    """Make sure a user sees their own write right after making it"""
+    response = replica_client.get(BUCKETLIST_ENDPOINT + '1',
+                                  headers=api_headers('arny', 'passy'))
+    assert response.status_code == status.HTTP_200_OK
+
+
+def test__reads_go_to_replica_once_window_passed__succeeds(
+        replica_client, api_headers, monkeypatch):
+    """Make sure reads are served by the replica, which is empty here"""
+    monkeypatch.setattr(write_tracker, 'window', 0)
+    response = replica_client.get(BUCKETLIST_ENDPOINT + '1',
+                                  headers=api_headers('arny', 'passy'))
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test__atomic_batch_reads_its_own_writes__succeeds(
+        replica_client, api_headers, monkeypatch):
+    """Make sure reads of an atomic batch stay in its transaction"""
+    monkeypatch.setattr(write_tracker, 'window', 0)
+    response = replica_client.post(
+        BATCH_ENDPOINT, headers=api_headers('arny', 'passy'),
+        data=json.dumps({'atomic': True, 'requests': [
+            {'method': 'POST', 'path': BUCKETLIST_ENDPOINT,
+             'body': {'name': 'other'}},
+            {'method': 'GET', 'path': BUCKETLIST_ENDPOINT + '2'}]}))
+    results = json.loads(response.data.decode('utf-8'))['results']
+    assert [r['status'] for r in results] == [201, 200]
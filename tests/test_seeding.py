@@ -0,0 +1,79 @@
+import json
+from base64 import b64encode
+
+from bucky_api import db
+from bucky_api.common import status
+from bucky_api.common.seeding import seed
+from bucky_api.models import BucketList, Task, User
+
+BUCKETLIST_ENDPOINT = '/api/v1.0/bucketlists/'
+
+
+# TEST HELPERS
+def get_api_headers(username, password):
+    """Helper function for creating request headers with http authentication"""
+    return {
+        'Authorization': 'Basic ' + b64encode(
+            (username + ':' + password).encode('utf-8')).decode('utf-8'),
+        'Accept': 'application/json',
+        'Content-Type': 'application/json'
+    }
+
+
+def snapshot():
+    """Helper function listing the seeded bucket-list names and task
+    descriptions"""
+    return ([b.name for b in BucketList.query.order_by(BucketList.id)],
+            [t.description for t in Task.query.order_by(Task.id)])
+
+
+def test__seed_inserts_the_requested_rows__succeeds(client):
+    """Make sure every user gets its bucket-lists and their tasks"""
+    assert seed(3, 4, 5, 'passy', batch_size=7) == (3, 12, 60)
+    assert User.query.count() == 3
+    assert BucketList.query.count() == 12
+    assert Task.query.count() == 60
+    user = User.query.first()
+    assert user.bucketlist_count == 4
+    assert user.bucketlists.first().task_count == 5
+    assert user.tasks.count() == 20
+
+
+def test__seed_is_deterministic__succeeds(client):
+    """Make sure a seed produces the same data whatever the batch size"""
+    seed(2, 3, 2, 'passy', seed=7, batch_size=1)
+    first = snapshot()
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    seed(2, 3, 2, 'passy', seed=7, batch_size=1000)
+    assert snapshot() == first
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    seed(2, 3, 2, 'passy', seed=8)
+    assert snapshot() != first
+
+
+def test__seed_appends_after_existing_rows__succeeds(client):
+    """Make sure seeding twice adds new users instead of failing"""
+    seed(2, 2, 2, 'passy')
+    seed(2, 2, 2, 'passy')
+    assert User.query.count() == 4
+    assert Task.query.count() == 16
+
+
+def test__seeded_users_can_use_the_api__succeeds(client):
+    """Make sure seeded users log in and find their bucket-lists"""
+    seed(1, 3, 1, 'passy')
+    db.session.remove()
+    username = User.query.one().username
+    name = BucketList.query.first().name
+    response = client.get(BUCKETLIST_ENDPOINT + 'search/' + name,
+                          headers=get_api_headers(username, 'passy'))
+    assert response.status_code == status.HTTP_200_OK
+    assert name in response.get_data(as_text=True)
+    response = client.post(BUCKETLIST_ENDPOINT,
+                           headers=get_api_headers(username, 'passy'),
+                           data=json.dumps({'name': 'brand new'}))
+    assert response.status_code == status.HTTP_201_CREATED
@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+import pytest
+
+from bucky_api.common.serializers import compile_schema
+from bucky_api.models import BucketListSchema, TaskSchema, UserSchema
+
+
+def make_bucketlist(id, name, task_count=0, tasks=()):
+    """Helper function building an object shaped like a bucket-list"""
+    return SimpleNamespace(
+        id=id, name=name, task_count=task_count,
+        task_list=[SimpleNamespace(id=t, description='task {}'.format(t))
+                   for t in tasks])
+
+
+SCHEMAS = [BucketListSchema(), BucketListSchema(many=True),
+           BucketListSchema(only=('id', 'name')),
+           BucketListSchema(only=('name', 'tasks'), many=True),
+           TaskSchema(), UserSchema()]
+
+
+@pytest.mark.parametrize('schema', SCHEMAS)
+def test__compiled_dump_matches_marshmallow__succeeds(schema):
+    """Make sure compiled dumps produce marshmallow's exact output"""
+    compiled = compile_schema(schema)
+    assert compiled._dump is not None
+    objects = [make_bucketlist(1, 'buck', 2, tasks=(1, 2)),
+               make_bucketlist(2, None),
+               {'id': 3, 'name': 'from dict', 'username': 'arny',
+                'description': 'a task', 'password': 'secret'},
+               SimpleNamespace(id='4', name=5, username=b'arny',
+                               description=None),
+               SimpleNamespace()]
+    if schema.many:
+        objects = [objects[:2], objects[2:], []]
+    for obj in objects:
+        assert compiled.dump(obj) == schema.dump(obj)
+
+
+@pytest.mark.parametrize('schema', [BucketListSchema(), TaskSchema(),
+                                    UserSchema()])
+def test__compiled_load_matches_marshmallow__succeeds(schema):
+    """Make sure compiled loads produce marshmallow's exact data and
+    validation errors"""
+    compiled = compile_schema(schema)
+    assert compiled._load is not None
+    inputs = [{'id': 3, 'name': 'buck', 'description': 'a task',
+               'username': 'arny', 'password': 'passy', 'tasks': []},
+              {'some_field': 'a bucket'},
+              {'name': None, 'description': 7, 'username': ['arny'],
+               'password': 1.5},
+              {}, [], 'junk', None]
+    for data in inputs:
+        assert compiled.load(data) == schema.load(data)
+    assert (compiled.load(inputs[:3], many=True) ==
+            schema.load(inputs[:3], many=True))
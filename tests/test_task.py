@@ -258,3 +258,204 @@ def test__delete_non_existent_task__fails(client_with_user_n_bkt_n_task):
                        ))
     assert response.status_code == status.HTTP_404_NOT_FOUND
     assert b'Task does not exist' in response.data
+
+
+# TASK PAGINATION
+def get_tasks(client, bucket_id, **query_string):
+    """Helper function fetching a page of tasks of a bucket-list"""
+    response = client.get(BUCKETLIST_ENDPOINT + str(bucket_id) + '/tasks/',
+                          headers=get_api_headers('arny', 'passy'),
+                          query_string=query_string)
+    return response, json.loads(response.data.decode('utf-8'))
+
+
+def create_tasks(bucket, descriptions):
+    """Helper function adding tasks to a bucket-list"""
+    bucket.task_count += len(descriptions)
+    db.session.add_all([Task(description=description, bucketlist=bucket,
+                             user_id=bucket.user_id)
+                        for description in descriptions])
+    db.session.commit()
+
+
+def test__get_tasks_with_cursor__succeeds(client_with_user_n_bkt):
+    """Make sure tasks can be walked page by page in both sort orders"""
+    bucket = BucketList.query.first()  # BucketList <buck>
+    create_tasks(bucket, ['task {}'.format(i) for i in range(5)])
+
+    for sort, expected in (('id', ['task 0', 'task 1', 'task 2',
+                                   'task 3', 'task 4']),
+                           ('-id', ['task 4', 'task 3', 'task 2',
+                                    'task 1', 'task 0'])):
+        response, data = get_tasks(client_with_user_n_bkt, bucket.id,
+                                   limit=2, sort=sort)
+        assert response.status_code == status.HTTP_200_OK
+        assert data['count'] == 5 and data['prev'] is None
+        seen = [t['description'] for t in data['tasks']]
+        while data['next']:
+            response = client_with_user_n_bkt.get(
+                data['next'], headers=get_api_headers('arny', 'passy'))
+            data = json.loads(response.data.decode('utf-8'))
+            assert len(data['tasks']) <= 2
+            seen += [t['description'] for t in data['tasks']]
+        assert seen == expected
+
+        response = client_with_user_n_bkt.get(
+            data['prev'], headers=get_api_headers('arny', 'passy'))
+        data = json.loads(response.data.decode('utf-8'))
+        assert [t['description'] for t in data['tasks']] == expected[2:4]
+
+
+def test__get_tasks_page_size_is_capped__succeeds(client_with_user_n_bkt,
+                                                  app):
+    """Make sure clients cannot ask for more than the max page size"""
+    app.config['TASKS_MAX_PER_PAGE'] = 3
+    bucket = BucketList.query.first()  # BucketList <buck>
+    create_tasks(bucket, ['task {}'.format(i) for i in range(5)])
+    response, data = get_tasks(client_with_user_n_bkt, bucket.id, limit=1000)
+    assert len(data['tasks']) == 3
+    assert data['next'] is not None
+
+
+def test__get_tasks_with_filter__succeeds(client_with_user_n_bkt):
+    """Make sure q= keeps only tasks whose description contains it"""
+    bucket = BucketList.query.first()  # BucketList <buck>
+    create_tasks(bucket, ['go fishing', 'go hiking', 'swim', '100% done'])
+    response, data = get_tasks(client_with_user_n_bkt, bucket.id, q='go ')
+    assert [t['description'] for t in data['tasks']] == ['go fishing',
+                                                         'go hiking']
+    assert data['count'] is None
+    response, data = get_tasks(client_with_user_n_bkt, bucket.id, q='0%')
+    assert [t['description'] for t in data['tasks']] == ['100% done']
+
+    response, data = get_tasks(client_with_user_n_bkt, bucket.id, q='run')
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert data['message'] == 'No tasks found'
+
+
+def test__get_tasks_with_bad_arguments__fails(client_with_user_n_bkt):
+    """Make sure unknown sort orders and missing bucket-lists are
+    rejected"""
+    bucket = BucketList.query.first()  # BucketList <buck>
+    response, data = get_tasks(client_with_user_n_bkt, bucket.id,
+                               sort='description')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response, data = get_tasks(client_with_user_n_bkt, bucket.id + 1)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert data['message'] == 'This bucket-list does not exist'
+
+
+def test__get_tasks_uses_one_query__succeeds(client_with_user_n_bkt,
+                                             statements):
+    """Make sure the ownership check and the tasks come from one query"""
+    bucket = BucketList.query.first()  # BucketList <buck>
+    create_tasks(bucket, ['task'])
+    del statements[:]
+    response, data = get_tasks(client_with_user_n_bkt, bucket.id)
+    assert response.status_code == status.HTTP_200_OK
+    assert len([s for s in statements if 'tasks' in s]) == 1
+
+
+# BULK TASK CREATION
+def post_tasks(client, bucket_id, items):
+    """Helper function posting an array of tasks to a bucket-list"""
+    response = client.post(BUCKETLIST_ENDPOINT + str(bucket_id) + '/tasks/',
+                           headers=get_api_headers('arny', 'passy'),
+                           data=json.dumps(items))
+    return response, json.loads(response.data.decode('utf-8'))
+
+
+def test__create_many_tasks__succeeds(client_with_user_n_bkt, app,
+                                      statements):
+    """Make sure an array of tasks is created with chunked multi-row
+    inserts in one transaction"""
+    app.config['BULK_CHUNK_SIZE'] = 100
+    bucket = BucketList.query.first()  # BucketList <buck>
+    items = [{'description': 'task {}'.format(i)} for i in range(250)]
+    del statements[:]
+    response, data = post_tasks(client_with_user_n_bkt, bucket.id, items)
+    assert response.status_code == status.HTTP_201_CREATED
+    assert [r['status'] for r in data['results']] == [201] * 250
+    assert [r['task']['description'] for r in data['results']] == [
+        item['description'] for item in items]
+    inserts = [s for s in statements if s.startswith('INSERT INTO tasks')]
+    assert len(inserts) == 3
+
+    tasks = Task.query.filter_by(bucketlist_id=bucket.id).order_by(Task.id)
+    assert [(t.id, t.description) for t in tasks] == [
+        (r['task']['id'], r['task']['description']) for r in data['results']]
+    assert BucketList.query.first().task_count == 250
+
+
+def test__create_many_tasks_with_bad_items__succeeds(
+        client_with_user_n_bkt_n_task):
+    """Make sure duplicate and invalid items are reported per item while
+    the rest are created"""
+    bucket = BucketList.query.first()  # BucketList <buck>
+    items = [{'description': 'new'}, {'description': 'tasky'},
+             {'description': 'new'}, {}, 'junk', {'description': 'other'}]
+    response, data = post_tasks(client_with_user_n_bkt_n_task, bucket.id,
+                                items)
+    assert response.status_code == status.HTTP_207_MULTI_STATUS
+    assert [r['status'] for r in data['results']] == [201, 409, 409,
+                                                      422, 422, 201]
+    assert 'description' in data['results'][3]['errors']
+    assert sorted(t.description for t in Task.query) == ['new', 'other',
+                                                         'tasky']
+    assert BucketList.query.first().task_count == 3
+
+
+def test__create_too_many_tasks__fails(client_with_user_n_bkt, app):
+    """Make sure arrays over the bulk limit are rejected"""
+    app.config['BULK_MAX_ITEMS'] = 2
+    bucket = BucketList.query.first()  # BucketList <buck>
+    items = [{'description': str(i)} for i in range(3)]
+    response, data = post_tasks(client_with_user_n_bkt, bucket.id, items)
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    assert Task.query.count() == 0
+
+
+# WRITE STATEMENT COUNTS
+def test__task_writes_statement_counts__succeeds(client_with_user_n_bkt,
+                                                 statements):
+    """Make sure task writes serialize what they wrote without reading
+    it back"""
+    bucket = BucketList.query.first()  # BucketList <buck>
+    url = BUCKETLIST_ENDPOINT + str(bucket.id) + '/tasks/'
+    headers = get_api_headers('arny', 'passy')
+    del statements[:]
+    response = client_with_user_n_bkt.post(
+        url, headers=headers, data=json.dumps({'description': 'tasky'}))
+    assert response.status_code == status.HTTP_201_CREATED
+    task = json.loads(response.data.decode('utf-8'))['task']
+    assert task['description'] == 'tasky'
+    # bucket-list, insert, task counter, data version
+    assert len(statements) == 4
+
+    del statements[:]
+    response = client_with_user_n_bkt.patch(
+        url + str(task['id']), headers=headers,
+        data=json.dumps({'description': 'tasked'}))
+    assert response.status_code == status.HTTP_200_OK
+    assert b'tasked' in response.data
+    # task, update, bucket-list version, data version
+    assert len(statements) == 4
+
+
+# UNIQUENESS
+def test__rename_task_to_existing_description__fails(
+        client_with_user_n_bkt_n_task):
+    """Make sure the unique index turns a clashing rename into a 409"""
+    bucket = BucketList.query.first()  # BucketList <buck>
+    url = BUCKETLIST_ENDPOINT + str(bucket.id) + '/tasks/'
+    headers = get_api_headers('arny', 'passy')
+    response = client_with_user_n_bkt_n_task.post(
+        url, headers=headers, data=json.dumps({'description': 'other'}))
+    task_id = json.loads(response.data.decode('utf-8'))['task']['id']
+    response = client_with_user_n_bkt_n_task.patch(
+        url + str(task_id), headers=headers,
+        data=json.dumps({'description': 'tasky'}))
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert Task.query.get(task_id).description == 'other'
+    assert BucketList.query.first().task_count == 2